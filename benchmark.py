@@ -0,0 +1,335 @@
+"""
+Robot Simulator Benchmarks
+------------------------
+
+This module measures the throughput of the robot simulator's hot paths, so that
+changes to parsing, movement or rotation that regress performance are noticed.
+
+Each scenario builds a deterministic workload, runs it several times and records
+the best time and the resulting commands/sec. Results are emitted as JSON and can
+be compared against a stored baseline, failing when any scenario is slower than
+the baseline by more than a threshold.
+
+The startup scenario instead times whole "python -m robot FILE" processes, each
+running a single command, so its commands/sec is process starts per second.
+--importtime adds the "python -X importtime" cost of each module robot.py imports.
+
+Usage:
+    python benchmark.py                          # print results as JSON
+    python benchmark.py --save baseline.json     # store a new baseline
+    python benchmark.py --baseline baseline.json --threshold 0.1
+    python benchmark.py startup --importtime     # time to first command
+"""
+
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate_commands import DEFAULT_MIX, INVALID_COMMANDS
+from robot import (Direction, Environment, Interface, NullSink, Robot, compile_commands,
+                   open_command_stream, run_stream)
+
+# Processes started by one run of the startup scenario.
+STARTUP_RUNS = 10
+# generate_commands.py's default mix, one entry per unit of weight.
+MIX_CHOICES = [command for command, weight in DEFAULT_MIX.items() for _ in range(weight)]
+
+
+def _new_interface(width=5, height=5):
+    return Interface(robot=Robot(environment=Environment(width, height)), output=NullSink())
+
+
+def _random_place(rng, width=5, height=5):
+    return f"PLACE,{rng.randrange(width)},{rng.randrange(height)},{rng.choice(Direction.NAMES)}"
+
+
+def mixed_workload(size, seed=0):
+    """
+    Build the generate_commands.py style workload: a command then a REPORT.
+
+    Args:
+        size (int): The number of commands.
+        seed (int): The random seed.
+
+    Returns:
+        list: The command lines.
+    """
+    rng = random.Random(seed)
+    commands = [_random_place(rng)]
+    while len(commands) < size:
+        if rng.random() < 0.1:
+            commands.append(rng.choice(INVALID_COMMANDS))
+        else:
+            command = rng.choice(MIX_CHOICES)
+            commands.append(_random_place(rng) if command == "PLACE" else command)
+        commands.append("REPORT")
+    return commands[:size]
+
+
+def weighted_workload(size, weights, seed=0, width=5, height=5):
+    """
+    Build a placed workload drawing commands with the given weights.
+
+    Args:
+        size (int): The number of commands.
+        weights (dict): Relative weight of each command ("PLACE" draws a
+                        random valid PLACE).
+        seed (int): The random seed.
+        width (int): The table width used for PLACE commands.
+        height (int): The table height used for PLACE commands.
+
+    Returns:
+        list: The command lines.
+    """
+    rng = random.Random(seed)
+    drawn = rng.choices(list(weights), weights=list(weights.values()), k=size - 1)
+    return [_random_place(rng, width, height)] + [
+        _random_place(rng, width, height) if command == "PLACE" else command for command in drawn
+    ]
+
+
+def error_workload(size, seed=0):
+    """
+    Build an error-heavy workload from generate_commands.py's invalid commands,
+    starting with a prefix of commands that are illegal before the first PLACE.
+
+    Args:
+        size (int): The number of commands.
+        seed (int): The random seed.
+
+    Returns:
+        list: The command lines.
+    """
+    rng = random.Random(seed)
+    prefix = rng.choices(["MOVE", "LEFT", "RIGHT", "REPORT"], k=size // 4)
+    return prefix + ["PLACE,0,0,NORTH"] + rng.choices(INVALID_COMMANDS, k=size - len(prefix) - 1)
+
+
+def _execute_lines(commands, width=5, height=5):
+    interface = _new_interface(width, height)
+    execute = interface.execute
+    for command in commands:
+        execute(command)
+
+
+def bench_parse(size):
+    """Parse-only cost: compile command lines without executing them."""
+    commands = mixed_workload(size)
+    return lambda: compile_commands(commands)
+
+
+def bench_execute(size):
+    """Execute-only cost: run an already compiled program."""
+    program = compile_commands(mixed_workload(size))
+    return lambda: _new_interface().run_program(program)
+
+
+def bench_replay(size):
+    """End-to-end replay of a command file on disk through run_stream()."""
+    # The directory is removed once the returned closure is garbage collected.
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "commands.txt")
+    with open(path, "w") as f:
+        f.write("\n".join(mixed_workload(size)) + "\n")
+
+    def replay():
+        with open_command_stream(path) as stream:
+            run_stream(_new_interface(), stream)
+
+    replay.directory = directory
+    return replay
+
+
+def bench_report_heavy(size):
+    """Mostly REPORT commands, executed line by line."""
+    commands = weighted_workload(size, {"REPORT": 8, "MOVE": 1, "LEFT": 1})
+    return lambda: _execute_lines(commands)
+
+
+def bench_move_heavy(size):
+    """Mostly MOVE commands, executed line by line."""
+    commands = weighted_workload(size, {"MOVE": 8, "LEFT": 1, "RIGHT": 1, "REPORT": 1})
+    return lambda: _execute_lines(commands)
+
+
+def bench_error_heavy(size):
+    """Illegal commands before PLACE and invalid commands after it."""
+    commands = error_workload(size)
+    return lambda: _execute_lines(commands)
+
+
+def bench_large_table(size):
+    """A 100000x100000 table with long runs of MOVE, streamed through run_stream()."""
+    rng = random.Random(0)
+    commands = [_random_place(rng, 100000, 100000)]
+    while len(commands) < size:
+        commands.extend([rng.choice(["MOVE", "LEFT", "RIGHT", "REPORT"])] * rng.randint(1, 1000))
+    data = "\n".join(commands[:size]).encode()
+    return lambda: run_stream(_new_interface(100000, 100000), io.BytesIO(data))
+
+
+def bench_startup(size):
+    """Start "python -m robot FILE" for a one-command file, STARTUP_RUNS times."""
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "commands.txt")
+    with open(path, "w") as f:
+        f.write("PLACE,0,0,NORTH\n")
+    command = [sys.executable, "-m", "robot", path]
+    cwd = os.path.dirname(os.path.abspath(__file__))
+
+    def startup():
+        for _ in range(STARTUP_RUNS):
+            subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+
+    startup.directory = directory
+    startup.commands = STARTUP_RUNS
+    return startup
+
+
+def import_times():
+    """
+    Measure what importing robot.py costs with "python -X importtime".
+
+    Returns:
+        dict: The cumulative import time in microseconds of every module
+              imported directly while importing robot, plus robot itself.
+    """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import robot"], cwd=cwd,
+                             capture_output=True, text=True, check=True)
+    times, children = {}, {}
+    for line in process.stderr.splitlines():
+        # "import time: self [us] | cumulative | package", where a package is
+        # indented two spaces deeper than the module that imported it and is
+        # listed before it.
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2][1:]
+        depth = len(name) - len(name.lstrip())
+        if depth == 0:
+            if name == "robot":
+                times.update(children)
+                times[name] = int(fields[1])
+            children = {}
+        elif depth == 2:
+            children[name.strip()] = int(fields[1])
+    return times
+
+
+SCENARIOS = {
+    "parse": bench_parse,
+    "execute": bench_execute,
+    "replay": bench_replay,
+    "report_heavy": bench_report_heavy,
+    "move_heavy": bench_move_heavy,
+    "error_heavy": bench_error_heavy,
+    "large_table": bench_large_table,
+    "startup": bench_startup,
+}
+
+
+def run_benchmarks(names=None, size=100000, repeat=3):
+    """
+    Run the selected scenarios.
+
+    Args:
+        names (Iterable[str]): The scenarios to run. Defaults to all of them.
+        size (int): The number of commands per scenario. The startup
+                    scenario always runs STARTUP_RUNS commands.
+        repeat (int): The number of timed runs; the fastest one is kept.
+
+    Returns:
+        dict: The environment and, for each scenario, the command count,
+              best time in seconds and commands/sec.
+    """
+    results = {}
+    for name in names or SCENARIOS:
+        run = SCENARIOS[name](size)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        commands = getattr(run, "commands", size)
+        results[name] = {
+            "commands": commands,
+            "seconds": best,
+            "commands_per_sec": commands / best if best > 0 else float("inf"),
+        }
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline.
+
+    Args:
+        results (dict): The output of run_benchmarks().
+        baseline (dict): A previous output of run_benchmarks().
+        threshold (float): The allowed relative slowdown, e.g. 0.1 for 10%.
+
+    Returns:
+        list: A description of every scenario that regressed.
+    """
+    regressions = []
+    for name, result in results["results"].items():
+        expected = baseline["results"].get(name)
+        if expected is None:
+            continue
+        ratio = result["commands_per_sec"] / expected["commands_per_sec"]
+        if ratio < 1 - threshold:
+            regressions.append(
+                f"{name}: {result['commands_per_sec']:,.0f} commands/sec is "
+                f"{1 - ratio:.1%} slower than the baseline {expected['commands_per_sec']:,.0f}"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Robot Simulator Benchmarks")
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("--size", type=int, default=100000, help="Commands per scenario")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per scenario")
+    parser.add_argument("--save", metavar="PATH", help="Write the results to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="Compare against a stored baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Allowed relative slowdown against the baseline")
+    parser.add_argument("--importtime", action="store_true",
+                        help="Also report the import time of each module robot.py imports")
+
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(args.scenarios, args.size, args.repeat)
+    if args.importtime:
+        results["import_us"] = import_times()
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
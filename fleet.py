@@ -0,0 +1,330 @@
+"""
+Fleet Simulator Module
+------------------------
+
+This module implements a vectorized simulation of many independent robots on the
+same tabletop. The position, heading and placed state of every robot is stored in
+NumPy arrays, and each step applies one opcode per robot to the whole fleet at once.
+
+Every robot behaves exactly like its own Interface: commands other than PLACE are
+ignored until a valid PLACE, moves off the table are refused, and the number of
+error lines each Interface would have printed is tracked per robot.
+
+Requires NumPy.
+
+Classes:
+    Fleet: Stores the state of N robots and applies vectorized command steps.
+
+Functions:
+    encode_commands: Convert command lines into opcode and PLACE operand arrays.
+    encode_streams: Convert one command stream per robot into padded step arrays.
+    load_reports: Memory-map a binary report file as a structured array.
+"""
+
+
+import os
+import struct
+
+import numpy as np
+
+from robot import (OP_ERROR, OP_LEFT, OP_MOVE, OP_PLACE, OP_REPORT, OP_RIGHT, OPCODES,
+                   REPORT_HEADER, REPORT_MAGIC, REPORT_VERSION, SNAPSHOT_HEADER, SNAPSHOT_MAGIC,
+                   SNAPSHOT_RECORD, SNAPSHOT_VERSION, Direction, ObstacleBitmap, write_atomically)
+
+# Padding opcode for robots whose command stream has already ended.
+OP_NOP = 0
+
+_DX = np.array(Direction.DX, dtype=np.int64)
+_DY = np.array(Direction.DY, dtype=np.int64)
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+# The layout of robot.SNAPSHOT_RECORD, so that a fleet is saved and loaded as one array.
+SNAPSHOT_DTYPE = np.dtype([
+    ("x", "<i8"), ("y", "<i8"), ("heading", "u1"), ("placed", "u1"), ("errors", "<u8"),
+    ("history", "u1"), ("history_size", "<u4"), ("history_length", "<u8"),
+])
+
+# The layout of robot.REPORT_RECORD.
+REPORT_DTYPE = np.dtype([("index", "<u8"), ("x", "<i8"), ("y", "<i8"), ("heading", "u1")])
+
+
+def load_reports(path):
+    """
+    Memory-map the records of a binary report file written by robot.ReportSink.
+
+    Nothing is read until the returned array is used, so columns of very
+    large files can be scanned without loading them. A trailing partial
+    record is ignored.
+
+    Args:
+        path (str): The report file.
+
+    Returns:
+        numpy.ndarray: A read-only structured array of REPORT_DTYPE with the
+                       fields index, x, y and heading.
+
+    Raises:
+        ValueError: If the file is not a report file of a supported version.
+    """
+    with open(path, "rb") as file:
+        header = file.read(REPORT_HEADER.size)
+    if len(header) < REPORT_HEADER.size or REPORT_HEADER.unpack(header) != (REPORT_MAGIC, REPORT_VERSION):
+        raise ValueError("Not a supported report file")
+    count = (os.path.getsize(path) - REPORT_HEADER.size) // REPORT_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=REPORT_DTYPE)
+    return np.memmap(path, dtype=REPORT_DTYPE, mode="r", offset=REPORT_HEADER.size, shape=(count,))
+
+
+def encode_commands(commands):
+    """
+    Convert command lines into opcode and PLACE operand arrays.
+
+    Blank lines are skipped. MOVE, LEFT, RIGHT and REPORT are matched on the
+    token before the first comma, so trailing arguments are ignored as in
+    Interface.run_command(). PLACE lines with well-formed arguments become
+    PLACE opcodes (whether the position is on the table is checked when the
+    step runs); any other line that is not a known command becomes an ERROR
+    opcode, since an Interface would always reject it.
+
+    Args:
+        commands (Iterable[str]): The command lines.
+
+    Returns:
+        tuple: Arrays (ops, x, y, heading) of equal length.
+    """
+    ops, xs, ys, headings = [], [], [], []
+    for command in commands:
+        command = command.strip()
+        if not command:
+            continue
+        # Like Interface.run_command(), arguments after other commands are ignored.
+        op, x, y, heading = OPCODES.get(command.partition(",")[0]), 0, 0, 0
+        if op is None:
+            op = OP_ERROR
+            args = command.split(",")
+            if args[0] == "PLACE" and len(args) == 4 and args[3] in Direction.INDEX:
+                try:
+                    x, y = int(args[1]), int(args[2])
+                except ValueError:
+                    pass
+                else:
+                    if _INT64_MIN <= x <= _INT64_MAX and _INT64_MIN <= y <= _INT64_MAX:
+                        op, heading = OP_PLACE, Direction.INDEX[args[3]]
+                    else:
+                        x = y = 0
+        ops.append(op)
+        xs.append(x)
+        ys.append(y)
+        headings.append(heading)
+    return (np.array(ops, dtype=np.uint8), np.array(xs, dtype=np.int64),
+            np.array(ys, dtype=np.int64), np.array(headings, dtype=np.int8))
+
+
+def encode_streams(streams):
+    """
+    Convert one command stream per robot into padded step arrays.
+
+    Args:
+        streams (Sequence[Iterable[str]]): The command lines for each robot.
+
+    Returns:
+        tuple: Arrays (ops, x, y, heading) of shape (steps, robots). Streams
+               shorter than the longest one are padded with OP_NOP.
+    """
+    encoded = [encode_commands(stream) for stream in streams]
+    steps = max((len(ops) for ops, _, _, _ in encoded), default=0)
+    ops = np.full((steps, len(encoded)), OP_NOP, dtype=np.uint8)
+    xs = np.zeros((steps, len(encoded)), dtype=np.int64)
+    ys = np.zeros((steps, len(encoded)), dtype=np.int64)
+    headings = np.zeros((steps, len(encoded)), dtype=np.int8)
+    for i, (robot_ops, robot_x, robot_y, robot_headings) in enumerate(encoded):
+        ops[:len(robot_ops), i] = robot_ops
+        xs[:len(robot_ops), i] = robot_x
+        ys[:len(robot_ops), i] = robot_y
+        headings[:len(robot_ops), i] = robot_headings
+    return ops, xs, ys, headings
+
+
+class Fleet:
+    """
+    A fleet of independent robots sharing one environment.
+
+    Attributes:
+        environment (Environment): The environment every robot moves in.
+        x (numpy.ndarray): The x-coordinate of each robot.
+        y (numpy.ndarray): The y-coordinate of each robot.
+        heading (numpy.ndarray): The heading of each robot as an index into Direction.NAMES.
+        placed (numpy.ndarray): Whether each robot has been placed.
+        errors (numpy.ndarray): The number of error lines each robot's Interface would have printed.
+    """
+
+    def __init__(self, size, environment):
+        """
+        Initialize a fleet of unplaced robots at (0, 0) facing NORTH.
+
+        Args:
+            size (int): The number of robots.
+            environment (Environment): The environment every robot moves in.
+        """
+        self.environment = environment
+        self.x = np.zeros(size, dtype=np.int64)
+        self.y = np.zeros(size, dtype=np.int64)
+        self.heading = np.zeros(size, dtype=np.int8)
+        self.placed = np.zeros(size, dtype=bool)
+        self.errors = np.zeros(size, dtype=np.int64)
+
+        obstacles = environment.obstacles
+        if obstacles is None:
+            self._blocked = None
+        elif isinstance(obstacles, ObstacleBitmap):
+            self._blocked = np.frombuffer(obstacles.bits, dtype=np.uint8)
+        else:
+            self._blocked = np.fromiter(obstacles.cells, dtype=np.int64, count=len(obstacles.cells))
+
+    def __len__(self):
+        return len(self.x)
+
+    def is_valid_position(self, x, y):
+        """
+        Vectorized Environment.is_valid_position.
+
+        Args:
+            x (numpy.ndarray): The x-coordinates.
+            y (numpy.ndarray): The y-coordinates.
+
+        Returns:
+            numpy.ndarray: True where the position is on the table and not blocked.
+        """
+        width = self.environment.width
+        valid = (x >= 0) & (x < width) & (y >= 0) & (y < self.environment.height)
+        if self._blocked is None:
+            return valid
+        index = np.where(valid, y * width + x, 0)
+        if self._blocked.dtype == np.uint8:
+            blocked = (self._blocked.take(index >> 3) >> (index & 7).astype(np.uint8)) & 1
+            return valid & (blocked == 0)
+        return valid & ~np.isin(index, self._blocked)
+
+    def step(self, ops, x=None, y=None, heading=None):
+        """
+        Apply one command to every robot.
+
+        Args:
+            ops (numpy.ndarray): One opcode per robot.
+            x (numpy.ndarray): PLACE x-coordinates, required if any op is PLACE.
+            y (numpy.ndarray): PLACE y-coordinates, required if any op is PLACE.
+            heading (numpy.ndarray): PLACE headings, required if any op is PLACE.
+        """
+        ops = np.asarray(ops, dtype=np.uint8)
+        placed = self.placed
+        # MOVE, LEFT, RIGHT and REPORT are the opcodes 1-4; NOP wraps around to 255.
+        simple = (ops - np.uint8(OP_MOVE)) <= np.uint8(OP_REPORT - OP_MOVE)
+        errors = (simple & ~placed) | (ops == OP_ERROR)
+        active = simple & placed
+
+        turn = (ops == OP_RIGHT).view(np.int8) - (ops == OP_LEFT).view(np.int8)
+        self.heading = (self.heading + turn * active) & 3
+
+        moving = active & (ops == OP_MOVE)
+        if moving.any():
+            new_x = self.x + _DX.take(self.heading) * moving
+            new_y = self.y + _DY.take(self.heading) * moving
+            moved = self.is_valid_position(new_x, new_y)
+            self.x = np.where(moved, new_x, self.x)
+            self.y = np.where(moved, new_y, self.y)
+            errors |= moving & ~moved
+
+        placing = ops == OP_PLACE
+        if placing.any():
+            x = np.asarray(x)
+            y = np.asarray(y)
+            heading = np.asarray(heading)
+            placed_now = placing & self.is_valid_position(x, y)
+            self.x = np.where(placed_now, x, self.x)
+            self.y = np.where(placed_now, y, self.y)
+            self.heading = np.where(placed_now, heading, self.heading).astype(np.int8)
+            self.placed = placed | placed_now
+            errors |= placing & ~placed_now
+
+        self.errors += errors
+
+    def run(self, ops, x=None, y=None, heading=None):
+        """
+        Apply a sequence of steps, as produced by encode_streams().
+
+        Args:
+            ops (numpy.ndarray): Opcodes of shape (steps, robots).
+            x (numpy.ndarray): PLACE x-coordinates of the same shape.
+            y (numpy.ndarray): PLACE y-coordinates of the same shape.
+            heading (numpy.ndarray): PLACE headings of the same shape.
+        """
+        for step in range(len(ops)):
+            if x is None:
+                self.step(ops[step])
+            else:
+                self.step(ops[step], x[step], y[step], heading[step])
+
+    def save_snapshot(self, path, offset=0, commands=0):
+        """
+        Atomically write the state of every robot in robot.py's snapshot format.
+
+        Args:
+            path (str): The snapshot file.
+            offset (int): The byte offset in the input the state corresponds to.
+            commands (int): The number of steps executed so far.
+        """
+        records = np.zeros(len(self), dtype=SNAPSHOT_DTYPE)
+        records["x"] = self.x
+        records["y"] = self.y
+        records["heading"] = self.heading
+        records["placed"] = self.placed
+        records["errors"] = self.errors
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, offset, commands, len(self), b"")
+        write_atomically(path, header + records.tobytes())
+
+    def load_snapshot(self, path):
+        """
+        Restore the state of every robot from a snapshot file, resizing the
+        fleet to the number of records. Command histories are ignored.
+
+        Args:
+            path (str): The snapshot file.
+
+        Returns:
+            tuple: The input byte offset and the number of commands executed.
+
+        Raises:
+            ValueError: If the file is not a snapshot of a supported version.
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        try:
+            magic, version, offset, commands, count, _ = SNAPSHOT_HEADER.unpack_from(data)
+            records = np.frombuffer(data, dtype=SNAPSHOT_DTYPE, count=count, offset=SNAPSHOT_HEADER.size)
+        except (ValueError, struct.error):
+            raise ValueError("Truncated snapshot") from None
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("Not a supported snapshot")
+        self.x = records["x"].astype(np.int64)
+        self.y = records["y"].astype(np.int64)
+        self.heading = records["heading"].astype(np.int8)
+        self.placed = records["placed"].astype(bool)
+        self.errors = records["errors"].astype(np.int64)
+        return offset, commands
+
+    def reports(self):
+        """
+        Return what a REPORT command would print for every robot.
+
+        Returns:
+            list: For each robot, "Report: x,y,DIRECTION", or the error line
+                  its Interface would print if it has not been placed.
+        """
+        names = Direction.NAMES
+        return [
+            f"Report: {x},{y},{names[heading]}" if placed else "Error: Illegal command: REPORT"
+            for x, y, heading, placed in zip(self.x.tolist(), self.y.tolist(),
+                                             self.heading.tolist(), self.placed.tolist())
+        ]
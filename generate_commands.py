@@ -1,102 +1,444 @@
-import random
+import argparse
+import functools
+import hashlib
+import json
 import os
+import random
+
+# List of invalid commands to simulate errors or unexpected input. The last one
+# is only off the table on tables smaller than 1000x1000; see invalid_commands().
+INVALID_COMMANDS = [
+    "JUMP",
+    "PLACE,1,2,3",
+    "PLACE,1,2",
+    "PLACE,1,2,NORTH,EXTRA",
+    "PLACE,999,999,NORTH"
+]
+DIRECTIONS = ["NORTH", "EAST", "SOUTH", "WEST"]
+# Relative weight of each valid command ("PLACE" draws a random PLACE command).
+DEFAULT_MIX = {"PLACE": 1, "MOVE": 2, "LEFT": 1, "RIGHT": 1}
+# Number of commands drawn and written at a time.
+CHUNK_COMMANDS = 1 << 16
+WRITE_BUFFER_SIZE = 1 << 20
+# Tables with at most this many distinct PLACE commands draw them directly.
+PLACE_POOL_LIMIT = 1 << 12
+
+def invalid_commands(width=5, height=5):
+    """
+    Return the invalid commands for a width x height table.
+
+    These are INVALID_COMMANDS, with the out-of-range PLACE command moved off
+    the table when the table is large enough to contain it.
+
+    Parameters:
+        width (int): The width of the table.
+        height (int): The height of the table.
+
+    Returns:
+        list: The invalid command strings.
+    """
+    return INVALID_COMMANDS[:-1] + [f"PLACE,{max(999, width)},{max(999, height)},NORTH"]
 
-def generate_place_command():
+def generate_place_command(rng=random, width=5, height=5):
     """
     Generate a random PLACE command for the robot simulation.
 
-    This function randomly selects x and y coordinates (between 0 and 4, inclusive)
-    and a random direction from the available choices ("NORTH", "EAST", "SOUTH", "WEST").
+    This function randomly selects x and y coordinates on a width x height table
+    (between 0 and 4, inclusive, by default) and a random direction from the
+    available choices ("NORTH", "EAST", "SOUTH", "WEST").
     It then returns a command string in the format 'PLACE,x,y,direction'.
 
+    Parameters:
+        rng (random.Random): The random number generator to draw from.
+        width (int): The width of the table.
+        height (int): The height of the table.
+
     Returns:
         str: A string representing the PLACE command.
     """
-    x = random.randint(0, 4)
-    y = random.randint(0, 4)
-    direction = random.choice(["NORTH", "EAST", "SOUTH", "WEST"])
+    x = rng.randrange(width)
+    y = rng.randrange(height)
+    direction = rng.choice(DIRECTIONS)
     return f"PLACE,{x},{y},{direction}"
 
-def generate_command_file(filename, num_commands, place_first):
+def generate_place_commands(rng, count, width=5, height=5):
+    """
+    Generate count random PLACE commands at once.
+
+    Parameters:
+        rng (random.Random): The random number generator to draw from.
+        count (int): The number of commands.
+        width (int): The width of the table.
+        height (int): The height of the table.
+
+    Returns:
+        list: The PLACE command strings.
+    """
+    xs = rng.choices(range(width), k=count)
+    ys = rng.choices(range(height), k=count)
+    directions = rng.choices(DIRECTIONS, k=count)
+    return [f"PLACE,{x},{y},{direction}" for x, y, direction in zip(xs, ys, directions)]
+
+def generate_command_chunks(num_commands, rng, mix=None, width=5, height=5, invalid_rate=0.1,
+                            place_first=True, chunk_commands=CHUNK_COMMANDS):
+    """
+    Generate commands in large chunks of text, each command followed by a REPORT.
+
+    Commands are drawn in bulk: each chunk picks all of its commands with one
+    weighted draw, then fills in the PLACE coordinates with another.
+
+    Parameters:
+        num_commands (int): The number of command iterations.
+        rng (random.Random): The random number generator to draw from.
+        mix (dict): Relative weight of each valid command ("PLACE" draws a random
+                    PLACE command). Defaults to DEFAULT_MIX.
+        width (int): The width of the table used for PLACE commands.
+        height (int): The height of the table used for PLACE commands.
+        invalid_rate (float): The probability of drawing one of invalid_commands() instead.
+        place_first (bool): If True, start with a valid PLACE command followed by a REPORT.
+        chunk_commands (int): The number of commands per chunk.
+
+    Yields:
+        str: The lines of one chunk, newline-terminated.
+
+    Raises:
+        ValueError: If invalid_rate is not between 0 and 1.
+    """
+    if not 0 <= invalid_rate <= 1:
+        raise ValueError(f"invalid_rate must be between 0 and 1, not {invalid_rate}")
+    mix = DEFAULT_MIX if mix is None else mix
+    invalid = invalid_commands(width, height)
+    valid_total = sum(mix.values())
+    choices = list(mix) + invalid
+    weights = [(1 - invalid_rate) * weight / valid_total for weight in mix.values()]
+    weights += [invalid_rate / len(invalid)] * len(invalid)
+
+    # On small tables every PLACE command is a choice of its own, so a chunk
+    # takes a single draw and needs no second pass to fill in coordinates.
+    expand_places = "PLACE" in mix and width * height * len(DIRECTIONS) <= PLACE_POOL_LIMIT
+    if expand_places:
+        index = choices.index("PLACE")
+        place_weight = weights.pop(index)
+        del choices[index]
+        pool = [f"PLACE,{x},{y},{direction}"
+                for x in range(width) for y in range(height) for direction in DIRECTIONS]
+        choices += pool
+        weights += [place_weight / len(pool)] * len(pool)
+
+    if place_first:
+        yield generate_place_commands(rng, 1, width, height)[0] + "\nREPORT\n"
+
+    for start in range(0, num_commands, chunk_commands):
+        commands = rng.choices(choices, weights=weights, k=min(chunk_commands, num_commands - start))
+        places = 0 if expand_places else commands.count("PLACE")
+        if places:
+            placed = iter(generate_place_commands(rng, places, width, height))
+            commands = [next(placed) if command == "PLACE" else command for command in commands]
+        yield "\nREPORT\n".join(commands) + "\nREPORT\n"
+
+class ReferenceModel:
+    """
+    A minimal, independent model of robot.py's command semantics, used to compute
+    the expected output of generated files without running the simulator.
+
+    The model consumes command lines and keeps the robot state together with
+    rolling SHA-256 digests of the full transcript (exactly what robot.py prints)
+    and of the REPORT lines alone.
+
+    Attributes:
+        width (int): The width of the table.
+        height (int): The height of the table.
+        x, y (int): The robot's position.
+        heading (int): The robot's facing direction as an index into DIRECTIONS.
+        placed (bool): Whether a valid PLACE command has been executed.
+        commands (int): The number of commands consumed.
+        errors (int): The number of error lines printed.
+        reports (int): The number of REPORT lines printed.
+        last_output (str): The last line printed.
+    """
+
+    STEPS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+    HEADINGS = {direction: heading for heading, direction in enumerate(DIRECTIONS)}
+
+    def __init__(self, width=5, height=5):
+        """
+        Initialize the model with an unplaced robot.
+
+        Parameters:
+            width (int): The width of the table.
+            height (int): The height of the table.
+        """
+        self.width = width
+        self.height = height
+        self.x = self.y = self.heading = 0
+        self.placed = False
+        self.commands = self.errors = self.reports = 0
+        self.last_output = None
+        self._transcript = hashlib.sha256()
+        self._report_digest = hashlib.sha256()
+
+    def run(self, lines):
+        """
+        Consume command lines. Blank lines are skipped and surrounding whitespace
+        is stripped, as in robot.py.
+
+        Parameters:
+            lines (Iterable[str]): The command lines.
+        """
+        width, height, steps, headings = self.width, self.height, self.STEPS, self.HEADINGS
+        x, y, heading, placed = self.x, self.y, self.heading, self.placed
+        output = []
+        reports = []
+        errors = 0
+        commands = 0
+        for line in lines:
+            command = line.strip()
+            if not command:
+                continue
+            commands += 1
+            output.append(command)
+            token, _, arguments = command.partition(",")
+            error = None
+            if token == "PLACE":
+                args = arguments.split(",")
+                new_heading = headings.get(args[2]) if len(args) == 3 else None
+                try:
+                    new_x, new_y = int(args[0]), int(args[1])
+                except (ValueError, IndexError):
+                    new_heading = None
+                if new_heading is not None and 0 <= new_x < width and 0 <= new_y < height:
+                    x, y, heading, placed = new_x, new_y, new_heading, True
+                else:
+                    error = "Invalid type of arguments: "
+            elif not placed:
+                error = "Illegal command: "
+            elif token == "MOVE":
+                dx, dy = steps[heading]
+                if 0 <= x + dx < width and 0 <= y + dy < height:
+                    x += dx
+                    y += dy
+                else:
+                    error = "Failed to execute: "
+            elif token == "LEFT":
+                heading = (heading - 1) % 4
+            elif token == "RIGHT":
+                heading = (heading + 1) % 4
+            elif token == "REPORT":
+                report = f"Report: {x},{y},{DIRECTIONS[heading]}"
+                output.append(report)
+                reports.append(report)
+            else:
+                error = "Invalid command: "
+            if error is not None:
+                output.append(f"Error: {error}{command}")
+                errors += 1
+
+        self.x, self.y, self.heading, self.placed = x, y, heading, placed
+        self.commands += commands
+        self.errors += errors
+        self.reports += len(reports)
+        if output:
+            self.last_output = output[-1]
+            output.append("")
+            self._transcript.update("\n".join(output).encode())
+        if reports:
+            reports.append("")
+            self._report_digest.update("\n".join(reports).encode())
+
+    def oracle(self):
+        """
+        Summarize the expected outcome of the commands consumed so far.
+
+        Returns:
+            dict: The command, error and report counts, the last line of output,
+                  the final state and the SHA-256 digests of the full transcript
+                  and of the REPORT lines.
+        """
+        return {
+            "commands": self.commands,
+            "errors": self.errors,
+            "reports": self.reports,
+            "last_output": self.last_output,
+            "state": {"x": self.x, "y": self.y, "f": DIRECTIONS[self.heading], "placed": self.placed},
+            "width": self.width,
+            "height": self.height,
+            "transcript_sha256": self._transcript.hexdigest(),
+            "report_sha256": self._report_digest.hexdigest(),
+        }
+
+def oracle_path(filename):
+    """
+    Return the path of the oracle file written next to a command file.
+
+    Parameters:
+        filename (str): The path of the command file, e.g. "commands_1.txt".
+
+    Returns:
+        str: The oracle path, e.g. "commands_1_oracle.json".
+    """
+    return os.path.splitext(filename)[0] + "_oracle.json"
+
+def write_oracle(filename, width=5, height=5):
+    """
+    Compute and write the oracle of an existing command file.
+
+    Parameters:
+        filename (str): The path of the command file.
+        width (int): The width of the table.
+        height (int): The height of the table.
+
+    Returns:
+        dict: The oracle, as returned by ReferenceModel.oracle().
+    """
+    model = ReferenceModel(width, height)
+    with open(filename, buffering=WRITE_BUFFER_SIZE) as file:
+        while True:
+            lines = file.readlines(WRITE_BUFFER_SIZE)
+            if not lines:
+                break
+            model.run(lines)
+    return _save_oracle(filename, model.oracle())
+
+def _save_oracle(filename, oracle):
+    with open(oracle_path(filename), 'w') as file:
+        json.dump(oracle, file, indent=2)
+        file.write("\n")
+    return oracle
+
+def generate_command_file(filename, num_commands, place_first, seed=None, oracle=False, **options):
     """
     Generate a command file with a mix of valid and invalid commands.
 
     This function writes a series of robot simulation commands to a file.
     Commands are written one per line, and after each command a REPORT command is added
-    to output the robot's state after executing that command.
-    
+    to output the robot's state after executing that command. Commands are drawn and
+    written in large chunks (see generate_command_chunks()).
+
     Parameters:
         filename (str): The path of the file to write commands.
         num_commands (int): The number of command iterations (each iteration produces one command and one REPORT).
         place_first (bool): If True, the file starts with an initial valid PLACE command followed by a REPORT.
-    
-    The function uses:
-        - A list of valid commands: "PLACE", "MOVE", "MOVE", "LEFT", "RIGHT"
-        - A list of invalid commands to simulate error scenarios.
+        seed: Seed for reproducible output. Defaults to a random seed.
+        oracle (bool): If True, also write the expected outcome computed by a
+                       ReferenceModel to oracle_path(filename).
+        **options: mix, width, height and invalid_rate, as for generate_command_chunks().
+
+    By default, the function uses:
+        - The valid commands of DEFAULT_MIX: PLACE, MOVE (twice as often), LEFT and RIGHT.
+        - The invalid commands of invalid_commands() to simulate error scenarios.
         - A 10% chance to use an invalid command instead of a valid one.
+
+    Returns:
+        str: The path of the written file.
     """
-    # List of valid commands for simulation
-    commands = ["PLACE", "MOVE", "MOVE", "LEFT", "RIGHT"]
-    # List of invalid commands to simulate errors or unexpected input
-    invalid_commands = [
-        "JUMP",
-        "PLACE,1,2,3",
-        "PLACE,1,2",
-        "PLACE,1,2,NORTH,EXTRA",
-        "PLACE,999,999,NORTH"
-    ]
-
-    with open(filename, 'w') as file:
-        # Optionally, write an initial valid PLACE command followed by a REPORT.
-        if place_first:
-            file.write(generate_place_command() + "\n")
-            file.write("REPORT\n")
-        
-        for _ in range(num_commands):
-            # Determine whether to use an invalid command (10% chance) or a valid command.
-            if random.random() < 0.1:  
-                command = random.choice(invalid_commands)
-            else:
-                command = random.choice(commands)
-                # If the command is PLACE, generate a complete random PLACE command.
-                if command == "PLACE":
-                    command = generate_place_command()
-            
-            # Write the selected command and a subsequent REPORT to the file.
-            file.write(f"{command}\n")
-            file.write("REPORT\n")
+    rng = random.Random(seed)
+    model = ReferenceModel(options.get("width", 5), options.get("height", 5)) if oracle else None
+    with open(filename, 'w', buffering=WRITE_BUFFER_SIZE) as file:
+        for chunk in generate_command_chunks(num_commands, rng, place_first=place_first, **options):
+            file.write(chunk)
+            if model is not None:
+                model.run(chunk.splitlines())
+    if model is not None:
+        _save_oracle(filename, model.oracle())
+    return filename
+
+def _generate_command_file(filename, seed, num_commands, place_first, oracle, options):
+    return generate_command_file(filename, num_commands, place_first, seed=seed, oracle=oracle, **options)
 
-def generate_command_files(num_files, num_commands_per_file, place_first):
+def generate_command_files(num_files, num_commands_per_file, place_first, directory="random_commands",
+                           seed=None, jobs=None, oracle=False, **options):
     """
     Generate multiple command files for testing the robot simulation.
 
     This function creates a specified number of files in a folder named "random_commands".
-    Each file contains a series of commands generated by 'generate_command_file'.
-    
+    Each file contains a series of commands generated by 'generate_command_file'. Files
+    are generated in parallel worker processes.
+
     Parameters:
         num_files (int): The number of files to generate.
         num_commands_per_file (int): The number of command iterations per file.
         place_first (bool): If True, each file will start with an initial PLACE command and REPORT.
+        directory (str): The folder to write the files to.
+        seed (int): Seed for reproducible output. Each file gets its own seed derived from it.
+        jobs (int): Number of worker processes. Defaults to the CPU count.
+        oracle (bool): If True, write an oracle file next to each command file.
+        **options: mix, width, height and invalid_rate, as for generate_command_chunks().
     """
-    for i in range(num_files):
-        filename = f"random_commands/commands_{i+1}.txt"
-        generate_command_file(filename, num_commands_per_file, place_first)
-        print(f"Generated {filename}")
+    filenames = [os.path.join(directory, f"commands_{i+1}.txt") for i in range(num_files)]
+    seeds = [None if seed is None else f"{seed}:{i}" for i in range(num_files)]
+    generate = functools.partial(_generate_command_file, num_commands=num_commands_per_file,
+                                 place_first=place_first, oracle=oracle, options=options)
+    if jobs == 1 or num_files == 1:
+        for filename in map(generate, filenames, seeds):
+            print(f"Generated {filename}")
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for filename in executor.map(generate, filenames, seeds):
+            print(f"Generated {filename}")
+
+def parse_mix(text):
+    """
+    Parse a command mix such as "MOVE=2,LEFT=1,RIGHT=1,PLACE=1".
+
+    Parameters:
+        text (str): Comma separated COMMAND=WEIGHT pairs.
+
+    Returns:
+        dict: The weight of each command.
+
+    Raises:
+        argparse.ArgumentTypeError: If the mix is malformed.
+    """
+    mix = {}
+    for part in text.split(","):
+        command, _, weight = part.partition("=")
+        command = command.strip().upper()
+        if command not in DEFAULT_MIX and command != "REPORT":
+            raise argparse.ArgumentTypeError(f"unknown command in mix: {command}")
+        try:
+            mix[command] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for {command}: {weight!r}") from None
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return mix
 
 if __name__ == "__main__":
     """
     Main execution block for generating command files.
 
     This block ensures that the output directory exists and then generates a set
-    of command files based on predefined configuration parameters.
+    of command files. The defaults match the original configuration: 10 files of
+    20 commands each, on a 5x5 table, starting with a PLACE command.
     """
+    parser = argparse.ArgumentParser(description="Generate random robot command files")
+    parser.add_argument("--files", type=int, default=10, help="Number of files to generate")
+    parser.add_argument("--commands", type=int, default=20, help="Commands per file")
+    parser.add_argument("--directory", default="random_commands", help="Output directory")
+    parser.add_argument("--no-place-first", dest="place_first", action="store_false",
+                        help="Do not start each file with a valid PLACE command")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible output")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="Relative command weights, e.g. MOVE=2,LEFT=1,RIGHT=1,PLACE=1")
+    parser.add_argument("--invalid-rate", type=float, default=0.1,
+                        help="Probability of an invalid command")
+    parser.add_argument("--width", type=int, default=5, help="Width of the table for PLACE commands")
+    parser.add_argument("--height", type=int, default=5, help="Height of the table for PLACE commands")
+    parser.add_argument("--oracle", action="store_true",
+                        help="Write the expected outcome of each file to <name>_oracle.json")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+    if not 0 <= args.invalid_rate <= 1:
+        parser.error("--invalid-rate must be between 0 and 1")
+
     # Create the output directory if it doesn't exist.
-    os.makedirs("random_commands", exist_ok=True)
-    
-    # Configuration: number of files to generate, number of commands per file, and whether to include an initial PLACE command.
-    files = 10
-    commands_per_file = 20
-    place_first = True
+    os.makedirs(args.directory, exist_ok=True)
 
     # Generate the command files.
-    generate_command_files(files, commands_per_file, place_first)
+    generate_command_files(args.files, args.commands, args.place_first, directory=args.directory,
+                           seed=args.seed, jobs=args.jobs, oracle=args.oracle, mix=args.mix,
+                           width=args.width, height=args.height, invalid_rate=args.invalid_rate)
@@ -9,32 +9,62 @@ allowed to move off the table.
 
 Classes:
     Direction: Defines the four cardinal directions and provides methods for rotation.
+    ObstacleBitmap, ObstacleSet: Dense and sparse maps of blocked cells.
     Environment: Represents the tabletop and provides a method to check valid positions.
     Position: Stores the coordinates of the robot.
+    StdoutSink, BufferedSink, CollectingSink, DigestSink, NullSink: Output sinks
+        for echoed commands, errors and reports.
+    ReportSink: Output sink that writes reports as binary records.
     Robot: Implements the robot's behavior, including placement, movement, rotation, and reporting.
+    Status: The outcome of executing a command without raising.
+    CommandStats: Per-command counters and latency histograms.
     Interface: Provides a command parser and executor to interact with the robot.
+    InstrumentedInterface: An Interface that records CommandStats.
+    TrajectoryCache: LRU cache of the effect of command blocks by start state.
+    Program: A command file compiled into a compact opcode array.
 """
 
 
-import argparse
+import array
+import collections
+import enum
+import itertools
+import os
+import struct
 import sys
+import time
 
 
 class Direction:
     """
     Represents the cardinal directions for the robot's orientation.
 
+    Headings are handled internally as integers 0-3 in clockwise order, which
+    index into NAMES, DX and DY. The string names are only used when parsing
+    commands and formatting reports.
+
     Attributes:
         NORTH (str): Represents the north direction.
         EAST (str): Represents the east direction.
         SOUTH (str): Represents the south direction.
         WEST (str): Represents the west direction.
+        NAMES (tuple): Direction names indexed by heading.
+        INDEX (dict): Heading for each direction name.
+        DX (tuple): Change in x for one step in each heading.
+        DY (tuple): Change in y for one step in each heading.
+        TURNS (dict): Change in heading for each rotation command.
     """
     NORTH = 'NORTH'
     EAST = 'EAST'
     SOUTH = 'SOUTH'
     WEST = 'WEST'
 
+    NAMES = (NORTH, EAST, SOUTH, WEST)
+    INDEX = {name: heading for heading, name in enumerate(NAMES)}
+    DX = (0, 1, 0, -1)
+    DY = (1, 0, -1, 0)
+    TURNS = {"LEFT": -1, "RIGHT": 1}
+
     @staticmethod
     def is_valid_direction(direction):
         """
@@ -46,9 +76,8 @@ class Direction:
         Returns:
             bool: True if the direction is one of NORTH, EAST, SOUTH, or WEST.
         """
-        return direction in [Direction.NORTH, Direction.EAST, Direction.SOUTH, Direction.WEST]
+        return direction in Direction.INDEX
 
-    # TODO: Refactor implementation
     @staticmethod
     def rotate_left(direction):
         """
@@ -58,16 +87,13 @@ class Direction:
             direction (str): The current direction.
 
         Returns:
-            str: The new direction after a left turn.
+            str: The new direction after a left turn, or None if the
+                 direction is invalid.
         """
-        if direction == Direction.NORTH:
-            return Direction.WEST
-        elif direction == Direction.WEST:
-            return Direction.SOUTH
-        elif direction == Direction.SOUTH:
-            return Direction.EAST
-        elif direction == Direction.EAST:
-            return Direction.NORTH
+        heading = Direction.INDEX.get(direction)
+        if heading is None:
+            return None
+        return Direction.NAMES[(heading - 1) % 4]
 
     @staticmethod
     def rotate_right(direction):
@@ -78,16 +104,219 @@ class Direction:
             direction (str): The current direction.
 
         Returns:
-            str: The new direction after a right turn.
+            str: The new direction after a right turn, or None if the
+                 direction is invalid.
+        """
+        heading = Direction.INDEX.get(direction)
+        if heading is None:
+            return None
+        return Direction.NAMES[(heading + 1) % 4]
+
+
+class ObstacleBitmap:
+    """
+    A dense obstacle map storing one bit per cell of the table.
+
+    Attributes:
+        width (int): The width of the table.
+        height (int): The height of the table.
+        bits (bytearray): The blocked cells, bit (y * width + x) set if blocked.
+    """
+
+    MAGIC = b"ROBM"
+    HEADER = struct.Struct("<4sQQ")
+    COUNT_CHUNK_BYTES = 1 << 20
+
+    def __init__(self, width, height, bits=None):
+        """
+        Initialize an obstacle map.
+
+        Args:
+            width (int): The width of the table.
+            height (int): The height of the table.
+            bits (bytearray): Existing bitmap contents. Defaults to no obstacles.
+        """
+        self.width = width
+        self.height = height
+        self.bits = bits if bits is not None else bytearray((width * height + 7) // 8)
+
+    def add(self, x, y):
+        """
+        Block a cell.
+
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+        """
+        index = y * self.width + x
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+    def is_blocked(self, x, y):
+        """
+        Check if a cell on the table is blocked.
+
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+
+        Returns:
+            bool: True if the cell is blocked.
+        """
+        index = y * self.width + x
+        return self.bits[index >> 3] >> (index & 7) & 1 == 1
+
+    def __len__(self):
+        # Counted in chunks so that large maps are not copied into one int.
+        bits = self.bits
+        chunk = self.COUNT_CHUNK_BYTES
+        return sum(int.from_bytes(bits[start:start + chunk], "little").bit_count()
+                   for start in range(0, len(bits), chunk))
+
+    def save(self, path):
+        """
+        Write the bitmap to a binary obstacle file readable by load_obstacles().
+
+        Args:
+            path (str): The file to write.
+        """
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.width, self.height))
+            file.write(self.bits)
+
+    @classmethod
+    def random(cls, width, height, count, seed=None):
+        """
+        Generate a map with count distinct randomly blocked cells.
+
+        Args:
+            width (int): The width of the table.
+            height (int): The height of the table.
+            count (int): The number of blocked cells, at most width * height.
+            seed (int): The random seed.
+
+        Returns:
+            ObstacleBitmap: The generated map.
+
+        Raises:
+            ValueError: If count is negative or larger than the table.
+        """
+        import random
+
+        if not 0 <= count <= width * height:
+            raise ValueError(f"Cannot place {count} obstacles on a {width}x{height} table")
+        obstacles = cls(width, height)
+        for index in random.Random(seed).sample(range(width * height), count):
+            obstacles.bits[index >> 3] |= 1 << (index & 7)
+        return obstacles
+
+
+class ObstacleSet:
+    """
+    A sparse obstacle map storing only the blocked cells.
+
+    Memory grows with the number of obstacles rather than the table size,
+    which suits large tables with few obstacles.
+
+    Attributes:
+        width (int): The width of the table.
+        height (int): The height of the table.
+        cells (set): The blocked cells, as y * width + x.
+    """
+
+    def __init__(self, width, height, cells=None):
+        """
+        Initialize an obstacle map.
+
+        Args:
+            width (int): The width of the table.
+            height (int): The height of the table.
+            cells (Iterable[int]): Blocked cells as y * width + x.
+        """
+        self.width = width
+        self.height = height
+        self.cells = set(cells) if cells is not None else set()
+
+    def add(self, x, y):
+        """
+        Block a cell.
+
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+        """
+        self.cells.add(y * self.width + x)
+
+    def is_blocked(self, x, y):
+        """
+        Check if a cell on the table is blocked.
+
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+
+        Returns:
+            bool: True if the cell is blocked.
         """
-        if direction == Direction.NORTH:
-            return Direction.EAST
-        elif direction == Direction.EAST:
-            return Direction.SOUTH
-        elif direction == Direction.SOUTH:
-            return Direction.WEST
-        elif direction == Direction.WEST:
-            return Direction.NORTH
+        return y * self.width + x in self.cells
+
+    def __len__(self):
+        return len(self.cells)
+
+
+# Approximate bytes per blocked cell in an ObstacleSet (set slot plus int object).
+_OBSTACLE_SET_CELL_BYTES = 64
+
+
+def load_obstacles(path, width, height):
+    """
+    Load an obstacle map from a file.
+
+    The file is either a binary bitmap written by ObstacleBitmap.save(), or a
+    text file with one blocked cell per line as "x,y" (blank lines and lines
+    starting with "#" are ignored). Text files are loaded into whichever of
+    ObstacleSet and ObstacleBitmap needs less memory.
+
+    Args:
+        path (str): The obstacle file.
+        width (int): The width of the table.
+        height (int): The height of the table.
+
+    Returns:
+        ObstacleBitmap | ObstacleSet: The obstacle map.
+
+    Raises:
+        ValueError: If the file does not match the table size or a cell is
+                    malformed or off the table.
+    """
+    with open(path, "rb") as file:
+        header = file.read(ObstacleBitmap.HEADER.size)
+        if header[:4] == ObstacleBitmap.MAGIC:
+            _, file_width, file_height = ObstacleBitmap.HEADER.unpack(header)
+            if (file_width, file_height) != (width, height):
+                raise ValueError(f"Obstacle map is {file_width}x{file_height}, table is {width}x{height}")
+            bits = bytearray(file.read())
+            if len(bits) != (width * height + 7) // 8:
+                raise ValueError(f"Truncated obstacle map: {path}")
+            return ObstacleBitmap(width, height, bits)
+
+        file.seek(0)
+        cells = set()
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            x, _, y = line.partition(b",")
+            x, y = parse_int(x.decode()), parse_int(y.decode())
+            if x is None or y is None or not (0 <= x < width and 0 <= y < height):
+                raise ValueError(f"Invalid obstacle on line {number} of {path}: {line.decode()}")
+            cells.add(y * width + x)
+
+    if len(cells) * _OBSTACLE_SET_CELL_BYTES < (width * height + 7) // 8:
+        return ObstacleSet(width, height, cells)
+    obstacles = ObstacleBitmap(width, height)
+    for index in cells:
+        obstacles.bits[index >> 3] |= 1 << (index & 7)
+    return obstacles
 
 
 class Environment:
@@ -97,22 +326,28 @@ class Environment:
     Attributes:
         width (int): The width of the table.
         height (int): The height of the table.
+        obstacles (ObstacleBitmap | ObstacleSet | None): The blocked cells, if any.
     """
 
-    def __init__(self, width, height):
+    __slots__ = ("width", "height", "obstacles")
+
+    def __init__(self, width, height, obstacles=None):
         """
         Initialize the environment with given dimensions.
 
         Args:
             width (int): The width of the tabletop.
             height (int): The height of the tabletop.
+            obstacles (ObstacleBitmap | ObstacleSet): Cells the robot may not enter.
         """
         self.width = width
         self.height = height
+        self.obstacles = obstacles
 
     def is_valid_position(self, x, y):
         """
-        Check if a given (x, y) coordinate is within the environment boundaries.
+        Check if a given (x, y) coordinate is within the environment boundaries
+        and not blocked by an obstacle.
 
         Args:
             x (int): The x-coordinate.
@@ -121,7 +356,36 @@ class Environment:
         Returns:
             bool: True if the position is valid, False otherwise.
         """
-        return 0 <= x < self.width and 0 <= y < self.height
+        return (0 <= x < self.width and 0 <= y < self.height
+                and (self.obstacles is None or not self.obstacles.is_blocked(x, y)))
+
+    def free_distance(self, x, y, heading, limit):
+        """
+        Count how many consecutive steps can be taken from a valid position.
+
+        Args:
+            x (int): The starting x-coordinate.
+            y (int): The starting y-coordinate.
+            heading (int): The heading to move in, as an index into Direction.NAMES.
+            limit (int): The maximum number of steps to count.
+
+        Returns:
+            int: The number of steps, at most limit, that stay within the
+                 environment and do not enter an obstacle.
+        """
+        dx = Direction.DX[heading]
+        dy = Direction.DY[heading]
+        if dx:
+            distance = self.width - 1 - x if dx > 0 else x
+        else:
+            distance = self.height - 1 - y if dy > 0 else y
+        distance = max(0, min(limit, distance))
+        if self.obstacles is not None:
+            is_blocked = self.obstacles.is_blocked
+            for step in range(1, distance + 1):
+                if is_blocked(x + dx * step, y + dy * step):
+                    return step - 1
+        return distance
 
 
 class Position:
@@ -133,6 +397,8 @@ class Position:
         y (int): The y-coordinate.
     """
 
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         """
         Initialize a Position with x and y coordinates.
@@ -156,235 +422,2899 @@ class Position:
         self.y = y
 
 
-class Robot:
+def _repeat_in_chunks(block, count):
+    # Yields block * count in pieces of whole blocks, each at most
+    # STREAM_BUFFER_SIZE long unless a single block is longer.
+    if not count:
+        return
+    batch = max(1, STREAM_BUFFER_SIZE // len(block))
+    full, rest = divmod(count, batch)
+    if full:
+        blocks = block * batch
+        for _ in range(full):
+            yield blocks
+    if rest:
+        yield block * rest
+
+
+class StdoutSink:
     """
-    Implements the robot's functionality, including placing, moving, rotating,
-    and reporting its position.
+    Output sink that writes every line straight to the current sys.stdout.
 
-    Attributes:
-        position (Position): The current position of the robot.
-        f (str): The current facing direction.
-        environment (Environment): The environment in which the robot moves.
+    This mirrors the behaviour of print() and is the default sink, so output
+    still follows redirect_stdout().
     """
 
-    def __init__(self, x=0, y=0, f=Direction.NORTH, environment=Environment(5, 5)):
+    def write(self, line):
         """
-        Initialize the Robot with a starting position, direction, and environment.
+        Write a single line of output.
 
-        If the provided position is invalid, defaults to (0, 0).
+        Args:
+            line (str): The line to write, without a trailing newline.
+        """
+        sys.stdout.write(line + "\n")
+
+    def write_repeated(self, lines, count):
+        """
+        Write a group of lines repeated count times, in chunks of at most
+        STREAM_BUFFER_SIZE characters.
 
         Args:
-            x (int): The starting x-coordinate.
-            y (int): The starting y-coordinate.
-            f (str): The initial facing direction.
-            environment (Environment): The simulation environment.
+            lines (tuple): The lines of one repetition.
+            count (int): The number of repetitions.
         """
-        self.f = f
-        self.environment = environment
-        if not self.environment.is_valid_position(x, y):
-            x = 0
-            y = 0
-        self.position = Position(x, y)
+        write = sys.stdout.write
+        for chunk in _repeat_in_chunks("".join(line + "\n" for line in lines), count):
+            write(chunk)
 
-    def place(self, x, y, f):
+    def flush(self):
+        """Flush the underlying stdout stream."""
+        sys.stdout.flush()
+
+
+class BufferedSink:
+    """
+    Output sink that batches lines and writes them to a stream in large chunks.
+
+    Attributes:
+        stream (TextIO): The stream written to on flush.
+        flush_size (int): Number of buffered characters that triggers a flush.
+    """
+
+    def __init__(self, stream=None, flush_size=1 << 16):
         """
-        Place the robot at the specified position and direction if valid.
+        Initialize the sink.
 
         Args:
-            x (int): The x-coordinate to place the robot.
-            y (int): The y-coordinate to place the robot.
-            f (str): The facing direction.
+            stream (TextIO): The stream to write to. Defaults to sys.stdout.
+            flush_size (int): Number of buffered characters that triggers a flush.
+        """
+        self.stream = stream if stream is not None else sys.stdout
+        self.flush_size = flush_size
+        self._parts = []
+        self._size = 0
 
-        Returns:
-            bool: True if placement was successful, False otherwise.
+    def write(self, line):
         """
-        if Direction.is_valid_direction(f) and self.environment.is_valid_position(x, y):
-            self.position = Position(x, y)
-            self.f = f
-            return True
-        return False
+        Buffer a single line of output, flushing once the buffer is full.
 
-    def move(self):
+        Args:
+            line (str): The line to write, without a trailing newline.
         """
-        Move the robot one unit in the direction it is currently facing.
+        self._parts.append(line)
+        self._size += len(line) + 1
+        if self._size >= self.flush_size:
+            self.flush()
 
-        Returns:
-            bool: True if the move is successful, False if the move would
-                  cause the robot to leave the environment.
+    def write_repeated(self, lines, count):
         """
-        new_x = self.position.x
-        new_y = self.position.y
+        Buffer a group of lines repeated count times, flushing whenever the
+        buffer is full so that a long run never exceeds flush_size.
 
-        if self.f == Direction.NORTH:
-            new_y += 1
-        elif self.f == Direction.EAST:
-            new_x += 1
-        elif self.f == Direction.SOUTH:
-            new_y -= 1
-        elif self.f == Direction.WEST:
-            new_x -= 1
+        Args:
+            lines (tuple): The lines of one repetition.
+            count (int): The number of repetitions.
+        """
+        block = "\n".join(lines)
+        size = len(block) + 1
+        while count > 0:
+            batch = min(count, max(1, (self.flush_size - self._size) // size))
+            self._parts.append("\n".join(itertools.repeat(block, batch)))
+            self._size += size * batch
+            count -= batch
+            if self._size >= self.flush_size:
+                self.flush()
+
+    def flush(self):
+        """Write all buffered lines to the stream."""
+        if self._parts:
+            self._parts.append("")
+            self.stream.write("\n".join(self._parts))
+            self._parts = []
+            self._size = 0
+        self.stream.flush()
+
+
+class CollectingSink:
+    """
+    Output sink that keeps every line in memory.
 
-        if self.environment.is_valid_position(new_x, new_y):
-            self.position.update(new_x, new_y)
-            return True
-        return False
+    Attributes:
+        lines (list | collections.deque): The lines written so far.
+    """
 
-    def rotate(self, rotation):
+    def __init__(self, maxlen=None):
         """
-        Rotate the robot 90 degrees based on the specified rotation command.
+        Initialize an empty collector.
 
         Args:
-            rotation (str): Either "LEFT" or "RIGHT".
+            maxlen (int): If given, only the last maxlen lines are kept.
+        """
+        self.lines = [] if maxlen is None else collections.deque(maxlen=maxlen)
 
-        Returns:
-            bool: Always returns True after rotation.
+    def write(self, line):
         """
-        if rotation == "LEFT":
-            self.f = Direction.rotate_left(self.f)
-            return True
-        elif rotation == "RIGHT":
-            self.f = Direction.rotate_right(self.f)
-            return True
-        return False
+        Collect a single line of output.
 
-    def report(self):
+        Args:
+            line (str): The line to write, without a trailing newline.
         """
-        Report the current position and direction of the robot.
+        self.lines.append(line)
+
+    def write_repeated(self, lines, count):
+        """
+        Collect a group of lines repeated count times.
+
+        A bounded collector only receives the repetitions it can keep.
+
+        Args:
+            lines (tuple): The lines of one repetition.
+            count (int): The number of repetitions.
+        """
+        maxlen = getattr(self.lines, "maxlen", None)
+        if maxlen is not None and lines:
+            count = min(count, maxlen // len(lines) + 1)
+        self.lines.extend(itertools.chain.from_iterable(itertools.repeat(lines, count)))
+
+    def flush(self):
+        """Collected lines are kept in memory, so there is nothing to flush."""
+
+    def getvalue(self):
+        """
+        Return the collected output as it would have been printed.
 
         Returns:
-            str: A string representation of the robot's current state.
-                 Format: "Report: x,y,DIRECTION"
+            str: All collected lines, each terminated by a newline.
         """
-        report_message = f"Report: {self.position.x},{self.position.y},{self.f}"
-        print(report_message)
-        return report_message
+        return "".join(line + "\n" for line in self.lines)
 
 
-class Interface:
+class DigestSink:
     """
-    Provides an interface for parsing and executing commands on the robot.
-    
+    Output sink that hashes the output instead of keeping it, so the full
+    transcript of a large run can be compared in constant memory.
+
+    The digest is of the output exactly as it would have been printed, so it
+    matches the hash of the captured stdout.
+
     Attributes:
-        robot (Robot): The robot instance to control.
-        commands (dict): A mapping of command strings to their corresponding functions.
-        command_history (list): A history of executed commands.
+        line_count (int): The number of lines written.
+        last_line (str | None): The most recent line written.
     """
 
-    def __init__(self, robot=Robot(), custom_commands={}):
+    def __init__(self, algorithm="sha256"):
         """
-        Initialize the Interface with a robot and optional custom commands.
+        Initialize the sink.
 
         Args:
-            robot (Robot): The robot to control.
-            custom_commands (dict): A dictionary of additional commands.
+            algorithm (str): A hashlib algorithm name.
         """
-        self.robot = robot
-        self.commands = custom_commands | {
-            "MOVE": self.robot.move,
-            "LEFT": lambda: self.robot.rotate("LEFT"),
-            "RIGHT": lambda: self.robot.rotate("RIGHT"),
-            "REPORT": self.robot.report,
-            "PLACE": self.robot.place
-        }
-        self.command_history = []
+        import hashlib
 
-    def parse_command(self, input):
+        self._digest = hashlib.new(algorithm)
+        self.line_count = 0
+        self.last_line = None
+
+    def write(self, line):
         """
-        Parse and execute a single command input.
+        Hash a single line of output.
 
-        For the PLACE command, the input must be in the format:
-            PLACE,x,y,DIRECTION
+        Args:
+            line (str): The line to write, without a trailing newline.
+        """
+        self._digest.update(line.encode() + b"\n")
+        self.line_count += 1
+        self.last_line = line
+
+    def write_repeated(self, lines, count):
+        """
+        Hash a group of lines repeated count times.
 
         Args:
-            input (str): The command string.
+            lines (tuple): The lines of one repetition.
+            count (int): The number of repetitions.
+        """
+        if not count:
+            return
+        for chunk in _repeat_in_chunks("".join(line + "\n" for line in lines).encode(), count):
+            self._digest.update(chunk)
+        self.line_count += len(lines) * count
+        self.last_line = lines[-1]
 
-        Raises:
-            ValueError: If the command is illegal, the arguments are invalid,
-                        or the command fails to execute.
+    def flush(self):
+        """The digest is always up to date, so there is nothing to flush."""
+
+    def hexdigest(self):
+        """
+        Return the digest of everything written so far.
+
+        Returns:
+            str: The hexadecimal digest.
         """
-        potential_command = input.split(",")[0]
+        return self._digest.hexdigest()
 
-        if self.is_command_prohibited(potential_command):
-            raise ValueError(f"Illegal command: {input}")
 
-        # Handle commands with arguments.
-        if potential_command == "PLACE":
-            try:
-                args = input.split(",")[1:]
-                if len(args) != 3:
-                    raise ValueError(f"Invalid arguments: {input}")
-                parsed_args = [int(args[0]), int(args[1]), args[2]]
-                command_result = self.commands[potential_command](*parsed_args)
-                if not command_result:
-                    raise ValueError(f"Invalid arguments: {input}")
-                self.command_history.append(potential_command)
-                return
-            except Exception as e:
-                raise ValueError(f"Invalid type of arguments: {input}") from e
-
-        # Handle commands without arguments.
-        if potential_command in self.commands:
-            result = self.commands[potential_command]()
-            if not result:
-                raise ValueError(f"Failed to execute: {input}")
-            self.command_history.append(potential_command)
-            return
+class NullSink:
+    """Output sink that discards everything written to it."""
 
-        raise ValueError(f"Invalid command: {input}")
+    def write(self, line):
+        """
+        Discard a single line of output.
 
-    def is_command_prohibited(self, command):
+        Args:
+            line (str): The line to discard.
         """
-        Determine if a command is prohibited based on command history.
 
-        No commands other than PLACE are allowed until a valid PLACE command
-        has been executed.
+    def write_repeated(self, lines, count):
+        """
+        Discard a group of repeated lines.
 
         Args:
-            command (str): The command to check.
+            lines (tuple): The lines of one repetition.
+            count (int): The number of repetitions.
+        """
 
-        Returns:
-            bool: True if the command is prohibited, False otherwise.
+    def flush(self):
+        """There is nothing to flush."""
+
+
+class ReportSink:
+    """
+    Output sink that writes REPORT results as fixed-width binary records
+    instead of text.
+
+    The file starts with REPORT_HEADER, followed by one REPORT_RECORD per
+    REPORT: the 0-based index of the REPORT command among all executed
+    commands, x, y and the heading as an index into Direction.NAMES. Echoed
+    commands and errors are only counted, not written. Records are never
+    formatted as text here; use read_reports() or format_reports() when a
+    human wants to look at them.
+
+    An Interface writing to a ReportSink runs REPORT through
+    Robot.record_report(). Every line passed to write() counts as an echoed
+    command unless it starts with "Error: ".
+
+    Attributes:
+        stream (BinaryIO): The stream written to on flush.
+        flush_size (int): Number of buffered bytes that triggers a flush.
+        commands (int): The number of commands echoed so far.
+        reports (int): The number of records written so far.
+    """
+
+    def __init__(self, stream=None, flush_size=1 << 16):
         """
-        if command != "PLACE" and len(self.command_history) == 0:
-            return True
-        return False
+        Initialize the sink and write the file header.
 
-    def execute(self, command):
+        Args:
+            stream (BinaryIO): The stream to write to. Defaults to stdout's
+                               binary buffer.
+            flush_size (int): Number of buffered bytes that triggers a flush.
         """
-        Execute a command and print the command along with any errors.
+        self.stream = stream if stream is not None else sys.stdout.buffer
+        self.flush_size = flush_size
+        self.commands = 0
+        self.reports = 0
+        self._buffer = bytearray(REPORT_HEADER.pack(REPORT_MAGIC, REPORT_VERSION))
+        self._pack = REPORT_RECORD.pack
+
+    def write(self, line):
+        """
+        Count an echoed command; error lines are dropped.
 
         Args:
-            command (str): The command string to execute.
+            line (str): The line of output.
         """
-        print(command)
-        try:
-            self.parse_command(command)
-        except Exception as e:
-            print(f"Error: {e}")
+        if not line.startswith("Error: "):
+            self.commands += 1
 
+    def write_repeated(self, lines, count):
+        """
+        Count the echoed commands in a group of repeated lines.
 
-if __name__ == "__main__":
-    # Set up argument parser
-    parser = argparse.ArgumentParser(description="Robot Simulator")
-    parser.add_argument("command_file", type=str, help="Path to the command file")
+        Args:
+            lines (tuple): The lines of one repetition.
+            count (int): The number of repetitions.
+        """
+        self.commands += count * sum(not line.startswith("Error: ") for line in lines)
 
-    args = parser.parse_args()
+    def write_report(self, x, y, heading):
+        """
+        Buffer a record for the REPORT command echoed last.
 
-    command_file = args.command_file
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+            heading (int): The heading as an index into Direction.NAMES.
+        """
+        self._buffer += self._pack(self.commands - 1, x, y, heading)
+        self.reports += 1
+        if len(self._buffer) >= self.flush_size:
+            self.flush()
 
-    env = Environment(5, 5)
-    robot = Robot(environment=env)
-    interface = Interface(robot=robot)
+    def flush(self):
+        """Write all buffered records to the stream."""
+        if self._buffer:
+            self.stream.write(self._buffer)
+            self._buffer = bytearray()
+        self.stream.flush()
 
-    # Read commands from the provided file and execute them
-    try:
-        with open(command_file, 'r') as file:
-            commands = file.readlines()
-    except FileNotFoundError:
-        print(f"Error: File '{command_file}' not found.")
-        sys.exit(1)
 
-    for command in commands:
-        command = command.strip()
-        if command:
-            interface.execute(command)
+STDOUT_SINK = StdoutSink()
+
+
+class Robot:
+    """
+    Implements the robot's functionality, including placing, moving, rotating,
+    and reporting its position.
+
+    Attributes:
+        position (Position): The current position of the robot.
+        heading (int): The current facing direction as an index into Direction.NAMES.
+        f (str): The current facing direction by name.
+        environment (Environment): The environment in which the robot moves.
+        output: The sink that reports are written to.
+    """
+
+    __slots__ = ("position", "heading", "environment", "output")
+
+    def __init__(self, x=0, y=0, f=Direction.NORTH, environment=None, output=None):
+        """
+        Initialize the Robot with a starting position, direction, and environment.
+
+        If the provided position is invalid, defaults to (0, 0).
+
+        Args:
+            x (int): The starting x-coordinate.
+            y (int): The starting y-coordinate.
+            f (str): The initial facing direction.
+            environment (Environment): The simulation environment. Defaults to
+                                       a new 5x5 table.
+            output: The sink that reports are written to. Defaults to stdout.
+
+        Raises:
+            ValueError: If f is not a valid direction.
+        """
+        self.f = f
+        self.environment = environment if environment is not None else Environment(5, 5)
+        self.output = output if output is not None else STDOUT_SINK
+        if not self.environment.is_valid_position(x, y):
+            x = 0
+            y = 0
+        self.position = Position(x, y)
+
+    @property
+    def f(self):
+        """str: The current facing direction by name."""
+        return Direction.NAMES[self.heading]
+
+    @f.setter
+    def f(self, f):
+        heading = Direction.INDEX.get(f)
+        if heading is None:
+            raise ValueError(f"Invalid direction: {f}")
+        self.heading = heading
+
+    def place(self, x, y, f):
+        """
+        Place the robot at the specified position and direction if valid.
+
+        Args:
+            x (int): The x-coordinate to place the robot.
+            y (int): The y-coordinate to place the robot.
+            f (str): The facing direction.
+
+        Returns:
+            bool: True if placement was successful, False otherwise.
+        """
+        heading = Direction.INDEX.get(f)
+        if heading is not None and self.environment.is_valid_position(x, y):
+            self.position.update(x, y)
+            self.heading = heading
+            return True
+        return False
+
+    def move(self):
+        """
+        Move the robot one unit in the direction it is currently facing.
+
+        Returns:
+            bool: True if the move is successful, False if the move would
+                  cause the robot to leave the environment.
+        """
+        new_x = self.position.x + Direction.DX[self.heading]
+        new_y = self.position.y + Direction.DY[self.heading]
+
+        if self.environment.is_valid_position(new_x, new_y):
+            self.position.update(new_x, new_y)
+            return True
+        return False
+
+    def rotate(self, rotation):
+        """
+        Rotate the robot 90 degrees based on the specified rotation command.
+
+        Args:
+            rotation (str): Either "LEFT" or "RIGHT".
+
+        Returns:
+            bool: True if the rotation is valid, False otherwise.
+        """
+        turn = Direction.TURNS.get(rotation)
+        if turn is None:
+            return False
+        self.heading = (self.heading + turn) & 3
+        return True
+
+    def rotate_left(self):
+        """
+        Rotate the robot 90 degrees to the left.
+
+        Returns:
+            bool: Always True.
+        """
+        self.heading = (self.heading - 1) & 3
+        return True
+
+    def rotate_right(self):
+        """
+        Rotate the robot 90 degrees to the right.
+
+        Returns:
+            bool: Always True.
+        """
+        self.heading = (self.heading + 1) & 3
+        return True
+
+    def move_many(self, count):
+        """
+        Move the robot count times in the direction it is facing.
+
+        Equivalent to calling move() count times, but computed in one step
+        from the distance to the nearest blocked cell.
+
+        Args:
+            count (int): The number of moves.
+
+        Returns:
+            int: The number of moves that succeeded. All later moves fail.
+        """
+        x = self.position.x
+        y = self.position.y
+        heading = self.heading
+        moved = self.environment.free_distance(x, y, heading, count)
+        if moved:
+            self.position.update(x + Direction.DX[heading] * moved, y + Direction.DY[heading] * moved)
+        return moved
+
+    def rotate_many(self, rotation, count):
+        """
+        Rotate the robot 90 degrees count times.
+
+        Args:
+            rotation (str): Either "LEFT" or "RIGHT".
+            count (int): The number of rotations.
+
+        Returns:
+            bool: True if the rotation is valid, False otherwise.
+        """
+        turn = Direction.TURNS.get(rotation)
+        if turn is None:
+            return False
+        self.heading = (self.heading + turn * count) & 3
+        return True
+
+    def report(self):
+        """
+        Report the current position and direction of the robot.
+
+        Returns:
+            str: A string representation of the robot's current state.
+                 Format: "Report: x,y,DIRECTION"
+        """
+        report_message = f"Report: {self.position.x},{self.position.y},{Direction.NAMES[self.heading]}"
+        self.output.write(report_message)
+        return report_message
+
+    def record_report(self):
+        """
+        Report the current position and direction of the robot as a binary
+        record, without formatting it. The output must be a ReportSink.
+
+        Returns:
+            bool: Always True.
+        """
+        self.output.write_report(self.position.x, self.position.y, self.heading)
+        return True
+
+
+class Status(enum.IntEnum):
+    """
+    The outcome of executing a command, as returned by Interface.run_command.
+
+    Every status other than OK is truthy and corresponds to the error message
+    that execute() writes for it.
+    """
+    OK = 0
+    ILLEGAL = 1             # A command other than PLACE before the first valid PLACE.
+    INVALID_ARGUMENTS = 2   # A PLACE with missing, malformed or out of range arguments.
+    FAILED = 3              # A command that could not be executed, e.g. a MOVE off the table.
+    INVALID_COMMAND = 4     # An unknown command.
+
+    def message(self, command):
+        """
+        Format the error message for a failed command.
+
+        Args:
+            command (str): The command string.
+
+        Returns:
+            str: The error message, without the "Error: " prefix.
+        """
+        return ERROR_MESSAGES[self] + command
+
+
+ERROR_MESSAGES = {
+    Status.ILLEGAL: "Illegal command: ",
+    Status.INVALID_ARGUMENTS: "Invalid type of arguments: ",
+    Status.FAILED: "Failed to execute: ",
+    Status.INVALID_COMMAND: "Invalid command: ",
+}
+_ERROR_LINES = {status: "Error: " + message for status, message in ERROR_MESSAGES.items()}
+TRAJECTORY_CACHE_BYTES = 64 << 20
+_INT_PATTERN = None
+
+
+def parse_int(text):
+    """
+    Parse an integer the way int() does, without raising on invalid input.
+
+    Args:
+        text (str): The text to parse.
+
+    Returns:
+        int | None: The parsed integer, or None if int() would reject the text.
+    """
+    if len(text) < 19 and text.isdecimal():
+        return int(text)
+    global _INT_PATTERN
+    if _INT_PATTERN is None:
+        # Compiled on first use so that importing this module does not import re.
+        import re
+        _INT_PATTERN = re.compile(r"\s*[+-]?\d+(?:_\d+)*\s*")
+    if _INT_PATTERN.fullmatch(text) is None:
+        return None
+    try:
+        # Only reachable for unusual input, e.g. more digits than int() allows.
+        return int(text)
+    except ValueError:
+        return None
+
+
+def parse_place_arguments(arguments):
+    """
+    Parse the "x,y,DIRECTION" arguments of a PLACE command.
+
+    Args:
+        arguments (str): The text after "PLACE,".
+
+    Returns:
+        tuple | None: (x, y, direction name), or None if the coordinates are
+                     not integers or the number of arguments is wrong. The
+                     direction is checked by Robot.place().
+    """
+    args = arguments.split(",")
+    if len(args) != 3:
+        return None
+    x, y, f = args
+    # Inlines parse_int()'s fast path for plain non-negative coordinates.
+    x = int(x) if len(x) < 19 and x.isdecimal() else parse_int(x)
+    y = int(y) if len(y) < 19 and y.isdecimal() else parse_int(y)
+    if x is None or y is None:
+        return None
+    return x, y, f
+
+
+def argument_parser(schema):
+    """
+    Build an argument parser for a command from a schema.
+
+    Args:
+        schema (Sequence[Callable]): One converter per argument, returning the
+                                     converted value or None if the text is
+                                     invalid, e.g. parse_int or str.
+
+    Returns:
+        Callable: A function taking the text after "NAME," and returning the
+                  list of converted arguments, or None if any is invalid.
+    """
+    schema = tuple(schema)
+
+    def parse(arguments):
+        args = arguments.split(",")
+        if len(args) != len(schema):
+            return None
+        for i, convert in enumerate(schema):
+            value = convert(args[i])
+            if value is None:
+                return None
+            args[i] = value
+        return args
+
+    return parse
+
+
+def _without_robot(function):
+    # Custom commands given as plain functions take no arguments.
+    return lambda robot: function()
+
+
+# The built-in command table. Each token maps to (handler, parse, places):
+# the Robot method that runs it, the argument parser (None for commands that
+# take no arguments), and whether the command may run before the robot is
+# placed and places it on success. Every Interface without custom commands
+# shares this table.
+BUILTIN_COMMANDS = {
+    "MOVE": (Robot.move, None, False),
+    "LEFT": (Robot.rotate_left, None, False),
+    "RIGHT": (Robot.rotate_right, None, False),
+    "REPORT": (Robot.report, None, False),
+    "PLACE": (Robot.place, parse_place_arguments, True),
+}
+# The table used by Interfaces that write to a ReportSink.
+BINARY_REPORT_COMMANDS = BUILTIN_COMMANDS | {"REPORT": (Robot.record_report, None, False)}
+
+
+class CommandStats:
+    """
+    Per-command counters and latency histograms collected by an
+    InstrumentedInterface.
+
+    Latencies are recorded in power-of-two buckets: a sample of ns
+    nanoseconds goes to bucket ns.bit_length(), so bucket k holds samples in
+    [2 ** (k - 1), 2 ** k) ns.
+
+    The phases recorded are the command token ("MOVE", "PLACE", ... or
+    "OTHER" for unknown commands) for the whole of execute(), "parse" for
+    splitting the command and converting its arguments, "dispatch" for the
+    command table lookup and checks, "move", "rotate", "place" and "report"
+    for the robot handlers, and "error" for formatting and writing error
+    lines.
+
+    Attributes:
+        counts (collections.Counter): Executions per (command token, status
+            name), where the status name is "EXCEPTION" for commands that raised.
+        histograms (dict): Maps each phase to its list of bucket counts.
+        totals (dict): Maps each phase to its total time in nanoseconds.
+    """
+
+    BUCKETS = 64
+
+    def __init__(self):
+        """Initialize empty counters."""
+        self.counts = collections.Counter()
+        self.histograms = {}
+        self.totals = {}
+
+    def record(self, phase, ns, count=1):
+        """
+        Record count samples of ns nanoseconds each.
+
+        Args:
+            phase (str): The phase the time was spent in.
+            ns (int): The latency of one sample in nanoseconds.
+            count (int): The number of samples.
+        """
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            histogram = self.histograms[phase] = [0] * self.BUCKETS
+            self.totals[phase] = 0
+        histogram[min(ns.bit_length(), self.BUCKETS - 1)] += count
+        self.totals[phase] += ns * count
+
+    def summary(self):
+        """
+        Summarize the counters.
+
+        Returns:
+            dict: "commands" maps each command token to its count per status
+                  name; "latency" maps each phase to its sample count, total
+                  and mean time in nanoseconds and its non-empty buckets,
+                  keyed by their upper bound in nanoseconds.
+        """
+        commands = {}
+        for (token, status), count in sorted(self.counts.items()):
+            commands.setdefault(token, {})[status] = count
+        latency = {}
+        for phase, histogram in sorted(self.histograms.items()):
+            samples = sum(histogram)
+            latency[phase] = {
+                "count": samples,
+                "total_ns": self.totals[phase],
+                "mean_ns": self.totals[phase] / samples if samples else 0.0,
+                "buckets": {1 << bucket: count for bucket, count in enumerate(histogram) if count},
+            }
+        return {"commands": commands, "latency": latency}
+
+    def format(self):
+        """
+        Format the counters as a human-readable table.
+
+        Returns:
+            str: One line per command token and status, then one per phase.
+        """
+        summary = self.summary()
+        lines = ["command  status             count"]
+        for token, statuses in summary["commands"].items():
+            for status, count in statuses.items():
+                lines.append(f"{token:<8} {status:<17} {count:>7}")
+        lines.append("phase    count      mean ns    total ms")
+        for phase, stats in summary["latency"].items():
+            lines.append(f"{phase:<8} {stats['count']:>7} {stats['mean_ns']:>12,.0f} "
+                         f"{stats['total_ns'] / 1e6:>11,.3f}")
+        return "\n".join(lines)
+
+
+class TrajectoryCache:
+    """
+    LRU cache of the effect of running a block of commands from a start state.
+
+    On an Environment, which never changes, the effect of a block of built-in
+    commands depends only on the start state (x, y, heading, placed). An entry
+    stores the end state, every output line of the block (echoed commands,
+    errors and reports), and the positions in the block of the commands that
+    failed. Entries are evicted least recently used first once their
+    estimated size exceeds max_bytes.
+
+    Attributes:
+        max_bytes (int): The memory cap for all entries.
+        size (int): The estimated size of the cached entries in bytes.
+        hits (int): Lookups that found an entry.
+        misses (int): Lookups that did not.
+        evictions (int): Entries evicted to stay under max_bytes.
+    """
+
+    # Estimated size of an entry's key and state tuples, on top of its lines.
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes=TRAJECTORY_CACHE_BYTES):
+        """
+        Initialize an empty cache.
+
+        Args:
+            max_bytes (int): The memory cap for all entries.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Look up an entry and mark it as recently used.
+
+        Args:
+            key (tuple): The block key and start state.
+
+        Returns:
+            tuple | None: The entry (x, y, heading, placed, lines, failures),
+                          or None on a miss.
+        """
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return item[0]
+
+    def put(self, key, entry):
+        """
+        Store an entry, evicting the least recently used ones if needed.
+        Entries larger than max_bytes on their own are not stored.
+
+        Args:
+            key (tuple): The block key and start state.
+            entry (tuple): The entry (x, y, heading, placed, lines, failures).
+        """
+        lines, failures = entry[4], entry[5]
+        size = (self.ENTRY_OVERHEAD + sys.getsizeof(lines) + sum(map(sys.getsizeof, lines))
+                + sys.getsizeof(failures))
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous[1]
+        while self.size + size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+        self._entries[key] = (entry, size)
+        self.size += size
+
+    def stats(self):
+        """
+        Summarize the cache.
+
+        Returns:
+            dict: The hits, misses, evictions, number of entries and their
+                  estimated size in bytes.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self._entries), "bytes": self.size}
+
+
+def block_key(commands):
+    """
+    Hash a block of commands for use in a TrajectoryCache key.
+
+    Args:
+        commands (Sequence[str]): The commands of the block.
+
+    Returns:
+        bytes: A 16-byte digest of the block.
+    """
+    import hashlib
+
+    return hashlib.blake2b("\n".join(commands).encode(), digest_size=16).digest()
+
+
+def _timed(stats, phase, handler):
+    perf_counter_ns = time.perf_counter_ns
+
+    def timed(*args):
+        start = perf_counter_ns()
+        result = handler(*args)
+        stats.record(phase, perf_counter_ns() - start)
+        return result
+
+    return timed
+
+
+class Interface:
+    """
+    Provides an interface for parsing and executing commands on the robot.
+    
+    Attributes:
+        robot (Robot): The robot instance to control.
+        commands (dict): The command table, mapping each command token to its
+            (handler, parse, places) entry. It is shared between interfaces
+            until a custom command is registered, so add commands through
+            register_command() rather than by modifying it.
+        placed (bool): Whether a valid PLACE command has been executed.
+        command_history (collections.deque | array.array | None): The log of
+            successfully executed commands, according to the history policy.
+        output: The sink that echoed commands, errors and reports are written to.
+        error_count (int): The number of commands that failed in execute().
+        stats (CommandStats | None): The counters recorded by an
+            InstrumentedInterface; None otherwise.
+    """
+
+    __slots__ = ("robot", "commands", "placed", "command_history", "output", "error_count",
+                 "stats", "_record", "_opcode_handlers")
+
+    def __init__(self, robot=None, custom_commands=None, output=None, history="off",
+                 history_size=1000):
+        """
+        Initialize the Interface with a robot and optional custom commands.
+
+        The command history policy is one of:
+            "off": no history is kept (the default).
+            "ring": the names of the last history_size commands, in a deque.
+            "full": every command as an opcode byte in an array. Custom
+                    commands are logged as OP_RAW.
+
+        Args:
+            robot (Robot): The robot to control. Defaults to a new Robot.
+            custom_commands (dict): Additional commands, mapping each name to a
+                                    function called without arguments, or to a
+                                    (handler, schema) pair as taken by
+                                    register_command(). Built-in commands take
+                                    precedence.
+            output: The sink to write to. If given, it replaces the robot's
+                    sink so that all output goes to the same place. With a
+                    ReportSink, REPORT writes binary records.
+            history (str): The command history policy.
+            history_size (int): The number of commands kept by the "ring" policy.
+
+        Raises:
+            ValueError: If the history policy is unknown.
+        """
+        if robot is None:
+            robot = Robot()
+        self.robot = robot
+        if output is not None:
+            robot.output = output
+        self.output = robot.output
+        self.error_count = 0
+        self.commands = BINARY_REPORT_COMMANDS if isinstance(self.output, ReportSink) else BUILTIN_COMMANDS
+        # The handlers of the opcode commands, built by run_program() on first use.
+        self._opcode_handlers = None
+        for name, command in (custom_commands or {}).items():
+            if name in BUILTIN_COMMANDS:
+                continue
+            if isinstance(command, tuple):
+                self.register_command(name, *command)
+            else:
+                self.register_command(name, _without_robot(command))
+        self.placed = False
+        self.stats = None
+        if history == "off":
+            self.command_history = None
+            self._record = None
+        elif history == "ring":
+            self.command_history = collections.deque(maxlen=history_size)
+            self._record = self.command_history.append
+        elif history == "full":
+            self.command_history = array.array("B")
+            self._record = self._record_opcode
+        else:
+            raise ValueError(f"Invalid history policy: {history}")
+
+    def register_command(self, name, handler, schema=None):
+        """
+        Add a command to this interface's command table.
+
+        The command is run as handler(robot, *arguments), where the arguments
+        in "NAME,arg1,arg2" are converted by the schema (see argument_parser()).
+        Input with the wrong number of arguments, an argument rejected by the
+        schema, or a false return value from the handler fails with
+        INVALID_ARGUMENTS. Without a schema, the handler is called with only
+        the robot, any arguments are ignored like those of the built-in
+        commands, and a false return value fails with FAILED.
+
+        Custom commands are illegal until the robot has been placed.
+
+        Args:
+            name (str): The command token.
+            handler (Callable): The function that runs the command.
+            schema (Sequence[Callable]): One converter per argument, or None.
+
+        Raises:
+            ValueError: If name is a built-in command.
+        """
+        if name in BUILTIN_COMMANDS:
+            raise ValueError(f"Cannot replace the built-in command {name}")
+        if self.commands is BUILTIN_COMMANDS or self.commands is BINARY_REPORT_COMMANDS:
+            self.commands = dict(self.commands)
+        parse = argument_parser(schema) if schema else None
+        self.commands[name] = (handler, parse, False)
+
+    def _record_opcode(self, command):
+        self.command_history.append(HISTORY_OPCODES.get(command, OP_RAW))
+
+    def history(self):
+        """
+        Return the recorded command history as command names.
+
+        Returns:
+            list: The names of the recorded commands, oldest first. Custom
+                  commands in a "full" log are reported as "RAW".
+        """
+        if self.command_history is None:
+            return []
+        if isinstance(self.command_history, array.array):
+            return [HISTORY_NAMES[op] for op in self.command_history]
+        return list(self.command_history)
+
+    def snapshot(self):
+        """
+        Capture the robot and interface state.
+
+        Returns:
+            tuple: The state (x, y, heading, placed, error_count, history
+                   policy, ring size, history data), as stored by
+                   save_snapshot().
+        """
+        position = self.robot.position
+        history = self.command_history
+        if history is None:
+            policy, size, data = SNAPSHOT_HISTORY_OFF, 0, b""
+        elif isinstance(history, array.array):
+            policy, size, data = SNAPSHOT_HISTORY_FULL, 0, history.tobytes()
+        else:
+            policy, size, data = SNAPSHOT_HISTORY_RING, history.maxlen, "\n".join(history).encode()
+        return (position.x, position.y, self.robot.heading, self.placed, self.error_count,
+                policy, size, data)
+
+    def restore(self, state):
+        """
+        Restore a state captured by snapshot(), including its history policy.
+
+        Args:
+            state (tuple): The state to restore.
+        """
+        x, y, heading, placed, error_count, policy, size, data = state
+        self.robot.position.update(x, y)
+        self.robot.heading = heading
+        self.placed = bool(placed)
+        self.error_count = error_count
+        if policy == SNAPSHOT_HISTORY_OFF:
+            self.command_history = None
+            self._record = None
+        elif policy == SNAPSHOT_HISTORY_RING:
+            names = data.decode().split("\n") if data else []
+            self.command_history = collections.deque(names, maxlen=size)
+            self._record = self.command_history.append
+        else:
+            self.command_history = array.array("B", data)
+            self._record = self._record_opcode
+
+    def run_command(self, input):
+        """
+        Execute a single command input and report the outcome as a status.
+
+        For the PLACE command, the input must be in the format:
+            PLACE,x,y,DIRECTION
+
+        The command token is looked up once in the command table, and its
+        arguments are converted by the parser of its entry.
+
+        Invalid commands are reported through the returned status rather than
+        by raising, so failing commands cost no more than successful ones.
+
+        Args:
+            input (str): The command string.
+
+        Returns:
+            Status: Status.OK on success, otherwise the reason for the failure.
+        """
+        token, separator, arguments = input.partition(",")
+        entry = self.commands.get(token)
+        if entry is None:
+            return Status.INVALID_COMMAND if self.placed else Status.ILLEGAL
+        handler, parse, places = entry
+        if not (places or self.placed):
+            return Status.ILLEGAL
+
+        if parse is None:
+            if not handler(self.robot):
+                return Status.FAILED
+        else:
+            args = parse(arguments) if separator else None
+            if args is None or not handler(self.robot, *args):
+                return Status.INVALID_ARGUMENTS
+
+        if places:
+            self.placed = True
+        if self._record is not None:
+            self._record(token)
+        return Status.OK
+
+    def parse_command(self, input):
+        """
+        Parse and execute a single command input.
+
+        For the PLACE command, the input must be in the format:
+            PLACE,x,y,DIRECTION
+
+        This is a raising wrapper around run_command().
+
+        Args:
+            input (str): The command string.
+
+        Raises:
+            ValueError: If the command is illegal, the arguments are invalid,
+                        or the command fails to execute.
+        """
+        status = self.run_command(input)
+        if status:
+            raise ValueError(status.message(input))
+
+    def is_command_prohibited(self, command):
+        """
+        Determine if a command is prohibited because the robot has not been placed.
+
+        No commands other than PLACE are allowed until a valid PLACE command
+        has been executed.
+
+        Args:
+            command (str): The command to check.
+
+        Returns:
+            bool: True if the command is prohibited, False otherwise.
+        """
+        if command != "PLACE" and not self.placed:
+            return True
+        return False
+
+    def execute(self, command):
+        """
+        Execute a command and write the command along with any errors to the
+        output sink.
+
+        Args:
+            command (str): The command string to execute.
+        """
+        self.output.write(command)
+        try:
+            status = self.run_command(command)
+        except Exception as e:
+            # Custom commands may still raise.
+            self.error_count += 1
+            self.output.write(f"Error: {e}")
+            return
+        if status:
+            self.error_count += 1
+            self.output.write(_ERROR_LINES[status] + command)
+
+    def execute_repeated(self, command, count):
+        """
+        Execute the same command count times in a row.
+
+        Produces the same output and state as calling execute() count times.
+        Runs of MOVE, LEFT and RIGHT are fast-forwarded in constant time: the
+        robot moves straight to the last reachable cell and every remaining
+        MOVE is reported as failed.
+
+        Args:
+            command (str): The command string to execute.
+            count (int): The number of times to execute it.
+        """
+        if command not in REPEATABLE_COMMANDS or count < 2:
+            for _ in range(count):
+                self.execute(command)
+            return
+
+        if not self.placed:
+            self.error_count += count
+            self.output.write_repeated((command, _ERROR_LINES[Status.ILLEGAL] + command), count)
+            return
+
+        if command == "MOVE":
+            succeeded = self.robot.move_many(count)
+        else:
+            self.robot.rotate_many(command, count)
+            succeeded = count
+
+        if succeeded:
+            self.output.write_repeated((command,), succeeded)
+            if self._record is not None:
+                self._record_many(command, succeeded)
+        failed = count - succeeded
+        if failed:
+            self.error_count += failed
+            self.output.write_repeated((command, _ERROR_LINES[Status.FAILED] + command), failed)
+
+    def _record_many(self, command, count):
+        if isinstance(self.command_history, array.array):
+            self.command_history.frombytes(bytes((HISTORY_OPCODES[command],)) * count)
+        else:
+            self.command_history.extend(itertools.repeat(command, min(count, self.command_history.maxlen)))
+
+    def execute_block(self, commands, cache, key=None):
+        """
+        Execute a block of commands through a TrajectoryCache.
+
+        Produces the same output and state as calling execute() on every
+        command. On a cache hit, the block's output is written and the robot
+        is moved to the end state without running the commands; on a miss,
+        the commands run and their effect is cached.
+
+        The cache is bypassed, and the commands simply executed, when the
+        effect might not depend on the start state alone: when the block uses
+        custom commands, the environment or robot is not a plain Environment
+        or Robot, a command history is kept, or the interface is instrumented.
+
+        Args:
+            commands (Sequence[str]): The stripped, non-empty commands.
+            cache (TrajectoryCache): The cache to consult.
+            key (bytes): The block_key() of commands, if already computed.
+        """
+        robot = self.robot
+        if not self._is_cacheable(commands):
+            for command in commands:
+                self.execute(command)
+            return
+        if key is None:
+            key = block_key(commands)
+        position = robot.position
+        state = (key, position.x, position.y, robot.heading, self.placed)
+        entry = cache.get(state)
+        if entry is not None:
+            x, y, heading, placed, lines, failures = entry
+            position.update(x, y)
+            robot.heading = heading
+            self.placed = placed
+            self.error_count += len(failures)
+            self.output.write_repeated(lines, 1)
+            return
+
+        output, robot_output = self.output, robot.output
+        collected = CollectingSink()
+        self.output = robot.output = collected
+        failures = []
+        try:
+            for i, command in enumerate(commands):
+                errors = self.error_count
+                self.execute(command)
+                if self.error_count != errors:
+                    failures.append(i)
+        finally:
+            self.output, robot.output = output, robot_output
+        lines = tuple(collected.lines)
+        cache.put(state, (position.x, position.y, robot.heading, self.placed, lines, tuple(failures)))
+        output.write_repeated(lines, 1)
+
+    def _is_cacheable(self, commands):
+        if (self._record is not None or type(self) is not Interface
+                or type(self.robot) is not Robot or type(self.robot.environment) is not Environment):
+            return False
+        if self.commands is BUILTIN_COMMANDS:
+            return True
+        for command in commands:
+            token = command.partition(",")[0]
+            if self.commands.get(token) is not BUILTIN_COMMANDS.get(token):
+                return False
+        return True
+
+    def run_program(self, program):
+        """
+        Execute a compiled program.
+
+        Produces exactly the same output and state changes as calling
+        execute() on every line the program was compiled from, without
+        re-parsing the command strings.
+
+        Args:
+            program (Program): The compiled program to run.
+
+        Returns:
+            int: The number of commands executed.
+
+        Raises:
+            ValueError: If the program contains an unknown opcode or is
+                        truncated, e.g. because its cache file is corrupt.
+        """
+        write = self.output.write
+        record = self._record
+        placed = self.placed
+        handlers = self._opcode_handlers
+        if handlers is None:
+            # Custom commands cannot replace built-in ones, so these never
+            # change after construction.
+            handlers = self._opcode_handlers = {name: self.commands[name][0] for name in HISTORY_OPCODES}
+        robot = self.robot
+        place = handlers["PLACE"]
+        code = program.code
+        texts = program.texts
+        unpack_place = PLACE_OPERANDS.unpack_from
+        unpack_text = TEXT_OPERAND.unpack_from
+        unpack_repeat = REPEAT_OPERANDS.unpack_from
+        place_size = PLACE_OPERANDS.size
+        text_size = TEXT_OPERAND.size
+        repeat_size = REPEAT_OPERANDS.size
+        pc = 0
+        end = len(code)
+        count = 0
+        errors = 0
+        try:
+            while pc < end:
+                op = code[pc]
+                pc += 1
+                count += 1
+                if OP_MOVE <= op <= OP_REPORT:
+                    name = OPCODE_NAMES[op]
+                    write(name)
+                    if not placed:
+                        errors += 1
+                        write(_ERROR_LINES[Status.ILLEGAL] + name)
+                    elif handlers[name](robot):
+                        if record is not None:
+                            record(name)
+                    else:
+                        errors += 1
+                        write(_ERROR_LINES[Status.FAILED] + name)
+                elif op == OP_PLACE:
+                    x, y, d = unpack_place(code, pc)
+                    pc += place_size
+                    f = Direction.NAMES[d]
+                    command = f"PLACE,{x},{y},{f}"
+                    write(command)
+                    if place(robot, x, y, f):
+                        placed = True
+                        if record is not None:
+                            record("PLACE")
+                    else:
+                        errors += 1
+                        write(_ERROR_LINES[Status.INVALID_ARGUMENTS] + command)
+                elif op == OP_REPEAT:
+                    op, repeat = unpack_repeat(code, pc)
+                    pc += repeat_size
+                    count += repeat - 1
+                    self.placed = placed
+                    self.execute_repeated(OPCODE_NAMES[op], repeat)
+                elif op == OP_ERROR or op == OP_RAW:
+                    text = texts[unpack_text(code, pc)[0]]
+                    pc += text_size
+                    if op == OP_ERROR:
+                        errors += 1
+                        write(text)
+                        write(_ERROR_LINES[Status.INVALID_ARGUMENTS] + text)
+                    else:
+                        self.placed = placed
+                        self.execute(text)
+                        placed = self.placed
+                else:
+                    raise ValueError(f"Corrupt compiled program: unknown opcode {op} at offset {pc - 1}")
+        except (IndexError, KeyError, struct.error):
+            raise ValueError(f"Corrupt compiled program: invalid operands at offset {pc}") from None
+        finally:
+            self.placed = placed
+            self.error_count += errors
+        return count
+
+
+_HANDLER_PHASES = {"MOVE": "move", "LEFT": "rotate", "RIGHT": "rotate", "PLACE": "place",
+                   "REPORT": "report"}
+
+
+class InstrumentedInterface(Interface):
+    """
+    An Interface that records every command into a CommandStats.
+
+    The robot handlers in its command table are wrapped with timers, and its
+    execute(), run_command() and execute_repeated() time the other phases.
+    Plain Interfaces run none of this code, so they pay nothing for it.
+
+    Runs fast-forwarded by execute_repeated() are not parsed command by
+    command; each command of a run is recorded in the dispatch, handler and
+    error phases at the run's mean time. Compiled programs run through
+    run_program() only record the robot handlers, PLACE included.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, robot=None, custom_commands=None, output=None, history="off",
+                 history_size=1000, stats=None):
+        """
+        Initialize the Interface and instrument its command table.
+
+        Args:
+            robot (Robot): The robot to control. Defaults to a new Robot.
+            custom_commands (dict): Additional commands, as for Interface.
+            output: The sink to write to, as for Interface.
+            history (str): The command history policy.
+            history_size (int): The number of commands kept by the "ring" policy.
+            stats (CommandStats): The counters to record into. Defaults to new ones.
+        """
+        super().__init__(robot, custom_commands, output, history, history_size)
+        self.stats = stats if stats is not None else CommandStats()
+        self.commands = dict(self.commands)
+        for name, phase in _HANDLER_PHASES.items():
+            handler, parse, places = self.commands[name]
+            self.commands[name] = (_timed(self.stats, phase, handler), parse, places)
+
+    def execute(self, command):
+        """
+        Execute a command like Interface.execute(), recording its status and
+        latency.
+
+        Args:
+            command (str): The command string to execute.
+        """
+        perf_counter_ns = time.perf_counter_ns
+        start = perf_counter_ns()
+        self.output.write(command)
+        try:
+            status = self.run_command(command)
+        except Exception as e:
+            self.error_count += 1
+            self.output.write(f"Error: {e}")
+            status_name = "EXCEPTION"
+        else:
+            if status:
+                error_start = perf_counter_ns()
+                self.error_count += 1
+                self.output.write(_ERROR_LINES[status] + command)
+                self.stats.record("error", perf_counter_ns() - error_start)
+            status_name = status.name
+        token = command.partition(",")[0]
+        if token not in _HANDLER_PHASES:
+            token = "OTHER"
+        self.stats.record(token, perf_counter_ns() - start)
+        self.stats.counts[token, status_name] += 1
+
+    def run_command(self, input):
+        """
+        Execute a command like Interface.run_command(), recording the parse
+        and dispatch phases.
+
+        Args:
+            input (str): The command string.
+
+        Returns:
+            Status: Status.OK on success, otherwise the reason for the failure.
+        """
+        perf_counter_ns = time.perf_counter_ns
+        record = self.stats.record
+        start = perf_counter_ns()
+        token, separator, arguments = input.partition(",")
+        split = perf_counter_ns()
+        entry = self.commands.get(token)
+        if entry is None:
+            status = Status.INVALID_COMMAND if self.placed else Status.ILLEGAL
+        elif not (entry[2] or self.placed):
+            status = Status.ILLEGAL
+        else:
+            status = None
+        dispatched = perf_counter_ns()
+        record("dispatch", dispatched - split)
+        if status is not None:
+            record("parse", split - start)
+            return status
+
+        handler, parse, places = entry
+        if parse is None:
+            record("parse", split - start)
+            if not handler(self.robot):
+                return Status.FAILED
+        else:
+            args = parse(arguments) if separator else None
+            record("parse", split - start + perf_counter_ns() - dispatched)
+            if args is None or not handler(self.robot, *args):
+                return Status.INVALID_ARGUMENTS
+
+        if places:
+            self.placed = True
+        if self._record is not None:
+            self._record(token)
+        return Status.OK
+
+    def execute_repeated(self, command, count):
+        """
+        Execute a run like Interface.execute_repeated(), recording the run's
+        statuses and the mean latency per command of each phase.
+
+        Args:
+            command (str): The command string to execute.
+            count (int): The number of times to execute it.
+        """
+        if command not in REPEATABLE_COMMANDS or count < 2:
+            # Falls back to execute(), which records each command.
+            super().execute_repeated(command, count)
+            return
+        perf_counter_ns = time.perf_counter_ns
+        record = self.stats.record
+        counts = self.stats.counts
+        start = perf_counter_ns()
+        placed = self.placed
+        dispatched = perf_counter_ns()
+        record("dispatch", (dispatched - start) // count, count)
+
+        if not placed:
+            self.error_count += count
+            self.output.write_repeated((command, _ERROR_LINES[Status.ILLEGAL] + command), count)
+            end = perf_counter_ns()
+            record("error", (end - dispatched) // count, count)
+            record(command, (end - start) // count, count)
+            counts[command, Status.ILLEGAL.name] += count
+            return
+
+        if command == "MOVE":
+            succeeded = self.robot.move_many(count)
+        else:
+            self.robot.rotate_many(command, count)
+            succeeded = count
+        moved = perf_counter_ns()
+        record(_HANDLER_PHASES[command], (moved - dispatched) // count, count)
+
+        if succeeded:
+            self.output.write_repeated((command,), succeeded)
+            if self._record is not None:
+                self._record_many(command, succeeded)
+            counts[command, Status.OK.name] += succeeded
+        failed = count - succeeded
+        if failed:
+            error_start = perf_counter_ns()
+            self.error_count += failed
+            self.output.write_repeated((command, _ERROR_LINES[Status.FAILED] + command), failed)
+            record("error", (perf_counter_ns() - error_start) // failed, failed)
+            counts[command, Status.FAILED.name] += failed
+        record(command, (perf_counter_ns() - start) // count, count)
+
+
+STREAM_BUFFER_SIZE = 1 << 20
+# Commands read at a time by run_macros(), and the find_repeated_blocks() defaults.
+MACRO_BATCH_LINES = 1 << 16
+MACRO_SAMPLE_LINES = 1 << 17
+MACRO_MIN_COUNT = 2
+MACRO_LIMIT = 16
+
+# Opcodes of the compiled command format. Each entry in a Program is a single
+# opcode byte, followed by packed operands for PLACE, ERROR, RAW and REPEAT.
+OP_MOVE = 1
+OP_LEFT = 2
+OP_RIGHT = 3
+OP_REPORT = 4
+OP_PLACE = 5    # operands: x, y, direction index
+OP_ERROR = 6    # operand: index of a PLACE line that can never succeed
+OP_RAW = 7      # operand: index of a line executed through Interface.execute
+OP_REPEAT = 8   # operands: MOVE, LEFT or RIGHT opcode, repeat count
+
+OPCODES = {"MOVE": OP_MOVE, "LEFT": OP_LEFT, "RIGHT": OP_RIGHT, "REPORT": OP_REPORT}
+OPCODE_NAMES = {op: name for name, op in OPCODES.items()}
+HISTORY_OPCODES = OPCODES | {"PLACE": OP_PLACE}
+HISTORY_NAMES = OPCODE_NAMES | {OP_PLACE: "PLACE", OP_RAW: "RAW"}
+PLACE_OPERANDS = struct.Struct("<iiB")
+TEXT_OPERAND = struct.Struct("<I")
+REPEAT_OPERANDS = struct.Struct("<BI")
+REPEATABLE_COMMANDS = ("MOVE", "LEFT", "RIGHT")
+BYTE_OPCODES = {
+    line: op
+    for name, op in OPCODES.items()
+    for line in (name.encode(), name.encode() + b"\r")
+}
+MMAP_WINDOW_SIZE = 1 << 26
+_REPEAT_MAX = (1 << 32) - 1
+
+PROGRAM_CACHE_SUFFIX = ".rbc"
+PROGRAM_CACHE_MAGIC = b"RBC2"
+PROGRAM_HEADER = struct.Struct("<QI")
+PROGRAM_CACHE_HEADER = struct.Struct("<4sqq32s")
+
+REPORT_MAGIC = b"RRPT"
+REPORT_VERSION = 1
+# magic, version
+REPORT_HEADER = struct.Struct("<4sH")
+# command index, x, y, heading
+REPORT_RECORD = struct.Struct("<QqqB")
+
+SNAPSHOT_MAGIC = b"RSNP"
+SNAPSHOT_VERSION = 2
+# magic, version, input byte offset, commands executed, number of records,
+# SHA-256 of the input before the offset (zeros if unknown)
+SNAPSHOT_HEADER = struct.Struct("<4sHQQI32s")
+# x, y, heading, placed, error count, history policy, ring size, history bytes
+SNAPSHOT_RECORD = struct.Struct("<qqBBQBIQ")
+SNAPSHOT_HISTORY_OFF = 0
+SNAPSHOT_HISTORY_RING = 1
+SNAPSHOT_HISTORY_FULL = 2
+CHECKPOINT_INTERVAL = 1000000
+# Sharded execution tabulates every start state, so it is limited to small tables.
+SHARD_MAX_CELLS = 1 << 12
+SHARD_MIN_BYTES = 1 << 20
+SHARDS_PER_JOB = 4
+_INT32_MIN = -(1 << 31)
+_INT32_MAX = (1 << 31) - 1
+
+
+class Program:
+    """
+    A command file compiled into a compact opcode array.
+
+    Attributes:
+        code (bytearray): The opcode stream.
+        texts (list): Original command lines referenced by ERROR and RAW opcodes.
+    """
+
+    def __init__(self, code=None, texts=None):
+        """
+        Initialize a Program.
+
+        Args:
+            code (bytearray): The opcode stream.
+            texts (list): Original command lines referenced by the opcodes.
+        """
+        self.code = code if code is not None else bytearray()
+        self.texts = texts if texts is not None else []
+        self._run_start = None
+
+    def append(self, command):
+        """
+        Compile a single stripped, non-empty command line onto the program.
+
+        Lines that are always valid in form are compiled to their opcode, PLACE
+        lines that can never succeed become ERROR opcodes, and anything else
+        (unknown or custom commands, unusually formatted PLACE arguments) is
+        kept as a RAW line for Interface.execute. Consecutive MOVE, LEFT or
+        RIGHT commands are collapsed into a single REPEAT opcode.
+
+        Args:
+            command (str): The command line.
+        """
+        op = OPCODES.get(command)
+        if op is not None:
+            self.append_opcode(op)
+            return
+
+        self._run_start = None
+
+        if command.split(",")[0] == "PLACE":
+            args = command.split(",")[1:]
+            x = y = f = None
+            if len(args) == 3:
+                x, y, f = parse_int(args[0]), parse_int(args[1]), args[2]
+            if x is None or y is None or not Direction.is_valid_direction(f):
+                self._append_text(OP_ERROR, command)
+                return
+            if (command == f"PLACE,{x},{y},{f}"
+                    and _INT32_MIN <= x <= _INT32_MAX and _INT32_MIN <= y <= _INT32_MAX):
+                self.code.append(OP_PLACE)
+                self.code += PLACE_OPERANDS.pack(x, y, Direction.INDEX[f])
+                return
+
+        self._append_text(OP_RAW, command)
+
+    def append_opcode(self, op, count=1):
+        """
+        Append a MOVE, LEFT, RIGHT or REPORT opcode count times, extending the
+        previous REPEAT run where possible.
+
+        Args:
+            op (int): The opcode.
+            count (int): The number of times to append it.
+        """
+        code = self.code
+        if op == OP_REPORT:
+            self._run_start = None
+            code += bytes((op,)) * count
+            return
+        start = self._run_start
+        if start is not None:
+            if code[start] == op:
+                count += 1
+                del code[start:]
+            elif code[start] == OP_REPEAT and code[start + 1] == op:
+                count += REPEAT_OPERANDS.unpack_from(code, start + 1)[1]
+                del code[start:]
+        while count > _REPEAT_MAX:
+            code.append(OP_REPEAT)
+            code += REPEAT_OPERANDS.pack(op, _REPEAT_MAX)
+            count -= _REPEAT_MAX
+        self._run_start = len(code)
+        if count == 1:
+            code.append(op)
+        else:
+            code.append(OP_REPEAT)
+            code += REPEAT_OPERANDS.pack(op, count)
+
+    def _append_text(self, op, command):
+        self.code.append(op)
+        self.code += TEXT_OPERAND.pack(len(self.texts))
+        self.texts.append(command)
+
+    def to_bytes(self):
+        """
+        Serialize the opcode stream and text table.
+
+        Returns:
+            bytes: The serialized program.
+        """
+        parts = [PROGRAM_HEADER.pack(len(self.code), len(self.texts)), bytes(self.code)]
+        for text in self.texts:
+            encoded = text.encode()
+            parts.append(TEXT_OPERAND.pack(len(encoded)))
+            parts.append(encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, offset=0):
+        """
+        Deserialize a program produced by to_bytes().
+
+        Args:
+            data (bytes): The serialized data.
+            offset (int): Where the serialized program starts in data.
+
+        Returns:
+            Program: The deserialized program.
+
+        Raises:
+            ValueError: If the data is truncated or does not end where the
+                        header says it does.
+        """
+        try:
+            code_size, text_count = PROGRAM_HEADER.unpack_from(data, offset)
+            offset += PROGRAM_HEADER.size
+            if offset + code_size > len(data):
+                raise ValueError("Truncated program code")
+            code = bytearray(data[offset:offset + code_size])
+            offset += code_size
+            texts = []
+            for _ in range(text_count):
+                (size,) = TEXT_OPERAND.unpack_from(data, offset)
+                offset += TEXT_OPERAND.size
+                if offset + size > len(data):
+                    raise ValueError("Truncated program text")
+                texts.append(bytes(data[offset:offset + size]).decode())
+                offset += size
+        except struct.error as e:
+            raise ValueError(f"Truncated program: {e}") from None
+        if offset != len(data):
+            raise ValueError("Trailing data after program")
+        return cls(code, texts)
+
+
+def compile_commands(lines):
+    """
+    Compile command lines into a Program.
+
+    Blank lines are skipped and surrounding whitespace is stripped, as in
+    run_stream().
+
+    Args:
+        lines (Iterable[str]): The command lines.
+
+    Returns:
+        Program: The compiled program.
+    """
+    program = Program()
+    for line in lines:
+        command = line.strip()
+        if command:
+            program.append(command)
+    return program
+
+
+def compile_file(path):
+    """
+    Compile a command file into a Program.
+
+    Args:
+        path (str): Path to the command file.
+
+    Returns:
+        tuple: The compiled Program and the SHA-256 digest of the file.
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    program = Program()
+    with open(path, "rb", buffering=STREAM_BUFFER_SIZE) as file:
+        for line in file:
+            digest.update(line)
+            command = line.decode().strip()
+            if command:
+                program.append(command)
+    return program, digest.digest()
+
+
+def _file_digest(path):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(STREAM_BUFFER_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def load_program(path):
+    """
+    Load the compiled form of a command file, compiling it if necessary.
+
+    The compiled program is cached next to the source file (with a ".rbc"
+    suffix). The cache is reused while the source's mtime and size are
+    unchanged; otherwise it is only reused if the source's SHA-256 digest still
+    matches, in which case its header is updated to the new mtime. It is
+    rebuilt when the digest does not match or the cache is damaged. The cache
+    is replaced atomically, so concurrent loads never see a partial file.
+
+    Args:
+        path (str): Path to the command file.
+
+    Returns:
+        Program: The compiled program.
+    """
+    cache_path = path + PROGRAM_CACHE_SUFFIX
+    stat = os.stat(path)
+    try:
+        with open(cache_path, "rb") as file:
+            data = file.read()
+        magic, mtime_ns, size, digest = PROGRAM_CACHE_HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        magic = None
+
+    if magic == PROGRAM_CACHE_MAGIC and size == stat.st_size:
+        touched = mtime_ns != stat.st_mtime_ns
+        if not touched or digest == _file_digest(path):
+            try:
+                program = Program.from_bytes(data, PROGRAM_CACHE_HEADER.size)
+            except ValueError:
+                pass
+            else:
+                if touched:
+                    header = PROGRAM_CACHE_HEADER.pack(PROGRAM_CACHE_MAGIC, stat.st_mtime_ns, stat.st_size,
+                                                       digest)
+                    _write_cache(cache_path, header + data[PROGRAM_CACHE_HEADER.size:])
+                return program
+
+    program, digest = compile_file(path)
+    header = PROGRAM_CACHE_HEADER.pack(PROGRAM_CACHE_MAGIC, stat.st_mtime_ns, stat.st_size, digest)
+    _write_cache(cache_path, header + program.to_bytes())
+    return program
+
+
+def _write_cache(cache_path, data):
+    # The cache is an optimization, so failing to write it is not an error.
+    try:
+        write_atomically(cache_path, data)
+    except OSError:
+        pass
+
+
+
+def open_command_stream(path):
+    """
+    Open a command file for streaming.
+
+    The file is opened in binary mode with a large read buffer so that
+    iterating over it yields one line at a time without holding the whole
+    file in memory.
+
+    Args:
+        path (str): Path to the command file, or "-" for standard input.
+
+    Returns:
+        BinaryIO: A binary stream yielding one command line per iteration.
+                  Closing it never closes standard input itself.
+    """
+    if path == "-":
+        return open(sys.stdin.buffer.fileno(), "rb", buffering=STREAM_BUFFER_SIZE, closefd=False)
+    return open(path, "rb", buffering=STREAM_BUFFER_SIZE)
+
+
+def run_stream(interface, stream):
+    """
+    Execute every command from a stream in bounded memory.
+
+    Blank lines are skipped and surrounding whitespace is stripped, exactly
+    as when the file is read up front. Lines end with "\n" or "\r\n"; a lone
+    "\r" is not a line break, unlike in text-mode readlines(). Runs of
+    identical commands are handed to Interface.execute_repeated() so that
+    long MOVE, LEFT and RIGHT runs are fast-forwarded.
+
+    Args:
+        interface (Interface): The interface to execute commands on.
+        stream (Iterable[bytes]): A binary stream of command lines.
+
+    Returns:
+        int: The number of commands executed.
+    """
+    count = 0
+    execute = interface.execute
+    previous = None
+    repeat = 0
+    try:
+        for line in stream:
+            command = line.decode().strip()
+            if not command:
+                continue
+            if command == previous:
+                repeat += 1
+                continue
+            if repeat == 1:
+                execute(previous)
+            elif repeat:
+                interface.execute_repeated(previous, repeat)
+            count += repeat
+            previous = command
+            repeat = 1
+    finally:
+        # The pending run is executed even if reading a later line fails.
+        if repeat == 1:
+            execute(previous)
+        elif repeat:
+            interface.execute_repeated(previous, repeat)
+    return count + repeat
+
+
+def load_macros(path):
+    """
+    Read command blocks from a file, one block per group of lines separated
+    by blank lines.
+
+    Args:
+        path (str): The macro file.
+
+    Returns:
+        list: The blocks, each a list of stripped commands.
+    """
+    with open(path) as file:
+        text = file.read()
+    blocks = []
+    for group in text.replace("\r", "").split("\n\n"):
+        commands = [line.strip() for line in group.splitlines() if line.strip()]
+        if commands:
+            blocks.append(commands)
+    return blocks
+
+
+def find_repeated_blocks(commands, length, min_count=MACRO_MIN_COUNT, limit=MACRO_LIMIT):
+    """
+    Find the blocks of a given length that occur most often in a list of
+    commands.
+
+    Every window of length consecutive commands is counted, so occurrences
+    may overlap, and blocks of other lengths are not found. This is meant
+    for a sample of the input, such as its first MACRO_SAMPLE_LINES commands.
+
+    Args:
+        commands (Sequence[str]): The stripped, non-empty commands.
+        length (int): The block length.
+        min_count (int): The minimum number of occurrences.
+        limit (int): The maximum number of blocks returned.
+
+    Returns:
+        list: The blocks, most frequent first, each a list of commands.
+    """
+    counts = collections.Counter(
+        tuple(commands[i:i + length]) for i in range(len(commands) - length + 1))
+    return [list(block) for block, count in counts.most_common(limit) if count >= min_count]
+
+
+def _match_block(batch, i, lengths, blocks):
+    # The longest block starting at batch[i], as (commands, key), or None.
+    command = batch[i]
+    for length in lengths:
+        end = i + length
+        if end > len(batch):
+            continue
+        for block in blocks[length].get((command, batch[end - 1]), ()):
+            if batch[i:end] == block[0]:
+                return block
+    return None
+
+
+def run_macros(interface, stream, macros, cache):
+    """
+    Execute every command from a stream, running blocks that match one of
+    the macros through Interface.execute_block().
+
+    At each command, the longest macro starting with it that matches the
+    following commands is executed as a block; other commands are executed
+    one at a time. Blank lines are skipped and whitespace is stripped as in
+    run_stream().
+
+    Args:
+        interface (Interface): The interface to execute commands on.
+        stream (Iterable[bytes]): A binary stream of command lines.
+        macros (Iterable[Sequence[str]]): The command blocks to look for.
+        cache (TrajectoryCache): The cache for the macros' effects.
+
+    Returns:
+        int: The number of commands executed.
+    """
+    # Blocks indexed by length, then by their first and last command.
+    blocks = {}
+    for macro in macros:
+        commands = [command.strip() for command in macro if command.strip()]
+        if commands:
+            candidates = blocks.setdefault(len(commands), {})
+            candidates.setdefault((commands[0], commands[-1]), []).append((commands, block_key(commands)))
+    lengths = sorted(blocks, reverse=True)
+    firsts = {first for candidates in blocks.values() for first, _ in candidates}
+    longest = lengths[0] if lengths else 1
+
+    execute = interface.execute
+    execute_block = interface.execute_block
+    lines = (line.decode().strip() for line in stream)
+    pending = []
+    count = 0
+    done = False
+    while not done:
+        chunk = list(itertools.islice(lines, MACRO_BATCH_LINES))
+        done = len(chunk) < MACRO_BATCH_LINES
+        batch = pending + [command for command in chunk if command]
+        # Commands too close to the end of a batch wait for the next one,
+        # so that a macro is never split across batches.
+        stop = len(batch) if done else len(batch) - longest + 1
+        i = 0
+        while i < stop:
+            command = batch[i]
+            match = _match_block(batch, i, lengths, blocks) if command in firsts else None
+            if match is None:
+                execute(command)
+                i += 1
+            else:
+                execute_block(match[0], cache, match[1])
+                i += len(match[0])
+        count += i
+        pending = batch[i:]
+    return count
+
+
+def compile_buffer(buffer, start=0, end=None):
+    """
+    Compile the command lines in a byte range of a buffer.
+
+    Lines are split and matched against the fixed command vocabulary as
+    bytes, one chunk of the buffer at a time, so the common MOVE, LEFT, RIGHT
+    and REPORT lines are compiled without decoding them. Other lines are
+    decoded and compiled as usual.
+
+    A line belongs to the range that contains its first byte, so adjacent
+    ranges of the same buffer compile every line exactly once.
+
+    Args:
+        buffer (bytes | mmap.mmap): The command file contents.
+        start (int): The first byte of the range.
+        end (int): The end of the range. Defaults to the end of the buffer.
+
+    Returns:
+        Program: The compiled program.
+    """
+    program = Program()
+    append = program.append
+    append_opcode = program.append_opcode
+    get_opcode = BYTE_OPCODES.get
+    find = buffer.find
+    size = len(buffer)
+    end = size if end is None else min(end, size)
+
+    pos = start
+    if pos > 0 and buffer[pos - 1:pos] != b"\n":
+        pos = find(b"\n", pos)
+        pos = size if pos == -1 else pos + 1
+
+    while pos < end:
+        # Extend the chunk to the end of the line containing its last byte.
+        newline = find(b"\n", min(pos + STREAM_BUFFER_SIZE, end) - 1)
+        chunk_end = size if newline == -1 else newline + 1
+        previous = None
+        repeat = 0
+        # Runs of identical lines are appended at once. The trailing None
+        # ends the last run of the chunk.
+        for line in itertools.chain(buffer[pos:chunk_end].split(b"\n"), (None,)):
+            if line == previous:
+                repeat += 1
+                continue
+            op = get_opcode(previous)
+            if op is not None:
+                append_opcode(op, repeat)
+            elif previous:
+                command = previous.decode().strip()
+                if command:
+                    for _ in range(repeat):
+                        append(command)
+            previous = line
+            repeat = 1
+        pos = chunk_end
+    return program
+
+
+def run_mmap(interface, path, start=0, end=None, window=MMAP_WINDOW_SIZE):
+    """
+    Execute a byte range of a command file through a memory map.
+
+    The range is compiled and executed one window at a time, so memory use
+    stays bounded and several workers can each take a range of the same file.
+
+    Args:
+        interface (Interface): The interface to execute commands on.
+        path (str): Path to the command file.
+        start (int): The first byte of the range.
+        end (int): The end of the range. Defaults to the end of the file.
+        window (int): The number of bytes compiled at a time.
+
+    Returns:
+        int: The number of commands executed.
+    """
+    import mmap
+
+    count = 0
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            end = len(buffer) if end is None else min(end, len(buffer))
+            for pos in range(start, end, window):
+                count += interface.run_program(compile_buffer(buffer, pos, min(pos + window, end)))
+    return count
+
+
+def _get_state(interface):
+    position = interface.robot.position
+    return position.x, position.y, interface.robot.heading, interface.placed
+
+
+def _set_state(interface, state):
+    x, y, heading, placed = state
+    interface.robot.position.update(x, y)
+    interface.robot.heading = heading
+    interface.placed = placed
+
+
+def _compile_range(path, start, end):
+    import mmap
+
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return compile_buffer(buffer, start, end)
+
+
+def _decode_op(program, pc):
+    # Returns the opcode at pc (REPEAT is unwrapped), its command string, its
+    # repeat count and the next pc.
+    code = program.code
+    op = code[pc]
+    if op <= OP_REPORT:
+        return op, OPCODE_NAMES[op], 1, pc + 1
+    if op == OP_PLACE:
+        x, y, heading = PLACE_OPERANDS.unpack_from(code, pc + 1)
+        return op, f"PLACE,{x},{y},{Direction.NAMES[heading]}", 1, pc + 1 + PLACE_OPERANDS.size
+    if op == OP_REPEAT:
+        op, repeat = REPEAT_OPERANDS.unpack_from(code, pc + 1)
+        return op, OPCODE_NAMES[op], repeat, pc + 1 + REPEAT_OPERANDS.size
+    return op, program.texts[TEXT_OPERAND.unpack_from(code, pc + 1)[0]], 1, pc + 1 + TEXT_OPERAND.size
+
+
+def shard_transitions(path, start, end, environment, states):
+    """
+    Compute the transition table of a byte range of a command file.
+
+    Every start state is simulated at once by following only the distinct
+    states reached so far: start states that reach the same state (at a
+    valid PLACE, or when pushed against an edge) merge, and once a single
+    state is left the rest of the range runs as one ordinary program.
+
+    Args:
+        path (str): Path to the command file.
+        start (int): The first byte of the range.
+        end (int): The end of the range.
+        environment (Environment): The table.
+        states (list): The possible start states as (x, y, heading, placed).
+
+    Returns:
+        list: The end state reached from each start state, in order.
+    """
+    program = _compile_range(path, start, end)
+    interface = Interface(robot=Robot(environment=environment), output=NullSink())
+    robot = interface.robot
+    distinct = list(states)
+    owner = list(range(len(states)))
+    code = program.code
+    pc = 0
+    while pc < len(code) and len(distinct) > 1:
+        op, command, repeat, pc = _decode_op(program, pc)
+        if op == OP_REPORT or op == OP_ERROR:
+            # Never changes the state.
+            continue
+        reached = []
+        for state in distinct:
+            x, y, heading, placed = state
+            if op == OP_MOVE and placed:
+                robot.position.update(x, y)
+                robot.heading = heading
+                robot.move_many(repeat)
+                reached.append((robot.position.x, robot.position.y, heading, True))
+            elif op == OP_LEFT or op == OP_RIGHT:
+                if placed:
+                    state = (x, y, (heading + (repeat if op == OP_RIGHT else -repeat)) % 4, True)
+                reached.append(state)
+            elif op == OP_MOVE:
+                reached.append(state)
+            else:
+                _set_state(interface, state)
+                interface.execute(command)
+                reached.append(_get_state(interface))
+        index = {}
+        merged = [index.setdefault(state, len(index)) for state in reached]
+        if len(index) < len(reached):
+            owner = [merged[i] for i in owner]
+        distinct = list(index)
+    if pc < len(code):
+        _set_state(interface, distinct[0])
+        interface.run_program(Program(code[pc:], program.texts))
+        distinct = [_get_state(interface)]
+    return [distinct[i] for i in owner]
+
+
+def run_shard(path, start, end, environment, state, output_path=None):
+    """
+    Execute a byte range of a command file from a known start state.
+
+    Args:
+        path (str): Path to the command file.
+        start (int): The first byte of the range.
+        end (int): The end of the range.
+        environment (Environment): The table.
+        state (tuple): The start state as (x, y, heading, placed).
+        output_path (str): The file the output is written to, or None to
+                           discard it.
+
+    Returns:
+        tuple: The number of commands executed and the number of errors.
+    """
+    stream = open(output_path, "w") if output_path is not None else None
+    try:
+        output = BufferedSink(stream, STREAM_BUFFER_SIZE) if stream is not None else NullSink()
+        interface = Interface(robot=Robot(environment=environment), output=output)
+        _set_state(interface, state)
+        count = interface.run_program(_compile_range(path, start, end))
+        output.flush()
+    finally:
+        if stream is not None:
+            stream.close()
+    return count, interface.error_count
+
+
+def run_sharded(interface, path, jobs=None, shards=None):
+    """
+    Execute one command file across worker processes.
+
+    The file is split into byte ranges. In a first parallel pass, each range
+    is turned into a transition table from every possible start state (each
+    placed state on the table, plus the unplaced initial state) to its end
+    state. Composing the tables in order gives the exact state at the start
+    of every range, so a second parallel pass replays each range from its
+    known start state into a temporary file, and the files are copied to
+    the output in order.
+
+    Tables with more than SHARD_MAX_CELLS cells, single worker runs and,
+    unless shards is given, files smaller than SHARD_MIN_BYTES fall back to
+    run_mmap(). The interface is treated as a plain
+    Interface: custom commands and the command history are not used.
+
+    Args:
+        interface (Interface): The interface whose table, start state and
+                               output are used, and whose state is updated.
+        path (str): Path to the command file.
+        jobs (int): Number of worker processes. Defaults to the CPU count.
+        shards (int): Number of byte ranges. Defaults to SHARDS_PER_JOB per job.
+
+    Returns:
+        int: The number of commands executed.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import shutil
+    import tempfile
+
+    environment = interface.robot.environment
+    size = os.path.getsize(path)
+    jobs = jobs or os.cpu_count() or 1
+    if (jobs == 1 or (shards is None and size < SHARD_MIN_BYTES)
+            or not isinstance(environment, Environment)
+            or environment.width * environment.height > SHARD_MAX_CELLS):
+        return run_mmap(interface, path)
+
+    shards = shards or jobs * SHARDS_PER_JOB
+    bounds = [size * i // shards for i in range(shards + 1)]
+    initial = _get_state(interface)
+    states = [(x, y, heading, True)
+              for x in range(environment.width) for y in range(environment.height)
+              if environment.is_valid_position(x, y) for heading in range(4)]
+    if not initial[3]:
+        states.append(initial)
+    index = {state: i for i, state in enumerate(states)}
+
+    output = interface.output
+    discard = isinstance(output, NullSink)
+    with ProcessPoolExecutor(max_workers=jobs) as executor, tempfile.TemporaryDirectory() as directory:
+        tables = executor.map(shard_transitions, itertools.repeat(path), bounds[:-1], bounds[1:],
+                              itertools.repeat(environment), itertools.repeat(states))
+        starts = [initial]
+        for table in tables:
+            starts.append(table[index[starts[-1]]])
+
+        output_paths = [None if discard else os.path.join(directory, f"{i}.out") for i in range(shards)]
+        results = executor.map(run_shard, itertools.repeat(path), bounds[:-1], bounds[1:],
+                               itertools.repeat(environment), starts[:-1], output_paths)
+        count = 0
+        for (executed, errors), output_path in zip(results, output_paths):
+            count += executed
+            interface.error_count += errors
+            if discard:
+                continue
+            with open(output_path) as file:
+                if isinstance(output, BufferedSink):
+                    output.flush()
+                    shutil.copyfileobj(file, output.stream, STREAM_BUFFER_SIZE)
+                else:
+                    for line in file:
+                        output.write(line[:-1])
+            os.remove(output_path)
+
+    _set_state(interface, starts[-1])
+    return count
+
+
+def encode_snapshot(states, offset=0, commands=0, input_digest=b""):
+    """
+    Pack robot states into the binary snapshot format.
+
+    A snapshot is a SNAPSHOT_HEADER followed by one fixed-size SNAPSHOT_RECORD
+    per robot and then the history data of every record, in record order.
+    Because the records are fixed-size, a whole fleet can be read back as a
+    single array.
+
+    Args:
+        states (Iterable[tuple]): States as returned by Interface.snapshot().
+        offset (int): The byte offset in the input file the states correspond to.
+        commands (int): The number of commands executed so far.
+        input_digest (bytes): The SHA-256 digest of the input up to offset.
+
+    Returns:
+        bytes: The snapshot.
+    """
+    records = []
+    histories = []
+    for x, y, heading, placed, error_count, policy, size, data in states:
+        records.append(SNAPSHOT_RECORD.pack(x, y, heading, placed, error_count, policy, size, len(data)))
+        histories.append(data)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, offset, commands, len(records),
+                                  input_digest)
+    return b"".join([header, *records, *histories])
+
+
+def decode_snapshot(data):
+    """
+    Unpack a snapshot written by encode_snapshot().
+
+    Args:
+        data (bytes): The snapshot.
+
+    Returns:
+        tuple: The input byte offset, the number of commands executed and the
+               list of robot states.
+
+    Raises:
+        ValueError: If the data is not a snapshot of a supported version.
+    """
+    try:
+        magic, version, offset, commands, count, _ = SNAPSHOT_HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError("Truncated snapshot") from None
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError("Not a supported snapshot")
+    pos = SNAPSHOT_HEADER.size + count * SNAPSHOT_RECORD.size
+    if len(data) < pos:
+        raise ValueError("Truncated snapshot")
+    states = []
+    for record in SNAPSHOT_RECORD.iter_unpack(data[SNAPSHOT_HEADER.size:pos]):
+        length = record[-1]
+        states.append(record[:-1] + (bytes(data[pos:pos + length]),))
+        pos += length
+    if len(data) < pos:
+        raise ValueError("Truncated snapshot")
+    return offset, commands, states
+
+
+def write_atomically(path, data):
+    """
+    Write a file so that readers see either the old or the new contents,
+    even if the process is killed mid-write.
+
+    Args:
+        path (str): The file to write.
+        data (bytes): The new contents.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_snapshot(path, states, offset=0, commands=0, input_digest=b""):
+    """
+    Atomically write a snapshot file.
+
+    Args:
+        path (str): The snapshot file.
+        states (Iterable[tuple]): States as returned by Interface.snapshot().
+        offset (int): The byte offset in the input file the states correspond to.
+        commands (int): The number of commands executed so far.
+        input_digest (bytes): The SHA-256 digest of the input up to offset.
+    """
+    write_atomically(path, encode_snapshot(states, offset, commands, input_digest))
+
+
+def load_snapshot(path):
+    """
+    Read a snapshot file written by save_snapshot().
+
+    Args:
+        path (str): The snapshot file.
+
+    Returns:
+        tuple: The input byte offset, the number of commands executed and the
+               list of robot states.
+
+    Raises:
+        ValueError: If the file is not a snapshot of a supported version.
+    """
+    with open(path, "rb") as file:
+        return decode_snapshot(file.read())
+
+
+def read_reports(path):
+    """
+    Read the records of a binary report file written by a ReportSink.
+
+    The file is read in large chunks; for random access, memory-map it with
+    fleet.load_reports() or numpy.memmap at offset REPORT_HEADER.size. A
+    trailing partial record, as left by an interrupted run, is ignored.
+
+    Args:
+        path (str): The report file.
+
+    Yields:
+        tuple: (command index, x, y, heading) for each REPORT.
+
+    Raises:
+        ValueError: If the file is not a report file of a supported version.
+    """
+    with open(path, "rb", buffering=0) as file:
+        header = file.read(REPORT_HEADER.size)
+        if len(header) < REPORT_HEADER.size or REPORT_HEADER.unpack(header) != (REPORT_MAGIC, REPORT_VERSION):
+            raise ValueError("Not a supported report file")
+        chunk_size = REPORT_RECORD.size * (STREAM_BUFFER_SIZE // REPORT_RECORD.size)
+        pending = b""
+        while True:
+            data = file.read(chunk_size)
+            if not data:
+                return
+            data = pending + data
+            end = len(data) - len(data) % REPORT_RECORD.size
+            yield from REPORT_RECORD.iter_unpack(data[:end])
+            pending = data[end:]
+
+
+def format_reports(path):
+    """
+    Format the records of a binary report file as the text REPORT lines.
+
+    Args:
+        path (str): The report file.
+
+    Yields:
+        str: "Report: x,y,DIRECTION" for each REPORT.
+
+    Raises:
+        ValueError: If the file is not a report file of a supported version.
+    """
+    names = Direction.NAMES
+    for _, x, y, heading in read_reports(path):
+        yield f"Report: {x},{y},{names[heading]}"
+
+
+def run_checkpointed(interface, stream, checkpoint_path, every=CHECKPOINT_INTERVAL, resume=False):
+    """
+    Execute a command stream, saving a snapshot every few lines.
+
+    After every batch of lines the output sink is flushed and the interface
+    state is saved to checkpoint_path together with the byte offset of the
+    next unread line and the SHA-256 digest of the input before it. With
+    resume, an existing checkpoint is restored and the input up to its offset
+    is read and checked against that digest, so a killed run continues where
+    its last checkpoint left off. Output written after that checkpoint is
+    repeated.
+
+    Args:
+        interface (Interface): The interface to execute commands on.
+        stream (BinaryIO): A binary stream of command lines, read from its
+                           start.
+        checkpoint_path (str): The snapshot file.
+        every (int): The number of input lines between checkpoints.
+        resume (bool): Continue from checkpoint_path if it exists.
+
+    Returns:
+        int: The number of commands executed by this call.
+
+    Raises:
+        ValueError: If the checkpoint was not written for this input, for
+                    example because the file has been edited since.
+    """
+    import hashlib
+
+    offset = total = 0
+    digest = hashlib.sha256()
+    if resume and os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "rb") as file:
+            data = file.read()
+        offset, total, states = decode_snapshot(data)
+        input_digest = SNAPSHOT_HEADER.unpack_from(data)[-1]
+        remaining = offset
+        while remaining:
+            chunk = stream.read(min(remaining, STREAM_BUFFER_SIZE))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+        if remaining or digest.digest() != input_digest:
+            raise ValueError(f"Checkpoint '{checkpoint_path}' does not match the input; not resuming")
+        interface.restore(states[0])
+
+    count = 0
+    while True:
+        lines = list(itertools.islice(stream, every))
+        if not lines:
+            break
+        executed = run_stream(interface, lines)
+        count += executed
+        total += executed
+        data = b"".join(lines)
+        offset += len(data)
+        digest.update(data)
+        interface.output.flush()
+        save_snapshot(checkpoint_path, [interface.snapshot()], offset, total, digest.digest())
+    return count
+
+
+def run_file(path, compiled=False):
+    """
+    Run one command file on a fresh 5x5 environment and summarize the result.
+
+    This is the unit of work of run_batch(), so it is a module-level function
+    that can be sent to worker processes.
+
+    Args:
+        path (str): Path to the command file.
+        compiled (bool): Run the file's cached compiled form instead of
+                         streaming it.
+
+    Returns:
+        dict: The file path, the number of commands and errors, the last
+              line of output and the elapsed time in seconds.
+    """
+    output = CollectingSink(maxlen=1)
+    interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+    start = time.perf_counter()
+    if compiled:
+        executed = interface.run_program(load_program(path))
+    else:
+        with open_command_stream(path) as stream:
+            executed = run_stream(interface, stream)
+    return {
+        "file": path,
+        "commands": executed,
+        "errors": interface.error_count,
+        "last_output": output.lines[-1] if output.lines else None,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def _run_batch_file(path, compiled=False):
+    # A file that cannot be read or decoded fails on its own, not the batch.
+    try:
+        return run_file(path, compiled)
+    except (OSError, ValueError) as e:
+        return {"file": path, "error": str(e)}
+
+
+def run_batch(directory, pattern="*.txt", jobs=None, compiled=False):
+    """
+    Run every matching command file in a directory across a process pool.
+
+    Each file is run in a worker process with its own Environment, Robot
+    and Interface. Results are yielded in sorted file order regardless of
+    which worker finishes first. A file that cannot be read or decoded gets
+    a result with its path and an "error" message instead of aborting the
+    batch.
+
+    The pattern matches every file name in the directory, so a directory
+    that also holds expected-output files needs a narrower pattern, such as
+    "*_input.txt" for robot_tests.
+
+    Args:
+        directory (str): The directory containing the command files.
+        pattern (str): Glob pattern selecting the command files.
+        jobs (int): Number of worker processes. Defaults to the CPU count.
+        compiled (bool): Run each file's cached compiled form.
+
+    Yields:
+        dict: The result of run_file() for each file, or its error.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import fnmatch
+    import functools
+
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if fnmatch.fnmatch(name, pattern) and os.path.isfile(os.path.join(directory, name))
+    )
+    if jobs == 1:
+        for path in paths:
+            yield _run_batch_file(path, compiled)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(functools.partial(_run_batch_file, compiled=compiled), paths)
+
+
+def peak_rss_bytes():
+    """
+    Return the peak resident set size of the current process.
+
+    Returns:
+        int | None: The peak RSS in bytes, or None if the platform does not
+                    provide it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_default(command_file):
+    """
+    Run a command file with the default settings and print its output.
+
+    This is what "python -m robot FILE" does. It is kept separate from main()
+    so that the common case does not pay for importing argparse.
+
+    Args:
+        command_file (str): Path to the command file, or "-" for stdin.
+
+    Returns:
+        int: The exit status.
+    """
+    output = BufferedSink(sys.stdout)
+    interface = Interface(robot=Robot(output=output))
+    try:
+        with open_command_stream(command_file) as stream:
+            run_stream(interface, stream)
+    except FileNotFoundError:
+        error = f"File '{command_file}' not found."
+    except ValueError as e:
+        error = str(e)
+    else:
+        error = None
+    # Output of the commands that ran comes before the error.
+    output.flush()
+    if error is not None:
+        print(f"Error: {error}")
+        return 1
+    return 0
+
+
+def main(argv=None):
+    """
+    Run the command-line simulator.
+
+    A lone command file argument is handed straight to _run_default(); the
+    argument parser is only built when options are given.
+
+    Args:
+        argv (list): The command-line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: The exit status.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if len(argv) == 1 and (argv[0] == "-" or not argv[0].startswith("-")):
+        return _run_default(argv[0])
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Robot Simulator")
+    parser.add_argument("command_file", type=str, nargs="?",
+                        help="Path to the command file, or '-' for stdin")
+    parser.add_argument("--batch", metavar="DIR",
+                        help="Run every command file in DIR and print one JSON result per file")
+    parser.add_argument("--pattern", default="*.txt",
+                        help="Glob pattern selecting command files in --batch mode; use "
+                             "'*_input.txt' to skip the expected files in robot_tests")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Number of worker processes in --batch and --parallel mode "
+                             "(default: CPU count)")
+    parser.add_argument("--summary", action="store_true",
+                        help="Print peak RSS and commands/sec to stderr when finished")
+    parser.add_argument("--output", choices=["buffered", "null"], default="buffered",
+                        help="Where command output goes: buffered stdout or discarded")
+    parser.add_argument("--flush-size", type=int, default=1 << 16,
+                        help="Characters of buffered output that trigger a write")
+    parser.add_argument("--compiled", action="store_true",
+                        help="Run the file's cached compiled form, compiling it if stale")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Read the command file through a memory map")
+    parser.add_argument("--parallel", action="store_true",
+                        help="Split the command file into chunks executed by --jobs worker processes")
+    parser.add_argument("--width", type=int, default=5, help="Width of the table")
+    parser.add_argument("--height", type=int, default=5, help="Height of the table")
+    parser.add_argument("--obstacles", metavar="FILE",
+                        help="Obstacle file: 'x,y' lines or a binary bitmap")
+    parser.add_argument("--random-obstacles", type=int, metavar="N",
+                        help="Block N random cells of the table")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for --random-obstacles")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print per-command counts and latency histograms to stderr")
+    parser.add_argument("--checkpoint", metavar="PATH",
+                        help="Save a snapshot of the simulator state to PATH while running")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_INTERVAL, metavar="N",
+                        help="Input lines between checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the --checkpoint snapshot if it exists")
+    parser.add_argument("--macros", metavar="FILE",
+                        help="Cache the effect of these command blocks, separated by blank lines")
+    parser.add_argument("--detect-macros", type=int, metavar="LENGTH",
+                        help="Cache the most frequent LENGTH-command blocks at the start of the file")
+    parser.add_argument("--macro-cache-mb", type=float, default=TRAJECTORY_CACHE_BYTES / (1 << 20),
+                        help="Memory cap of the macro cache in MiB")
+    parser.add_argument("--report-format", choices=["text", "binary"], default="text",
+                        help="Write the usual text output, or only REPORT results as binary records")
+    parser.add_argument("--report-file", metavar="PATH",
+                        help="Where binary report records go (default: stdout)")
+    parser.add_argument("--format-reports", metavar="PATH",
+                        help="Print the records of a binary report file as text and exit")
+
+    args = parser.parse_args(argv)
+
+    if args.batch is not None:
+        import json
+
+        status = 0
+        for result in run_batch(args.batch, args.pattern, args.jobs, args.compiled):
+            print(json.dumps(result))
+            if "error" in result:
+                status = 1
+        return status
+
+    if args.format_reports is not None:
+        try:
+            for line in format_reports(args.format_reports):
+                print(line)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return 1
+        return 0
+
+    if args.command_file is None:
+        parser.error("a command file or --batch DIR is required")
+
+    command_file = args.command_file
+    if args.resume and args.checkpoint is None:
+        parser.error("--resume requires --checkpoint")
+    if args.checkpoint is not None and (args.compiled or args.mmap):
+        parser.error("--checkpoint cannot be combined with --compiled or --mmap")
+    if args.stats and (args.compiled or args.mmap):
+        parser.error("--stats cannot be combined with --compiled or --mmap")
+    if args.parallel and (args.checkpoint is not None or args.stats or args.compiled or args.mmap):
+        parser.error("--parallel cannot be combined with --checkpoint, --stats, --compiled or --mmap")
+    if args.resume and command_file == "-":
+        parser.error("--resume requires a command file, not stdin")
+    if command_file == "-" and (args.parallel or args.compiled or args.mmap):
+        parser.error("--parallel, --compiled and --mmap require a command file, not stdin")
+    use_macros = args.macros is not None or args.detect_macros is not None
+    if use_macros and (args.checkpoint is not None or args.parallel or args.compiled or args.mmap):
+        parser.error("--macros and --detect-macros cannot be combined with --checkpoint, "
+                     "--parallel, --compiled or --mmap")
+    if args.detect_macros is not None and (command_file == "-" or args.detect_macros < 1):
+        parser.error("--detect-macros requires a command file and a positive LENGTH")
+    binary = args.report_format == "binary"
+    if binary and (args.checkpoint is not None or args.parallel or args.output == "null"):
+        parser.error("--report-format binary cannot be combined with --checkpoint, --parallel "
+                     "or --output null")
+    if args.report_file is not None and not binary:
+        parser.error("--report-file requires --report-format binary")
+
+    # In binary mode stdout may carry the records, so errors go to stderr.
+    errors = sys.stderr if binary else sys.stdout
+    report_file = None
+    if binary:
+        try:
+            report_file = open(args.report_file, "wb") if args.report_file is not None else None
+        except OSError as e:
+            print(f"Error: {e}", file=errors)
+            return 1
+        output = ReportSink(report_file)
+    elif args.output == "null":
+        output = NullSink()
+    else:
+        output = BufferedSink(sys.stdout, flush_size=args.flush_size)
+
+    try:
+        obstacles = None
+        if args.obstacles is not None:
+            try:
+                obstacles = load_obstacles(args.obstacles, args.width, args.height)
+            except (OSError, ValueError) as e:
+                print(f"Error: {e}", file=errors)
+                return 1
+        elif args.random_obstacles is not None:
+            try:
+                obstacles = ObstacleBitmap.random(args.width, args.height, args.random_obstacles, args.seed)
+            except ValueError as e:
+                print(f"Error: {e}", file=errors)
+                return 1
+
+        macros = []
+        if args.macros is not None:
+            try:
+                macros = load_macros(args.macros)
+            except OSError as e:
+                print(f"Error: {e}", file=errors)
+                return 1
+        cache = TrajectoryCache(int(args.macro_cache_mb * (1 << 20))) if use_macros else None
+
+        env = Environment(args.width, args.height, obstacles)
+        robot = Robot(environment=env, output=output)
+        interface = (InstrumentedInterface if args.stats else Interface)(robot=robot)
+
+        start = time.perf_counter()
+        # Stream commands from the provided file and execute them
+        try:
+            if args.checkpoint is not None:
+                with open_command_stream(command_file) as stream:
+                    executed = run_checkpointed(interface, stream, args.checkpoint,
+                                                args.checkpoint_every, args.resume)
+            elif args.parallel:
+                executed = run_sharded(interface, command_file, args.jobs)
+            elif args.compiled:
+                executed = interface.run_program(load_program(command_file))
+            elif args.mmap:
+                executed = run_mmap(interface, command_file)
+            elif use_macros:
+                if args.detect_macros is not None:
+                    with open_command_stream(command_file) as stream:
+                        sample = [command for command in (line.decode().strip() for line in
+                                                          itertools.islice(stream, MACRO_SAMPLE_LINES))
+                                  if command]
+                    macros += find_repeated_blocks(sample, args.detect_macros)
+                with open_command_stream(command_file) as stream:
+                    executed = run_macros(interface, stream, macros, cache)
+            else:
+                with open_command_stream(command_file) as stream:
+                    executed = run_stream(interface, stream)
+        except FileNotFoundError:
+            output.flush()
+            print(f"Error: File '{command_file}' not found.", file=errors)
+            return 1
+        except ValueError as e:
+            # Output of the commands that ran comes before the error.
+            output.flush()
+            print(f"Error: {e}", file=errors)
+            return 1
+        output.flush()
+        elapsed = time.perf_counter() - start
+
+        if args.summary:
+            rate = executed / elapsed if elapsed > 0 else float("inf")
+            peak = peak_rss_bytes()
+            peak_text = f"{peak / (1 << 20):.1f} MiB" if peak is not None else "unavailable"
+            print(f"Executed {executed} commands in {elapsed:.3f}s "
+                  f"({rate:,.0f} commands/sec), peak RSS {peak_text}", file=sys.stderr)
+            if cache is not None:
+                stats = cache.stats()
+                print(f"Macro cache: {stats['hits']} hits, {stats['misses']} misses, "
+                      f"{stats['evictions']} evictions, {stats['entries']} entries, "
+                      f"{stats['bytes'] / (1 << 20):.1f} MiB", file=sys.stderr)
+
+        if args.stats:
+            print(interface.stats.format(), file=sys.stderr)
+        return 0
+    finally:
+        # A report file always gets at least its header.
+        output.flush()
+        if report_file is not None:
+            report_file.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
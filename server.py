@@ -0,0 +1,207 @@
+"""
+Robot Simulator Server
+------------------------
+
+This module implements a long-lived simulator server, so that clients can run
+commands without starting a new robot.py process for every replay.
+
+The server listens on a TCP or Unix socket and speaks a line protocol. Every
+request line gets exactly one response line, in order, so clients may pipeline
+as many requests as they like:
+
+    SESSION <name>   Attach the connection to a named session, creating it if
+                     needed. Named sessions outlive the connection. Responds OK.
+    QUIT             Close the connection. Responds OK.
+    <command>        Run a robot command (PLACE, MOVE, LEFT, RIGHT, REPORT) on
+                     the current session. Responds with the REPORT line, the
+                     error message, or OK.
+
+Until a SESSION request, a connection uses its own anonymous session, which is
+discarded when the connection closes. Bytes that are not valid UTF-8 are
+replaced, and a connection that sends more than MAX_LINE_SIZE bytes without a
+newline gets an error line and is closed.
+
+Classes:
+    SimulatorServer: Holds the sessions and serves client connections.
+"""
+
+
+import argparse
+import asyncio
+import sys
+
+from robot import CollectingSink, Environment, Interface, Robot
+
+READ_SIZE = 1 << 16
+# The longest request line accepted, like asyncio.StreamReader's limit.
+MAX_LINE_SIZE = 1 << 16
+
+
+class SimulatorServer:
+    """
+    Serves robot sessions over a line protocol.
+
+    Attributes:
+        environment (Environment): The table used by every session.
+        sessions (dict): Maps session names to their Interface.
+    """
+
+    def __init__(self, environment=None):
+        """
+        Initialize a server with no sessions.
+
+        Args:
+            environment (Environment): The table used by every session.
+                                       Defaults to 5x5.
+        """
+        self.environment = environment if environment is not None else Environment(5, 5)
+        self.sessions = {}
+        # All sessions write to one sink, which is drained after every command.
+        # Commands never interleave because they run on the event loop thread.
+        self._output = CollectingSink()
+
+    def new_session(self):
+        """
+        Create a session that is not registered under a name.
+
+        Returns:
+            Interface: The new session.
+        """
+        return Interface(robot=Robot(environment=self.environment), output=self._output)
+
+    def session(self, name):
+        """
+        Return a named session, creating it if necessary.
+
+        Args:
+            name (str): The session name.
+
+        Returns:
+            Interface: The session.
+        """
+        interface = self.sessions.get(name)
+        if interface is None:
+            interface = self.sessions[name] = self.new_session()
+        return interface
+
+    def run(self, interface, command):
+        """
+        Run a robot command on a session.
+
+        Args:
+            interface (Interface): The session.
+            command (str): The command string.
+
+        Returns:
+            str: The response line, without a newline.
+        """
+        lines = self._output.lines
+        lines.clear()
+        try:
+            status = interface.run_command(command)
+        except Exception as e:
+            return f"Error: {e}"
+        if status:
+            return f"Error: {status.message(command)}"
+        return lines[-1] if lines else "OK"
+
+    async def handle_client(self, reader, writer):
+        """
+        Serve one client connection until it sends QUIT or disconnects.
+
+        Requests are read in large chunks and the responses to every complete
+        line in a chunk are written back together. The connection is closed
+        with an error line if a request line grows past MAX_LINE_SIZE.
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader.
+            writer (asyncio.StreamWriter): The connection's writer.
+        """
+        interface = self.new_session()
+        pending = bytearray()
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                pending += data
+                end = pending.rfind(b"\n") + 1
+                lines = pending[:end].split(b"\n")[:-1]
+                del pending[:end]
+                responses = []
+                closing = False
+                for line in lines:
+                    request = line.decode(errors="replace").strip()
+                    if request.startswith("SESSION "):
+                        interface = self.session(request[len("SESSION "):].strip())
+                        responses.append("OK")
+                    elif request == "QUIT":
+                        responses.append("OK")
+                        closing = True
+                        break
+                    else:
+                        responses.append(self.run(interface, request))
+                if not closing and len(pending) > MAX_LINE_SIZE:
+                    responses.append(f"Error: Line longer than {MAX_LINE_SIZE} bytes")
+                    closing = True
+                if responses:
+                    responses.append("")
+                    writer.write("\n".join(responses).encode())
+                    await writer.drain()
+                if closing:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host="127.0.0.1", port=8765, path=None):
+        """
+        Start listening.
+
+        Args:
+            host (str): The TCP host.
+            port (int): The TCP port. Use 0 to pick a free port.
+            path (str): A Unix socket path. If given, host and port are ignored.
+
+        Returns:
+            asyncio.base_events.Server: The listening server.
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_client, path=path)
+        return await asyncio.start_server(self.handle_client, host, port)
+
+
+async def serve(host, port, path, environment):
+    """
+    Run a SimulatorServer until cancelled.
+
+    Args:
+        host (str): The TCP host.
+        port (int): The TCP port.
+        path (str): A Unix socket path, or None to use TCP.
+        environment (Environment): The table used by every session.
+    """
+    server = await SimulatorServer(environment).start(host, port, path)
+    address = path if path is not None else ":".join(str(part) for part in server.sockets[0].getsockname()[:2])
+    print(f"Listening on {address}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Robot Simulator Server")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    parser.add_argument("--unix", metavar="PATH", help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--width", type=int, default=5, help="Width of the table")
+    parser.add_argument("--height", type=int, default=5, help="Height of the table")
+
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, Environment(args.width, args.height)))
+    except KeyboardInterrupt:
+        pass
@@ -1,9 +1,28 @@
-from contextlib import redirect_stdout
+from contextlib import redirect_stderr, redirect_stdout
+import hashlib
 import io
+import itertools
 import os
 import random
+import sys
+import tempfile
 import unittest
-from robot import Direction, Environment, Interface, Position, Robot
+
+import robot
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from robot import (OP_ERROR, OP_MOVE, OP_PLACE, OP_RAW, PROGRAM_CACHE_HEADER, REPORT_RECORD,
+                   BufferedSink, CollectingSink, CommandStats, DigestSink, Direction, Environment,
+                   InstrumentedInterface, Interface, NullSink, ObstacleBitmap, ObstacleSet,
+                   Position, Program, ReportSink, Robot, Status, StdoutSink, TrajectoryCache,
+                   compile_buffer, compile_commands, find_repeated_blocks, format_reports,
+                   load_obstacles, load_program, load_snapshot, parse_int, read_reports, run_batch,
+                   run_checkpointed, run_macros, run_mmap, run_sharded, run_stream, save_snapshot,
+                   write_atomically)
 
 
 class TestDirection(unittest.TestCase):
@@ -19,6 +38,15 @@ class TestDirection(unittest.TestCase):
         self.assertEqual(Direction.rotate_right(Direction.SOUTH), Direction.WEST)
         self.assertEqual(Direction.rotate_right(Direction.WEST), Direction.NORTH)
 
+    def test_heading_tables(self):
+        for heading, name in enumerate(Direction.NAMES):
+            self.assertEqual(Direction.INDEX[name], heading)
+            self.assertEqual(Direction.NAMES[(heading + 1) % 4], Direction.rotate_right(name))
+        self.assertEqual((Direction.DX[Direction.INDEX[Direction.EAST]],
+                          Direction.DY[Direction.INDEX[Direction.EAST]]), (1, 0))
+        self.assertIsNone(Direction.rotate_left("UP"))
+        self.assertFalse(Direction.is_valid_direction("UP"))
+
 class TestEnvironment(unittest.TestCase):
     def test_is_valid_position(self):
 
@@ -59,6 +87,48 @@ class TestEnvironment(unittest.TestCase):
         # Y > y_max
         self.assertFalse(env.is_valid_position(4, y_max+1))
 
+    def test_obstacles(self):
+        for obstacles in [ObstacleBitmap(5, 5), ObstacleSet(5, 5)]:
+            with self.subTest(obstacles=type(obstacles).__name__):
+                obstacles.add(2, 3)
+                env = Environment(5, 5, obstacles)
+                self.assertEqual(len(obstacles), 1)
+                self.assertFalse(env.is_valid_position(2, 3))
+                self.assertTrue(env.is_valid_position(3, 2))
+                self.assertEqual(env.free_distance(2, 0, Direction.INDEX[Direction.NORTH], 10), 2)
+                self.assertEqual(env.free_distance(0, 3, Direction.INDEX[Direction.EAST], 10), 1)
+                self.assertEqual(env.free_distance(0, 3, Direction.INDEX[Direction.WEST], 10), 0)
+
+    def test_load_obstacles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            text_path = os.path.join(directory, "obstacles.txt")
+            with open(text_path, "w") as f:
+                f.write("# warehouse\n1,1\n\n4,0\n")
+            sparse = load_obstacles(text_path, 1000, 1000)
+            self.assertIsInstance(sparse, ObstacleSet)
+            dense = load_obstacles(text_path, 5, 5)
+            self.assertIsInstance(dense, ObstacleBitmap)
+            for obstacles in [sparse, dense]:
+                self.assertTrue(obstacles.is_blocked(1, 1))
+                self.assertTrue(obstacles.is_blocked(4, 0))
+                self.assertFalse(obstacles.is_blocked(0, 4))
+
+            bitmap_path = os.path.join(directory, "obstacles.bin")
+            ObstacleBitmap.random(50, 40, 100, seed=1).save(bitmap_path)
+            loaded = load_obstacles(bitmap_path, 50, 40)
+            self.assertEqual(loaded.bits, ObstacleBitmap.random(50, 40, 100, seed=1).bits)
+            self.assertEqual(len(loaded), 100)
+            self.assertEqual(len(ObstacleBitmap.random(5, 5, 25)), 25)
+            with self.assertRaises(ValueError):
+                ObstacleBitmap.random(5, 5, 26)
+
+            with self.assertRaises(ValueError):
+                load_obstacles(bitmap_path, 40, 50)
+            with open(text_path, "w") as f:
+                f.write("5,5\n")
+            with self.assertRaises(ValueError):
+                load_obstacles(text_path, 5, 5)
+
 class TestPosition(unittest.TestCase):
     def test_update(self):
         pos = Position(0, 0)
@@ -82,6 +152,13 @@ class TestRobot(unittest.TestCase):
         self.env = Environment(5, 5)
         self.robot = Robot(environment=self.env)
 
+    def test_invalid_direction(self):
+        with self.assertRaisesRegex(ValueError, "^Invalid direction: UP$"):
+            Robot(f="UP", environment=self.env)
+        with self.assertRaisesRegex(ValueError, "^Invalid direction: DOWN$"):
+            self.robot.f = "DOWN"
+        self.assertEqual(self.robot.f, Direction.NORTH)
+
     def test_place(self):
         # Test valid position
         self.assertTrue(self.robot.place(1, 1, Direction.NORTH))
@@ -205,6 +282,74 @@ class TestInterface(unittest.TestCase):
         self.assertFalse(self.interface.is_command_prohibited("REPORT"))
         self.assertFalse(self.interface.is_command_prohibited("PLACE"))
 
+    def test_command_history_policies(self):
+        commands = ["MOVE", "PLACE,1,1,NORTH", "MOVE", "JUMP", "LEFT", "REPORT"]
+        expected = ["PLACE", "MOVE", "LEFT", "REPORT"]
+
+        for history, expected_history in [("off", []), ("ring", expected[-2:]), ("full", expected)]:
+            with self.subTest(history=history):
+                interface = Interface(robot=Robot(environment=self.env), output=NullSink(),
+                                      history=history, history_size=2)
+                for command in commands:
+                    interface.execute(command)
+                self.assertTrue(interface.placed)
+                self.assertEqual(interface.history(), expected_history)
+
+        with self.assertRaises(ValueError):
+            Interface(robot=self.robot, history="forever")
+
+    def test_place_updates_position_in_place(self):
+        position = self.robot.position
+        self.interface.parse_command("PLACE,1,2,EAST")
+        self.interface.parse_command("PLACE,3,4,WEST")
+        self.assertIs(self.robot.position, position)
+        self.assertEqual((position.x, position.y, self.robot.f), (3, 4, Direction.WEST))
+        for obj in (position, self.robot, self.env, self.interface):
+            self.assertFalse(hasattr(obj, "__dict__"), type(obj).__name__)
+
+    def test_custom_commands(self):
+        calls = []
+        interface = Interface(robot=Robot(environment=self.env), output=NullSink(),
+                              custom_commands={"BEEP": lambda: calls.append("BEEP") or True,
+                                               "MOVE": lambda: False})
+        self.assertEqual(interface.run_command("BEEP"), Status.ILLEGAL)
+        interface.parse_command("PLACE,0,0,NORTH")
+        self.assertEqual(interface.run_command("BEEP"), Status.OK)
+        # Built-in commands take precedence over custom ones.
+        self.assertEqual(interface.run_command("MOVE"), Status.OK)
+        self.assertEqual(calls, ["BEEP"])
+
+    def test_custom_command_schema(self):
+        def jump(robot, steps, f):
+            robot.f = f
+            return robot.move_many(steps) == steps
+
+        interface = Interface(robot=Robot(environment=self.env), output=NullSink(),
+                              custom_commands={"JUMP": (jump, (parse_int, str))})
+        self.assertEqual(interface.run_command("JUMP,2,EAST"), Status.ILLEGAL)
+        interface.parse_command("PLACE,0,0,NORTH")
+        self.assertEqual(interface.run_command("JUMP,2,EAST"), Status.OK)
+        self.assertEqual(interface.robot.report(), "Report: 2,0,EAST")
+        for command in ["JUMP", "JUMP,2", "JUMP,x,EAST", "JUMP,2,EAST,1", "JUMP,9,NORTH"]:
+            self.assertEqual(interface.run_command(command), Status.INVALID_ARGUMENTS, command)
+
+        interface.register_command("HOME", lambda robot: robot.place(0, 0, Direction.NORTH))
+        self.assertEqual(interface.run_command("HOME,ignored"), Status.OK)
+        self.assertEqual(interface.history(), [])
+        with self.assertRaises(ValueError):
+            interface.register_command("MOVE", jump)
+        # Interfaces without custom commands share the built-in table.
+        self.assertIs(self.interface.commands, Interface().commands)
+
+    def test_default_arguments_are_not_shared(self):
+        first, second = Interface(output=NullSink()), Interface(output=NullSink())
+        self.assertIsNot(first.robot, second.robot)
+        self.assertIsNot(first.robot.environment, second.robot.environment)
+        first.execute("PLACE,1,1,NORTH")
+        first.execute("MOVE")
+        self.assertEqual((second.robot.position.x, second.robot.position.y), (0, 0))
+        self.assertFalse(second.placed)
+
     # parse_command tests
 
     # TODO: Test all possible valid positions?
@@ -294,48 +439,1103 @@ class TestInterface(unittest.TestCase):
         except Exception as e:
             self.fail(e)
 
+    def test_run_command_status(self):
+        self.assertEqual(self.interface.run_command("MOVE"), Status.ILLEGAL)
+        self.assertEqual(self.interface.run_command("JUMP"), Status.ILLEGAL)
+        self.assertEqual(self.interface.run_command("PLACE,1"), Status.INVALID_ARGUMENTS)
+        self.assertEqual(self.interface.run_command("PLACE,x,1,NORTH"), Status.INVALID_ARGUMENTS)
+        self.assertEqual(self.interface.run_command("PLACE,5,1,NORTH"), Status.INVALID_ARGUMENTS)
+        self.assertEqual(self.interface.run_command("PLACE,0,4,NORTH"), Status.OK)
+        self.assertEqual(self.interface.run_command("MOVE"), Status.FAILED)
+        self.assertEqual(self.interface.run_command("JUMP"), Status.INVALID_COMMAND)
+        self.assertEqual(self.interface.run_command("RIGHT"), Status.OK)
+        self.assertEqual(Status.FAILED.message("MOVE"), "Failed to execute: MOVE")
+
     def test_parse_command_invalid_command(self):
         with self.assertRaises(ValueError):
             self.interface.parse_command("JUMP")
 
+    def test_parse_command_error_messages(self):
+        with self.assertRaisesRegex(ValueError, "^Illegal command: MOVE$"):
+            self.interface.parse_command("MOVE")
+        with self.assertRaisesRegex(ValueError, "^Invalid type of arguments: PLACE,x,1,NORTH$"):
+            self.interface.parse_command("PLACE,x,1,NORTH")
+        self.interface.parse_command("PLACE,0,0,SOUTH")
+        with self.assertRaisesRegex(ValueError, "^Failed to execute: MOVE$"):
+            self.interface.parse_command("MOVE")
+        with self.assertRaisesRegex(ValueError, "^Invalid command: JUMP$"):
+            self.interface.parse_command("JUMP")
+
+
+class TestStats(unittest.TestCase):
+    commands = ["MOVE", "PLACE,0,0,NORTH", "MOVE", "LEFT", "MOVE", "JUMP", "PLACE,9,9,EAST", "REPORT"]
+
+    def test_counts_statuses(self):
+        interface = InstrumentedInterface(robot=Robot(environment=Environment(5, 5)), output=NullSink())
+        stats = interface.stats
+        for command in self.commands:
+            interface.execute(command)
+        interface.execute_repeated("MOVE", 10)
+        interface.execute_repeated("LEFT", 4)
+
+        summary = stats.summary()
+        self.assertEqual(summary["commands"], {
+            "LEFT": {"OK": 5},
+            "MOVE": {"FAILED": 11, "ILLEGAL": 1, "OK": 1},
+            "OTHER": {"INVALID_COMMAND": 1},
+            "PLACE": {"INVALID_ARGUMENTS": 1, "OK": 1},
+            "REPORT": {"OK": 1},
+        })
+        self.assertEqual(summary["latency"]["MOVE"]["count"], 13)
+        # Runs are recorded per command in every phase but parse.
+        self.assertEqual(summary["latency"]["parse"]["count"], len(self.commands))
+        self.assertEqual(summary["latency"]["dispatch"]["count"], len(self.commands) + 14)
+        self.assertEqual(summary["latency"]["move"]["count"], 12)
+        self.assertEqual(summary["latency"]["rotate"]["count"], 5)
+        self.assertEqual(summary["latency"]["place"]["count"], 2)
+        self.assertEqual(summary["latency"]["error"]["count"], 14)
+        for phase in summary["latency"].values():
+            self.assertEqual(sum(phase["buckets"].values()), phase["count"])
+        self.assertIn("FAILED", stats.format())
+
+    def test_instrumented_output_matches(self):
+        expected = CollectingSink()
+        plain = Interface(robot=Robot(environment=Environment(5, 5)), output=expected, history="ring")
+        output = CollectingSink()
+        stats = CommandStats()
+        interface = InstrumentedInterface(robot=Robot(environment=Environment(5, 5)), output=output,
+                                          history="ring", stats=stats)
+        self.assertIs(interface.stats, stats)
+        for command in self.commands:
+            plain.execute(command)
+            interface.execute(command)
+        for command, count in [("MOVE", 7), ("RIGHT", 3)]:
+            plain.execute_repeated(command, count)
+            interface.execute_repeated(command, count)
+        self.assertEqual(output.lines, expected.lines)
+        self.assertEqual(interface.error_count, plain.error_count)
+        self.assertEqual(interface.history(), plain.history())
+        self.assertEqual(sum(stats.counts.values()), len(self.commands) + 10)
+
+        # Plain interfaces never run the instrumented methods.
+        self.assertIsNone(plain.stats)
+        self.assertIs(plain.execute.__func__, Interface.execute)
+
+    def test_record_buckets(self):
+        stats = CommandStats()
+        stats.record("move", 0)
+        stats.record("move", 1000, count=3)
+        latency = stats.summary()["latency"]["move"]
+        self.assertEqual(latency["buckets"], {1: 1, 1024: 3})
+        self.assertEqual((latency["count"], latency["total_ns"], latency["mean_ns"]), (4, 3000, 750))
+
+
+class TestTrajectoryCache(unittest.TestCase):
+    macros = [["MOVE", "MOVE", "LEFT", "REPORT"], ["RIGHT", "MOVE", "JUMP", "MOVE", "REPORT", "MOVE"],
+              ["MOVE", "PLACE,1,1,EAST", "MOVE"]]
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.lines = ["MOVE", "REPORT"]
+        for _ in range(300):
+            if rng.random() < 0.2:
+                self.lines.append(f"PLACE,{rng.randrange(6)},{rng.randrange(5)},{rng.choice(Direction.NAMES)}")
+            else:
+                self.lines.extend(rng.choice(self.macros))
+        self.data = ("\n".join(self.lines) + "\n").encode()
+
+    def run_lines(self, cache, history="off"):
+        output = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output, history=history)
+        executed = run_macros(interface, io.BytesIO(self.data), self.macros, cache)
+        position = interface.robot.position
+        return executed, output.lines, (position.x, position.y, interface.robot.f, interface.placed,
+                                        interface.error_count, interface.history())
+
+    def test_matches_execute(self):
+        output = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+        for line in self.lines:
+            interface.execute(line)
+        position = interface.robot.position
+        expected = (len(self.lines), output.lines, (position.x, position.y, interface.robot.f,
+                                                    interface.placed, interface.error_count, []))
+
+        cache = TrajectoryCache()
+        self.assertEqual(self.run_lines(cache), expected)
+        self.assertGreater(cache.hits, cache.misses)
+        self.assertEqual(cache.stats()["entries"], cache.misses)
+
+        small = TrajectoryCache(max_bytes=2000)
+        self.assertEqual(self.run_lines(small), expected)
+        self.assertGreater(small.evictions, 0)
+        self.assertLessEqual(small.size, 2000)
+
+    def test_bypassed_with_history(self):
+        cache = TrajectoryCache()
+        _, _, state = self.run_lines(cache, history="full")
+        self.assertEqual(cache.stats()["hits"] + cache.stats()["misses"], 0)
+        self.assertTrue(state[-1])
+
+    def test_find_repeated_blocks(self):
+        commands = ["MOVE", "LEFT", "REPORT", "PLACE,0,0,NORTH"] * 3 + ["RIGHT"]
+        self.assertEqual(find_repeated_blocks(commands, 4, min_count=3, limit=1),
+                         [["MOVE", "LEFT", "REPORT", "PLACE,0,0,NORTH"]])
+        self.assertEqual(find_repeated_blocks(commands, 4, min_count=4), [])
+
+
+class TestRunStream(unittest.TestCase):
+    def test_run_stream(self):
+        output = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+        stream = io.BytesIO(b"PLACE,0,0,NORTH\n\n  MOVE  \r\nREPORT")
+
+        executed = run_stream(interface, stream)
+
+        self.assertEqual(executed, 3)
+        self.assertEqual(output.lines, ["PLACE,0,0,NORTH", "MOVE", "REPORT", "Report: 0,1,NORTH"])
+
+
+class TestSinks(unittest.TestCase):
+    def test_buffered_sink(self):
+        stream = io.StringIO()
+        sink = BufferedSink(stream, flush_size=10)
+
+        sink.write("MOVE")
+        self.assertEqual(stream.getvalue(), "")
+        sink.write("REPORT")
+        self.assertEqual(stream.getvalue(), "MOVE\nREPORT\n")
+        sink.write("LEFT")
+        sink.flush()
+        self.assertEqual(stream.getvalue(), "MOVE\nREPORT\nLEFT\n")
+
+    def test_collecting_sink(self):
+        sink = CollectingSink()
+        robot = Robot(environment=Environment(5, 5), output=sink)
+        robot.place(1, 2, Direction.EAST)
+        robot.report()
+        self.assertEqual(sink.lines, ["Report: 1,2,EAST"])
+        self.assertEqual(sink.getvalue(), "Report: 1,2,EAST\n")
+
+    def test_digest_sink(self):
+        expected = CollectingSink()
+        sink = DigestSink()
+        for out in [expected, sink]:
+            out.write("PLACE,0,0,NORTH")
+            out.write_repeated(("MOVE", "Error: Failed to execute: MOVE"), 300000)
+            out.write_repeated(("LEFT",), 0)
+            out.write("REPORT")
+        self.assertEqual(sink.hexdigest(), hashlib.sha256(expected.getvalue().encode()).hexdigest())
+        self.assertEqual((sink.line_count, sink.last_line), (len(expected.lines), "REPORT"))
+
+    def test_write_repeated_is_chunked(self):
+        class Recorder(io.StringIO):
+            def __init__(self):
+                super().__init__()
+                self.sizes = []
+
+            def write(self, text):
+                self.sizes.append(len(text))
+                return super().write(text)
+
+        expected = "PLACE,0,0,NORTH\n" + "MOVE\nError: Failed to execute: MOVE\n" * 1000
+        stream = Recorder()
+        sink = BufferedSink(stream, flush_size=256)
+        sink.write("PLACE,0,0,NORTH")
+        sink.write_repeated(("MOVE", "Error: Failed to execute: MOVE"), 1000)
+        sink.write_repeated(("LEFT",), 0)
+        sink.flush()
+        self.assertEqual(stream.getvalue(), expected)
+        self.assertLessEqual(max(stream.sizes), 256 + len("MOVE\nError: Failed to execute: MOVE\n"))
+
+        stream = Recorder()
+        sink = StdoutSink()
+        with redirect_stdout(stream):
+            sink.write("PLACE,0,0,NORTH")
+            sink.write_repeated(("MOVE", "Error: Failed to execute: MOVE"), 1000)
+        self.assertEqual(stream.getvalue(), expected)
+
+        # A bounded collector never materializes the whole run.
+        sink = CollectingSink(maxlen=3)
+        sink.write_repeated(("A", "B"), 10 ** 15)
+        self.assertEqual(list(sink.lines), ["B", "A", "B"])
+
+    def test_null_sink(self):
+        output_capture = io.StringIO()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=NullSink())
+        with redirect_stdout(output_capture):
+            interface.execute("PLACE,0,0,NORTH")
+            interface.execute("REPORT")
+        self.assertEqual(output_capture.getvalue(), "")
+
+    def test_report_sink(self):
+        commands = ["REPORT", "PLACE,1,2,EAST", "REPORT", "JUMP", "MOVE", "MOVE", "MOVE", "MOVE",
+                    "LEFT", "REPORT", "PLACE,9,9,NORTH", "REPORT"]
+        text = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=text)
+        for command in commands:
+            interface.execute(command)
+        expected_lines = [line for line in text.lines if line.startswith("Report: ")]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "reports.bin")
+            with open(path, "wb") as file:
+                output = ReportSink(file, flush_size=REPORT_RECORD.size)
+                interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+                for command in commands:
+                    interface.execute(command)
+                output.flush()
+                # Interrupted writes leave a partial record behind.
+                file.write(b"\0" * 3)
+            self.assertEqual(interface.error_count, 4)
+            self.assertEqual((output.commands, output.reports), (len(commands), 3))
+            self.assertEqual(list(read_reports(path)), [(2, 1, 2, 1), (9, 4, 2, 0), (11, 4, 2, 0)])
+            self.assertEqual(list(format_reports(path)), expected_lines)
+            if numpy is not None:
+                from fleet import load_reports
+
+                reports = load_reports(path)
+                self.assertEqual(reports["index"].tolist(), [2, 9, 11])
+                self.assertEqual(reports["x"].tolist(), [1, 4, 4])
+                del reports
+
+            with open(path, "wb") as file:
+                file.write(b"not a report file")
+            with self.assertRaises(ValueError):
+                list(read_reports(path))
+
+
+class TestProgram(unittest.TestCase):
+    commands = [
+        "MOVE", "JUMP", "PLACE,1,2", "PLACE,x,2,NORTH", "PLACE,01,2,NORTH",
+        "PLACE,999,999,NORTH", "PLACE,4,4,EAST", "MOVE", "LEFT", "MOVE", "REPORT", "JUMP",
+    ]
+
+    def run_lines(self, commands):
+        output = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+        for command in commands:
+            interface.execute(command)
+        return output.lines
+
+    def run_compiled(self, program):
+        output = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+        executed = interface.run_program(program)
+        return executed, output.lines
+
+    def test_run_program_records_place_and_rejects_bad_opcodes(self):
+        compiled = InstrumentedInterface(robot=Robot(environment=Environment(5, 5)), output=NullSink())
+        compiled.run_program(compile_commands(self.commands))
+        streamed = InstrumentedInterface(robot=Robot(environment=Environment(5, 5)), output=NullSink())
+        for command in self.commands:
+            streamed.execute(command)
+        self.assertEqual(compiled.stats.summary()["latency"]["place"]["count"],
+                         streamed.stats.summary()["latency"]["place"]["count"])
+
+        for code in [bytearray([OP_MOVE, 99]), bytearray([0]), bytearray([OP_PLACE, 1])]:
+            with self.subTest(code=code):
+                with self.assertRaisesRegex(ValueError, "^Corrupt compiled program"):
+                    self.run_compiled(Program(code))
+
+    def test_compile_commands(self):
+        program = compile_commands(["MOVE\n", "  \n", "PLACE,1,2,EAST", "PLACE,x,2,NORTH", "JUMP"])
+        self.assertEqual(program.code[0], OP_MOVE)
+        self.assertEqual(program.code[1], OP_PLACE)
+        self.assertEqual(program.code[11], OP_ERROR)
+        self.assertEqual(program.code[16], OP_RAW)
+        self.assertEqual(program.texts, ["PLACE,x,2,NORTH", "JUMP"])
+
+    def test_run_program_matches_execute(self):
+        executed, lines = self.run_compiled(compile_commands(self.commands))
+        self.assertEqual(executed, len(self.commands))
+        self.assertEqual(lines, self.run_lines(self.commands))
+
+    def test_load_program_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commands.txt")
+            with open(path, "w") as f:
+                f.write("\n".join(self.commands))
+
+            program = load_program(path)
+            self.assertTrue(os.path.exists(path + ".rbc"))
+            self.assertEqual(self.run_compiled(load_program(path))[1], self.run_lines(self.commands))
+
+            # Changing the source invalidates the cache.
+            with open(path, "w") as f:
+                f.write("PLACE,0,0,NORTH\nREPORT\n")
+            os.utime(path, ns=(0, 0))
+            self.assertNotEqual(load_program(path).code, program.code)
+            self.assertEqual(self.run_compiled(load_program(path))[1],
+                             ["PLACE,0,0,NORTH", "REPORT", "Report: 0,0,NORTH"])
+
+            # A touched but unchanged source gets its cache header updated.
+            os.utime(path, ns=(10 ** 9, 10 ** 9))
+            load_program(path)
+            with open(path + ".rbc", "rb") as f:
+                self.assertEqual(f.read(PROGRAM_CACHE_HEADER.size)[4:12], (10 ** 9).to_bytes(8, "little"))
+
+            # A torn cache is rebuilt rather than trusted.
+            with open(path + ".rbc", "r+b") as f:
+                f.truncate(PROGRAM_CACHE_HEADER.size + 14)
+            self.assertEqual(self.run_compiled(load_program(path))[1],
+                             ["PLACE,0,0,NORTH", "REPORT", "Report: 0,0,NORTH"])
+            with open(path + ".rbc", "rb") as f:
+                Program.from_bytes(f.read(), PROGRAM_CACHE_HEADER.size)
+            with self.assertRaises(ValueError):
+                Program.from_bytes(compile_commands(self.commands).to_bytes()[:-1])
+
+
+@unittest.skipIf(numpy is None, "fleet requires NumPy")
+class TestFleet(unittest.TestCase):
+    def test_fleet_matches_interfaces(self):
+        vocabulary = ["MOVE", "MOVE", "LEFT", "RIGHT", "REPORT", "JUMP", "PLACE,1,2",
+                      "PLACE,999,999,NORTH", "PLACE,x,1,EAST", "PLACE,01,3,WEST", "MOVE,1", "LEFT,",
+                      "REPORT,x"]
+        rng = random.Random(5)
+        streams = []
+        for _ in range(50):
+            stream = []
+            for _ in range(rng.randint(0, 60)):
+                if rng.random() < 0.1:
+                    stream.append(f"PLACE,{rng.randint(-1, 5)},{rng.randint(-1, 5)},"
+                                  f"{rng.choice(Direction.NAMES)}")
+                else:
+                    stream.append(rng.choice(vocabulary))
+            streams.append(stream)
+
+        for obstacles in [None, ObstacleBitmap.random(5, 5, 4, seed=2), ObstacleSet(5, 5, {7, 12})]:
+            with self.subTest(obstacles=type(obstacles).__name__):
+                self.check_fleet(streams, Environment(5, 5, obstacles))
+
+    def check_fleet(self, streams, env):
+        from fleet import Fleet, encode_streams
+
+        fleet = Fleet(len(streams), env)
+        fleet.run(*encode_streams(streams))
+
+        expected_reports = []
+        expected_errors = []
+        for stream in streams:
+            output = CollectingSink()
+            interface = Interface(robot=Robot(environment=env), output=output)
+            for command in stream:
+                interface.execute(command)
+            errors = sum(line.startswith("Error: ") for line in output.lines)
+            interface.execute("REPORT")
+            expected_reports.append(output.lines[-1])
+            expected_errors.append(errors)
+
+        self.assertEqual(fleet.reports(), expected_reports)
+        self.assertEqual(fleet.errors.tolist(), expected_errors)
+
+
+class TestRepeatedCommands(unittest.TestCase):
+    def random_commands(self, seed):
+        rng = random.Random(seed)
+        commands = []
+        for _ in range(40):
+            command = rng.choice(["MOVE", "LEFT", "RIGHT", "REPORT", "JUMP",
+                                  f"PLACE,{rng.randint(0, 5)},{rng.randint(0, 5)},NORTH"])
+            commands.extend([command] * rng.choice([1, 2, 3, 7, 50]))
+        return commands
+
+    def new_interface(self, history="full"):
+        output = CollectingSink()
+        return Interface(robot=Robot(environment=Environment(5, 5)), output=output, history=history), output
+
+    def test_execute_repeated_matches_execute(self):
+        for seed in range(20):
+            commands = self.random_commands(seed)
+            expected_interface, expected = self.new_interface()
+            for command in commands:
+                expected_interface.execute(command)
+
+            for run in [
+                lambda interface: run_stream(interface, io.BytesIO("\n".join(commands).encode())),
+                lambda interface: interface.run_program(compile_commands(commands)),
+            ]:
+                with self.subTest(seed=seed):
+                    interface, output = self.new_interface()
+                    self.assertEqual(run(interface), len(commands))
+                    self.assertEqual(output.lines, expected.lines)
+                    self.assertEqual(interface.error_count, expected_interface.error_count)
+                    self.assertEqual(interface.history(), expected_interface.history())
+
+    def test_move_many_clamps_at_edge(self):
+        interface, output = self.new_interface(history="ring")
+        interface.execute("PLACE,1,0,NORTH")
+        interface.execute_repeated("MOVE", 10000)
+        self.assertEqual((interface.robot.position.x, interface.robot.position.y), (1, 4))
+        self.assertEqual(interface.error_count, 10000 - 4)
+        self.assertEqual(output.lines.count("Error: Failed to execute: MOVE"), 10000 - 4)
+        self.assertEqual(interface.history(), ["PLACE"] + ["MOVE"] * 4)
+
+        interface.execute_repeated("LEFT", 4001)
+        self.assertEqual(interface.robot.f, Direction.WEST)
+        self.assertEqual(len(interface.command_history), 1000)
+
+
+class TestMmapReader(unittest.TestCase):
+    data = b"MOVE\r\nPLACE,1,1,EAST\n\n MOVE \nMOVE\nJUMP\nLEFT\nLEFT\nPLACE,x,1,EAST\nREPORT"
+
+    def run_lines(self, lines):
+        output = CollectingSink()
+        interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+        for line in lines:
+            if line.strip():
+                interface.execute(line.strip())
+        return output.lines
+
+    def test_compile_buffer_ranges(self):
+        expected = self.run_lines(self.data.decode().split("\n"))
+        for split in range(len(self.data) + 1):
+            with self.subTest(split=split):
+                output = CollectingSink()
+                interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+                interface.run_program(compile_buffer(self.data, 0, split))
+                interface.run_program(compile_buffer(self.data, split))
+                self.assertEqual(output.lines, expected)
+
+    def test_run_mmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commands.txt")
+            with open(path, "wb") as f:
+                f.write(self.data)
+
+            output = CollectingSink()
+            interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+            self.assertEqual(run_mmap(interface, path, window=7), 9)
+            self.assertEqual(output.lines, self.run_lines(self.data.decode().split("\n")))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def new_interface(self, history="off"):
+        output = CollectingSink()
+        return Interface(robot=Robot(environment=Environment(5, 5)), output=output, history=history), output
+
+    def test_save_and_restore(self):
+        path = os.path.join(self.directory, "state.snap")
+        for history in ["off", "ring", "full"]:
+            with self.subTest(history=history):
+                interface, _ = self.new_interface(history)
+                for command in ["MOVE", "PLACE,1,2,EAST", "MOVE", "LEFT", "JUMP", "MOVE"]:
+                    interface.execute(command)
+                save_snapshot(path, [interface.snapshot()], offset=42, commands=6)
+
+                offset, commands, states = load_snapshot(path)
+                self.assertEqual((offset, commands, len(states)), (42, 6, 1))
+                restored, output = self.new_interface()
+                restored.restore(states[0])
+                self.assertTrue(restored.placed)
+                self.assertEqual(restored.error_count, 2)
+                self.assertEqual(restored.history(), interface.history())
+                restored.execute("REPORT")
+                self.assertEqual(output.lines[-1], "Report: 2,3,NORTH")
+
+    def test_load_snapshot_rejects_other_files(self):
+        path = os.path.join(self.directory, "state.snap")
+        with open(path, "wb") as f:
+            f.write(b"PLACE,0,0,NORTH\nREPORT\n")
+        with self.assertRaises(ValueError):
+            load_snapshot(path)
+
+    def test_resume_after_interruption(self):
+        rng = random.Random(3)
+        commands = [rng.choice(["MOVE", "LEFT", "RIGHT", "REPORT", "JUMP", "PLACE,1,1,SOUTH", ""])
+                    for _ in range(200)]
+        data = "\n".join(commands).encode()
+        input_path = os.path.join(self.directory, "commands.txt")
+        with open(input_path, "wb") as f:
+            f.write(data)
+        checkpoint = os.path.join(self.directory, "state.snap")
+
+        expected_interface, expected = self.new_interface()
+        run_stream(expected_interface, io.BytesIO(data))
+
+        def interrupted(stream, lines):
+            for line in itertools.islice(stream, lines):
+                yield line
+            raise KeyboardInterrupt
+
+        interface, _ = self.new_interface()
+        with open(input_path, "rb") as stream:
+            with self.assertRaises(KeyboardInterrupt):
+                run_checkpointed(interface, interrupted(stream, 123), checkpoint, every=10)
+        offset, _, _ = load_snapshot(checkpoint)
+        self.assertEqual(offset, len(b"".join(io.BytesIO(data).readlines()[:120])))
+
+        interface, output = self.new_interface()
+        with open(input_path, "rb") as stream:
+            run_checkpointed(interface, stream, checkpoint, every=10, resume=True)
+        _, total, _ = load_snapshot(checkpoint)
+        self.assertEqual(total, sum(1 for command in commands if command))
+        self.assertEqual(expected.lines[len(expected.lines) - len(output.lines):], output.lines)
+        self.assertEqual(interface.error_count, expected_interface.error_count)
+        self.assertEqual(interface.snapshot(), expected_interface.snapshot())
+
+    def test_resume_rejects_changed_input(self):
+        input_path = os.path.join(self.directory, "commands.txt")
+        checkpoint = os.path.join(self.directory, "state.snap")
+        with open(input_path, "wb") as f:
+            f.write(b"PLACE,0,0,NORTH\nMOVE\nMOVE\nREPORT\n")
+        interface, _ = self.new_interface()
+        with open(input_path, "rb") as stream:
+            run_checkpointed(interface, stream, checkpoint, every=2)
+
+        # Appending to the input keeps the consumed prefix, so resuming is fine.
+        with open(input_path, "ab") as f:
+            f.write(b"LEFT\nREPORT\n")
+        interface, output = self.new_interface()
+        with open(input_path, "rb") as stream:
+            run_checkpointed(interface, stream, checkpoint, every=2, resume=True)
+        self.assertEqual(output.lines, ["LEFT", "REPORT", "Report: 0,2,WEST"])
+
+        for data in [b"PLACE,1,0,NORTH\nMOVE\nMOVE\nREPORT\nLEFT\nREPORT\n", b"PLACE,0,0,NORTH\n"]:
+            with self.subTest(data=data):
+                with open(input_path, "wb") as f:
+                    f.write(data)
+                interface, output = self.new_interface()
+                with open(input_path, "rb") as stream, self.assertRaises(ValueError):
+                    run_checkpointed(interface, stream, checkpoint, every=2, resume=True)
+                self.assertEqual(output.lines, [])
+
+    @unittest.skipIf(numpy is None, "fleet requires NumPy")
+    def test_fleet_snapshot(self):
+        from fleet import Fleet, encode_streams
+
+        path = os.path.join(self.directory, "fleet.snap")
+        streams = [["PLACE,0,0,NORTH", "MOVE"], ["PLACE,4,4,EAST", "MOVE", "LEFT"], ["MOVE"]]
+        fleet = Fleet(len(streams), Environment(5, 5))
+        fleet.run(*encode_streams(streams))
+        fleet.save_snapshot(path, offset=7, commands=3)
+
+        restored = Fleet(1, Environment(5, 5))
+        self.assertEqual(restored.load_snapshot(path), (7, 3))
+        self.assertEqual(restored.reports(), fleet.reports())
+        self.assertEqual(restored.errors.tolist(), fleet.errors.tolist())
+
+        _, _, states = load_snapshot(path)
+        interface, output = self.new_interface()
+        interface.restore(states[1])
+        interface.execute("REPORT")
+        self.assertEqual(output.lines[-1], fleet.reports()[1])
+
+
+class TestSharded(unittest.TestCase):
+    def test_matches_sequential(self):
+        rng = random.Random(11)
+        vocabulary = ["MOVE", "MOVE", "MOVE", "LEFT", "RIGHT", "REPORT", "JUMP", "PLACE,1,2",
+                      "PLACE, 1,1,EAST", "PLACE,9,9,NORTH", "", "  MOVE  "]
+        with tempfile.TemporaryDirectory() as directory:
+            for case in range(6):
+                lines = [rng.choice(vocabulary) if rng.random() < 0.97 else
+                         f"PLACE,{rng.randint(0, 4)},{rng.randint(0, 4)},{rng.choice(Direction.NAMES)}"
+                         for _ in range(3000)]
+                if case == 0:
+                    # Never placed.
+                    lines = [line for line in lines if not line.startswith("PLACE")]
+                path = os.path.join(directory, f"{case}.txt")
+                with open(path, "w") as f:
+                    f.write("\n".join(lines))
+                obstacles = ObstacleSet(5, 5, {6, 12}) if case % 2 else None
+                with self.subTest(case=case):
+                    expected = CollectingSink()
+                    sequential = Interface(robot=Robot(environment=Environment(5, 5, obstacles)),
+                                           output=expected)
+                    executed = run_mmap(sequential, path)
+
+                    output = CollectingSink()
+                    interface = Interface(robot=Robot(environment=Environment(5, 5, obstacles)), output=output)
+                    self.assertEqual(run_sharded(interface, path, jobs=2, shards=7), executed)
+                    self.assertEqual(output.lines, expected.lines)
+                    self.assertEqual(interface.error_count, sequential.error_count)
+                    self.assertEqual(interface.snapshot(), sequential.snapshot())
+
+
+class TestWorld(unittest.TestCase):
+    def test_collisions(self):
+        from world import World
+
+        output = CollectingSink()
+        world = World(Environment(5, 5), output=output)
+        for line in ["ROBOT 1 PLACE,0,0,NORTH", "ROBOT 2 PLACE,0,0,EAST", "ROBOT 2 PLACE,0,2,SOUTH",
+                     "ROBOT 1 MOVE", "ROBOT 1 MOVE", "ROBOT 2 LEFT", "ROBOT 2 MOVE", "ROBOT 1 MOVE",
+                     "ROBOT 1 REPORT", "ROBOT 3 MOVE", "JUMP"]:
+            world.execute(line)
+
+        self.assertEqual([line for line in output.lines if line.startswith(("Error", "Report"))], [
+            "Error: Invalid type of arguments: PLACE,0,0,EAST",
+            "Error: Failed to execute: MOVE",
+            "Report: 0,2,NORTH",
+            "Error: Illegal command: MOVE",
+            "Error: Invalid command: JUMP",
+        ])
+        self.assertEqual(world.error_count, 4)
+        self.assertEqual(world.occupancy, {2 * 5 + 0: 1, 2 * 5 + 1: 2})
+
+    def test_run_stream(self):
+        from world import World
+
+        output = CollectingSink()
+        world = World(Environment(5, 5), output=output)
+        run_stream(world, io.BytesIO(b"ROBOT 1 PLACE,0,0,NORTH\nROBOT 2 PLACE,0,4,SOUTH\n"
+                                     b"ROBOT 1 MOVE\nROBOT 1 MOVE\nROBOT 1 MOVE\nROBOT 1 MOVE\n"))
+        self.assertEqual((world.interfaces[1].robot.position.x, world.interfaces[1].robot.position.y), (0, 3))
+        self.assertEqual(world.error_count, 1)
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def test_sessions_and_pipelining(self):
+        import asyncio
+        from server import SimulatorServer
+
+        server = await SimulatorServer().start(port=0)
+        host, port = server.sockets[0].getsockname()[:2]
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b"SESSION a\nMOVE\nPLACE,1,1,NORTH\nMOVE\nREPORT\nJUMP\nQUIT\n")
+            responses = (await reader.read()).decode().splitlines()
+            self.assertEqual(responses, ["OK", "Error: Illegal command: MOVE", "OK", "OK",
+                                         "Report: 1,2,NORTH", "Error: Invalid command: JUMP", "OK"])
+            writer.close()
+
+            # The named session outlives the connection.
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b"REPORT\nSESSION a\nREPORT\nQUIT\n")
+            responses = (await reader.read()).decode().splitlines()
+            self.assertEqual(responses, ["Error: Illegal command: REPORT", "OK", "Report: 1,2,NORTH", "OK"])
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def test_bad_input(self):
+        import asyncio
+        from server import MAX_LINE_SIZE, SimulatorServer
+
+        server = await SimulatorServer().start(port=0)
+        host, port = server.sockets[0].getsockname()[:2]
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b"PLACE,1,1,NORTH\nMO\xffVE\nREPORT\nQUIT\n")
+            responses = (await reader.read()).decode().splitlines()
+            self.assertEqual(responses, ["OK", "Error: Invalid command: MO\ufffdVE", "Report: 1,1,NORTH", "OK"])
+            writer.close()
+
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(b"REPORT\n" + b"M" * (MAX_LINE_SIZE + 1))
+            responses = (await reader.read()).decode().splitlines()
+            self.assertEqual(responses, ["Error: Illegal command: REPORT",
+                                         f"Error: Line longer than {MAX_LINE_SIZE} bytes"])
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+
+class TestMain(unittest.TestCase):
+    def run_main(self, argv):
+        from robot import main
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            status = main(argv)
+        return status, stdout.getvalue()
+
+    def test_fast_path_matches_parsed_arguments(self):
+        path = os.path.join("robot_tests", "Test1_input.txt")
+        status, fast = self.run_main([path])
+        self.assertEqual(status, 0)
+        self.assertEqual(self.run_main([path, "--flush-size", "16"]), (0, fast))
+        with open(path.replace("_input.txt", "_expected.txt")) as f:
+            self.assertEqual(fast.strip().split("\n")[-1], f.read().strip())
+
+    def test_missing_file(self):
+        self.assertEqual(self.run_main(["missing.txt"]), (1, "Error: File 'missing.txt' not found.\n"))
+        self.assertEqual(self.run_main(["missing.txt", "--mmap"])[0], 1)
+
+    def test_binary_errors_go_to_stderr(self):
+        stderr = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory, redirect_stderr(stderr):
+            report_path = os.path.join(directory, "reports.bin")
+            self.assertEqual(self.run_main(["missing.txt", "--report-format", "binary",
+                                            "--report-file", report_path]), (1, ""))
+        self.assertEqual(stderr.getvalue(), "Error: File 'missing.txt' not found.\n")
+
+    def test_stdin_stays_open(self):
+        from robot import open_command_stream
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b"PLACE,0,0,NORTH\nREPORT\n")
+            f.seek(0)
+            stdin = sys.stdin
+            try:
+                sys.stdin = io.TextIOWrapper(open(f.fileno(), "rb", closefd=False))
+                with open_command_stream("-") as stream:
+                    self.assertEqual(list(stream), [b"PLACE,0,0,NORTH\n", b"REPORT\n"])
+                self.assertFalse(sys.stdin.closed)
+            finally:
+                sys.stdin = stdin
+
+    def test_output_before_a_decode_error_survives(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commands.txt")
+            with open(path, "wb") as f:
+                f.write(b"PLACE,0,0,NORTH\nREPORT\n\xff\nREPORT\n")
+            status, output = self.run_main([path])
+        self.assertEqual(status, 1)
+        self.assertEqual(output.splitlines()[:3], ["PLACE,0,0,NORTH", "REPORT", "Report: 0,0,NORTH"])
+        self.assertTrue(output.splitlines()[3].startswith("Error: 'utf-8' codec can't decode"))
+
+    def test_output_before_a_decode_error_survives_options(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commands.txt")
+            with open(path, "wb") as f:
+                f.write(b"PLACE,0,0,NORTH\nREPORT\n\xff\nREPORT\n")
+            status, output = self.run_main([path, "--flush-size", "1024"])
+            self.assertEqual(status, 1)
+            self.assertEqual(output.splitlines()[:3], ["PLACE,0,0,NORTH", "REPORT", "Report: 0,0,NORTH"])
+            self.assertTrue(output.splitlines()[3].startswith("Error: 'utf-8' codec can't decode"))
+
+            report_path = os.path.join(directory, "reports.bin")
+            with redirect_stderr(io.StringIO()):
+                self.assertEqual(self.run_main([path, "--report-format", "binary",
+                                                "--report-file", report_path]), (1, ""))
+            self.assertEqual(list(format_reports(report_path)), ["Report: 0,0,NORTH"])
+
+    def test_too_many_random_obstacles(self):
+        path = os.path.join("robot_tests", "Test1_input.txt")
+        self.assertEqual(self.run_main([path, "--random-obstacles", "26"]),
+                         (1, "Error: Cannot place 26 obstacles on a 5x5 table\n"))
+
+    def test_whole_file_modes_reject_stdin(self):
+        for flag in ["--parallel", "--compiled", "--mmap"]:
+            with self.subTest(flag=flag):
+                stderr = io.StringIO()
+                with redirect_stderr(stderr), self.assertRaises(SystemExit) as context:
+                    self.run_main(["-", flag])
+                self.assertEqual(context.exception.code, 2)
+                self.assertIn("require a command file, not stdin", stderr.getvalue())
+
+
+class TestBatch(unittest.TestCase):
+    def test_run_batch(self):
+        results = list(run_batch("robot_tests", pattern="*_input.txt", jobs=2))
+
+        paths = [result["file"] for result in results]
+        self.assertEqual(paths, sorted(paths))
+        self.assertEqual(len(paths), len([f for f in os.listdir("robot_tests") if f.endswith("_input.txt")]))
+        for result in results:
+            with open(result["file"].replace("_input.txt", "_expected.txt")) as f:
+                self.assertEqual(result["last_output"], f.read().strip())
+
+    def test_run_batch_reports_bad_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "a.txt"), "w") as f:
+                f.write("PLACE,0,0,NORTH\nREPORT\n")
+            with open(os.path.join(directory, "b.txt"), "wb") as f:
+                f.write(b"PLACE,0,0,NORTH\n\xff\n")
+            os.mkdir(os.path.join(directory, "c.txt"))
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    results = list(run_batch(directory, jobs=jobs))
+                    self.assertEqual([result["file"] for result in results],
+                                     [os.path.join(directory, name) for name in ["a.txt", "b.txt"]])
+                    self.assertEqual(results[0]["last_output"], "Report: 0,0,NORTH")
+                    self.assertIn("error", results[1])
+
+
+class TestGenerateCommands(unittest.TestCase):
+    def test_seeded_files_are_reproducible(self):
+        from generate_commands import generate_command_file
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f"{i}.txt") for i in range(3)]
+            for path, seed in zip(paths, [7, 7, 8]):
+                generate_command_file(path, 1000, True, seed=seed)
+            contents = []
+            for path in paths:
+                with open(path) as f:
+                    contents.append(f.read())
+        self.assertEqual(contents[0], contents[1])
+        self.assertNotEqual(contents[0], contents[2])
+        lines = contents[0].splitlines()
+        self.assertEqual(len(lines), 2002)
+        self.assertTrue(lines[0].startswith("PLACE,"))
+        self.assertTrue(all(line == "REPORT" for line in lines[1::2]))
+
+    def test_mix_and_table_size(self):
+        from generate_commands import generate_command_chunks, invalid_commands
+
+        for width in [5, 100000]:
+            with self.subTest(width=width):
+                text = "".join(generate_command_chunks(5000, random.Random(1), mix={"PLACE": 1, "LEFT": 1},
+                                                       width=width, height=3, invalid_rate=0.2,
+                                                       place_first=False, chunk_commands=999))
+                commands = text.splitlines()[::2]
+                self.assertEqual(len(commands), 5000)
+                invalid_set = invalid_commands(width, 3)
+                invalid = sum(command in invalid_set for command in commands)
+                self.assertTrue(800 < invalid < 1200)
+                for command in commands:
+                    if command.startswith("PLACE,") and command not in invalid_set:
+                        _, x, y, direction = command.split(",")
+                        self.assertTrue(0 <= int(x) < width and 0 <= int(y) < 3)
+                        self.assertIn(direction, Direction.NAMES)
+                    else:
+                        self.assertIn(command, ["LEFT"] + invalid_set)
+
+    def test_invalid_commands_fail_on_large_tables(self):
+        from generate_commands import generate_command_chunks, invalid_commands
+
+        for size in [5, 1000, 5000]:
+            with self.subTest(size=size):
+                interface = Interface(robot=Robot(environment=Environment(size, size)), output=NullSink())
+                interface.execute("PLACE,0,0,NORTH")
+                for command in invalid_commands(size, size):
+                    interface.execute(command)
+                self.assertEqual(interface.error_count, len(invalid_commands(size, size)))
+        for rate in [-0.1, 1.5]:
+            with self.assertRaises(ValueError):
+                next(generate_command_chunks(1, random.Random(1), invalid_rate=rate))
+
+
+class TestReferenceModel(unittest.TestCase):
+    def test_matches_interface(self):
+        from generate_commands import ReferenceModel
+
+        vocabulary = ["MOVE", "LEFT", "RIGHT", "REPORT", "JUMP", "MOVE,1", "PLACE", "PLACE,1,2",
+                      "PLACE,1,2,3", "PLACE,1,2,NORTH,EXTRA", "PLACE,999,999,NORTH", "PLACE,x,1,EAST",
+                      "PLACE, 2,1,WEST", "PLACE,-1,0,SOUTH", "  REPORT ", ""]
+        for seed in range(20):
+            rng = random.Random(seed)
+            width, height = rng.randint(1, 6), rng.randint(1, 6)
+            lines = [rng.choice(vocabulary) if rng.random() < 0.8 else
+                     f"PLACE,{rng.randint(-1, 6)},{rng.randint(-1, 6)},{rng.choice(Direction.NAMES)}"
+                     for _ in range(300)]
+            with self.subTest(seed=seed):
+                model = ReferenceModel(width, height)
+                model.run(lines[:150])
+                model.run(lines[150:])
+                oracle = model.oracle()
+
+                output = CollectingSink()
+                interface = Interface(robot=Robot(environment=Environment(width, height)), output=output)
+                for line in lines:
+                    if line.strip():
+                        interface.execute(line.strip())
+                reports = [line for line in output.lines if line.startswith("Report: ")]
+                self.assertEqual(hashlib.sha256(output.getvalue().encode()).hexdigest(),
+                                 oracle["transcript_sha256"])
+                self.assertEqual(hashlib.sha256("".join(report + "\n" for report in reports).encode())
+                                 .hexdigest(), oracle["report_sha256"])
+                self.assertEqual(output.lines[-1], oracle["last_output"])
+                self.assertEqual((len(reports), interface.error_count), (oracle["reports"], oracle["errors"]))
+
+    def test_generated_oracle(self):
+        import json
+        from generate_commands import generate_command_file, oracle_path
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commands.txt")
+            generate_command_file(path, 2000, True, seed=3, oracle=True, width=3, height=4)
+            with open(oracle_path(path)) as f:
+                oracle = json.load(f)
+            output = DigestSink()
+            interface = Interface(robot=Robot(environment=Environment(3, 4)), output=output)
+            with open(path, "rb") as stream:
+                run_stream(interface, stream)
+        self.assertEqual(output.hexdigest(), oracle["transcript_sha256"])
+        self.assertEqual(interface.error_count, oracle["errors"])
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_benchmarks(self):
+        from benchmark import SCENARIOS, compare, run_benchmarks
+
+        results = run_benchmarks(size=200, repeat=1)
+        self.assertEqual(list(results["results"]), list(SCENARIOS))
+        self.assertEqual(compare(results, results, 0.1), [])
+
+        baseline = {"results": {"parse": {"commands_per_sec": results["results"]["parse"]["commands_per_sec"] * 2}}}
+        self.assertEqual(len(compare(results, baseline, 0.1)), 1)
+
+
+# Set ROBOT_TEST_CACHE to a file path to remember passing robot_tests cases
+# between runs. Without it, every case runs.
+INTEGRATION_CACHE = os.environ.get("ROBOT_TEST_CACHE") or None
+# Bump to invalidate cached results when the way cases are judged changes.
+INTEGRATION_RUNNER_VERSION = 1
+# Changed cases run in worker processes once there are at least this many.
+INTEGRATION_PARALLEL_MIN = 32
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def integration_cases(test_dir):
+    """
+    List the (name, input path, expected path) of every case in a directory.
+    """
+    names = sorted(f[:-len("_input.txt")] for f in os.listdir(test_dir) if f.endswith("_input.txt"))
+    return [(name, os.path.join(test_dir, f"{name}_input.txt"), os.path.join(test_dir, f"{name}_expected.txt"))
+            for name in names]
+
+
+def run_integration_case(input_path, expected_path):
+    """
+    Run one case through run_stream() into a DigestSink.
+
+    An expected file with a single line is compared with the last line of
+    output. A longer one is a full transcript and is compared by digest, so
+    neither the actual nor the expected transcript is held in memory.
+
+    Returns:
+        str | None: A description of the mismatch, or None if the case passes.
+    """
+    output = DigestSink()
+    interface = Interface(robot=Robot(environment=Environment(5, 5)), output=output)
+    with open(input_path, "rb") as stream:
+        run_stream(interface, stream)
+
+    expected = hashlib.sha256()
+    expected_lines = 0
+    last_line = None
+    with open(expected_path, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            expected.update(line.encode() + b"\n")
+            expected_lines += 1
+            last_line = line
+
+    if expected_lines <= 1:
+        expected_output = (last_line or "").strip()
+        if output.last_line != expected_output:
+            return f"last line {output.last_line!r} != {expected_output!r}"
+    elif output.hexdigest() != expected.hexdigest():
+        return f"transcript of {output.line_count} lines differs from the {expected_lines} expected lines"
+    return None
+
+
+def run_integration_cases(test_dir, cache_path=INTEGRATION_CACHE, jobs=None):
+    """
+    Run the cases of a directory, skipping those that passed before with the
+    same input file, expected file, simulator and test sources, runner version
+    and Python version.
+
+    Returns:
+        list: (name, failure or None, skipped) for every case.
+    """
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+
+    runner = hashlib.sha256(f"{INTEGRATION_RUNNER_VERSION}:{sys.version}".encode())
+    directory = os.path.dirname(os.path.abspath(robot.__file__))
+    for path in [robot.__file__, os.path.join(directory, "fleet.py"), os.path.abspath(__file__)]:
+        runner.update(_file_sha256(path).encode())
+    source = runner.hexdigest()
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+
+    keys = {}
+    changed = []
+    for name, input_path, expected_path in integration_cases(test_dir):
+        keys[name] = f"{_file_sha256(input_path)}:{_file_sha256(expected_path)}:{source}"
+        if cache.get(name) != keys[name]:
+            changed.append((name, input_path, expected_path))
+
+    jobs = jobs or os.cpu_count() or 1
+    if jobs > 1 and len(changed) >= INTEGRATION_PARALLEL_MIN:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            failures = list(executor.map(run_integration_case, [case[1] for case in changed],
+                                         [case[2] for case in changed], chunksize=8))
+    else:
+        failures = [run_integration_case(input_path, expected_path)
+                    for _, input_path, expected_path in changed]
+    failed = {name: failure for (name, _, _), failure in zip(changed, failures)}
+
+    if cache_path:
+        cache = {name: key for name, key in keys.items()
+                 if failed.get(name) is None and (name in failed or cache.get(name) == key)}
+        write_atomically(cache_path, json.dumps(cache, indent=1, sort_keys=True).encode())
+    return [(name, failed.get(name), name not in failed) for name in keys]
+
 
 class TestFileIntegration(unittest.TestCase):
     def test_integration_files(self):
-        test_dir = "robot_tests"
-        input_files = [f for f in os.listdir(test_dir) if f.endswith("_input.txt")]
-        # Sort tests
-        input_files.sort()
-        
+        for name, failure, skipped in run_integration_cases("robot_tests"):
+            with self.subTest(test_file=f"{name}_input.txt"):
+                if skipped:
+                    self.skipTest("passed before and unchanged")
+                self.assertIsNone(failure, f"Failed test file: {name}_input.txt")
+
+    def test_incremental_runner(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, command in [("A", "REPORT"), ("B", "MOVE")]:
+                with open(os.path.join(directory, f"{name}_input.txt"), "w") as f:
+                    f.write(f"PLACE,1,1,NORTH\n{command}\n")
+            with open(os.path.join(directory, "A_expected.txt"), "w") as f:
+                f.write("Report: 1,1,NORTH")
+            with open(os.path.join(directory, "B_expected.txt"), "w") as f:
+                f.write("PLACE,1,1,NORTH\nMOVE\n")
+            cache_path = os.path.join(directory, "cache.json")
+
+            self.assertEqual(run_integration_cases(directory, cache_path),
+                             [("A", None, False), ("B", None, False)])
+            self.assertEqual(run_integration_cases(directory, cache_path),
+                             [("A", None, True), ("B", None, True)])
+
+            # Full transcripts are compared line for line, by digest.
+            with open(os.path.join(directory, "B_expected.txt"), "w") as f:
+                f.write("PLACE,1,1,NORTH\nLEFT\n")
+            results = run_integration_cases(directory, cache_path)
+            self.assertEqual(results[0], ("A", None, True))
+            self.assertIsNotNone(results[1][1])
+            self.assertFalse(results[1][2])
+            # Failures are not cached, so the case runs again.
+            self.assertFalse(run_integration_cases(directory, cache_path)[1][2])
+
+    def test_random_command_oracles(self):
+        import json
+        from generate_commands import oracle_path
+
+        test_dir = "random_commands"
+        input_files = sorted(f for f in os.listdir(test_dir)
+                             if f.endswith(".txt") and os.path.exists(oracle_path(os.path.join(test_dir, f))))
+        self.assertTrue(input_files)
+
         for input_file in input_files:
             with self.subTest(test_file=input_file):
                 input_path = os.path.join(test_dir, input_file)
-                # The expected output file has same name with "_expected.txt"
-                expected_path = os.path.join(test_dir, input_file.replace("_input.txt", "_expected.txt"))
-                
-                # Read all commands from the input file
-                with open(input_path, "r") as f:
-                    commands = f.read().splitlines()
-                
-                env = Environment(5, 5)
-                robot = Robot(environment=env)
-                interface = Interface(robot=robot)
-                
-                # Capture any printed output (from REPORT commands)
-                output_capture = io.StringIO()
-                with redirect_stdout(output_capture):
-                    for command in commands:
-                        if command.strip():
-                            interface.execute(command)
-                
-                actual_output = output_capture.getvalue().strip().split('\n')[-1]
-
-                
-                # Read the expected output for comparison
-                with open(expected_path, "r") as f:
-                    expected_output = f.read().strip()
-                
-                self.assertEqual(actual_output, expected_output,
-                                 f"Failed test file: {input_file}")
+                with open(oracle_path(input_path)) as f:
+                    oracle = json.load(f)
+
+                output = DigestSink()
+                interface = Interface(robot=Robot(environment=Environment(oracle["width"], oracle["height"])),
+                                      output=output)
+                with open(input_path, "rb") as stream:
+                    self.assertEqual(run_stream(interface, stream), oracle["commands"])
+
+                self.assertEqual(output.hexdigest(), oracle["transcript_sha256"])
+                self.assertEqual(output.last_line, oracle["last_output"])
+                self.assertEqual(interface.error_count, oracle["errors"])
+                state = oracle["state"]
+                self.assertEqual((interface.robot.position.x, interface.robot.position.y,
+                                  interface.robot.f, interface.placed),
+                                 (state["x"], state["y"], state["f"], state["placed"]))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,227 @@
+"""
+Multi-Robot World Module
+------------------------
+
+This module implements a shared tabletop on which many robots move at once.
+Commands are routed to a robot by its ID:
+
+    ROBOT 17 PLACE,1,2,NORTH
+    ROBOT 17 MOVE
+    ROBOT 17 REPORT
+
+Each robot behaves like its own Interface, except that it cannot be placed on or
+move into a cell occupied by another robot. Occupied cells are kept in a hash
+index from cell to robot ID, which is updated in O(1) whenever a robot moves, so
+the collision check does not depend on the number of robots.
+
+Classes:
+    SharedEnvironment: One robot's view of the table, treating other robots as obstacles.
+    World: Routes commands to robots and maintains the occupancy index.
+"""
+
+
+import argparse
+import sys
+
+from robot import (STDOUT_SINK, BufferedSink, Direction, Environment, Interface, Robot, Status,
+                   open_command_stream, parse_int, run_stream)
+
+
+class SharedEnvironment:
+    """
+    One robot's view of a shared table, in which cells occupied by other
+    robots are not valid positions.
+
+    Attributes:
+        environment (Environment): The shared table.
+        occupancy (dict): Maps occupied cells (y * width + x) to robot IDs.
+        robot_id (int): The robot this view belongs to.
+    """
+
+    def __init__(self, environment, occupancy, robot_id):
+        """
+        Initialize the view.
+
+        Args:
+            environment (Environment): The shared table.
+            occupancy (dict): Maps occupied cells to robot IDs.
+            robot_id (int): The robot this view belongs to.
+        """
+        self.environment = environment
+        self.occupancy = occupancy
+        self.robot_id = robot_id
+
+    @property
+    def width(self):
+        """int: The width of the table."""
+        return self.environment.width
+
+    @property
+    def height(self):
+        """int: The height of the table."""
+        return self.environment.height
+
+    def is_valid_position(self, x, y):
+        """
+        Check if a position is on the table, unblocked and not occupied by
+        another robot.
+
+        Args:
+            x (int): The x-coordinate.
+            y (int): The y-coordinate.
+
+        Returns:
+            bool: True if the position is valid, False otherwise.
+        """
+        return (self.environment.is_valid_position(x, y)
+                and self.occupancy.get(y * self.environment.width + x, self.robot_id) == self.robot_id)
+
+    def free_distance(self, x, y, heading, limit):
+        """
+        Count how many consecutive steps can be taken without leaving the
+        table, entering an obstacle or running into another robot.
+
+        Args:
+            x (int): The starting x-coordinate.
+            y (int): The starting y-coordinate.
+            heading (int): The heading to move in.
+            limit (int): The maximum number of steps to count.
+
+        Returns:
+            int: The number of steps, at most limit.
+        """
+        distance = self.environment.free_distance(x, y, heading, limit)
+        width = self.environment.width
+        step = width * Direction.DY[heading] + Direction.DX[heading]
+        cell = y * width + x
+        for moved in range(distance):
+            cell += step
+            if self.occupancy.get(cell, self.robot_id) != self.robot_id:
+                return moved
+        return distance
+
+
+class World:
+    """
+    A shared table with many robots, addressed by ID.
+
+    Attributes:
+        environment (Environment): The shared table.
+        output: The sink that echoed commands, errors and reports are written to.
+        occupancy (dict): Maps occupied cells (y * width + x) to robot IDs.
+        interfaces (dict): Maps robot IDs to their Interface.
+        error_count (int): The number of commands that failed.
+    """
+
+    def __init__(self, environment, output=None):
+        """
+        Initialize an empty world.
+
+        Args:
+            environment (Environment): The shared table.
+            output: The sink to write to. Defaults to stdout.
+        """
+        self.environment = environment
+        self.output = output if output is not None else STDOUT_SINK
+        self.occupancy = {}
+        self.interfaces = {}
+        self.error_count = 0
+
+    def interface(self, robot_id):
+        """
+        Return the Interface of a robot, creating the robot if necessary.
+
+        Args:
+            robot_id (int): The robot ID.
+
+        Returns:
+            Interface: The robot's interface.
+        """
+        interface = self.interfaces.get(robot_id)
+        if interface is None:
+            view = SharedEnvironment(self.environment, self.occupancy, robot_id)
+            interface = Interface(robot=Robot(environment=view), output=self.output)
+            self.interfaces[robot_id] = interface
+        return interface
+
+    def run_command(self, robot_id, command):
+        """
+        Execute a command on one robot and keep the occupancy index up to date.
+
+        Args:
+            robot_id (int): The robot ID.
+            command (str): The command string, e.g. "MOVE".
+
+        Returns:
+            Status: The outcome of the command.
+        """
+        interface = self.interface(robot_id)
+        position = interface.robot.position
+        width = self.environment.width
+        before = position.y * width + position.x if interface.placed else None
+
+        status = interface.run_command(command)
+
+        position = interface.robot.position
+        after = position.y * width + position.x if interface.placed else None
+        if after != before:
+            if before is not None:
+                del self.occupancy[before]
+            self.occupancy[after] = robot_id
+        return status
+
+    def execute(self, line):
+        """
+        Execute a "ROBOT <id> <command>" line and write the line along with
+        any errors to the output sink.
+
+        Args:
+            line (str): The command line.
+        """
+        self.output.write(line)
+        parts = line.split(None, 2)
+        robot_id = parse_int(parts[1]) if len(parts) == 3 and parts[0] == "ROBOT" else None
+        if robot_id is None:
+            self.error_count += 1
+            self.output.write(f"Error: {Status.INVALID_COMMAND.message(line)}")
+            return
+        try:
+            status = self.run_command(robot_id, parts[2])
+        except Exception as e:
+            self.error_count += 1
+            self.output.write(f"Error: {e}")
+            return
+        if status:
+            self.error_count += 1
+            self.output.write(f"Error: {status.message(parts[2])}")
+
+    def execute_repeated(self, line, count):
+        """
+        Execute the same line count times, so that a World can be driven by
+        robot.run_stream().
+
+        Args:
+            line (str): The command line.
+            count (int): The number of times to execute it.
+        """
+        for _ in range(count):
+            self.execute(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-Robot Simulator")
+    parser.add_argument("command_file", help="Path to the command file, or '-' for stdin")
+    parser.add_argument("--width", type=int, default=5, help="Width of the table")
+    parser.add_argument("--height", type=int, default=5, help="Height of the table")
+
+    args = parser.parse_args()
+
+    output = BufferedSink(sys.stdout)
+    world = World(Environment(args.width, args.height), output=output)
+    try:
+        with open_command_stream(args.command_file) as stream:
+            run_stream(world, stream)
+    except FileNotFoundError:
+        print(f"Error: File '{args.command_file}' not found.")
+        sys.exit(1)
+    output.flush()